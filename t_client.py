@@ -3,20 +3,30 @@ import pygame
 import socket
 import threading
 import json
-import random
 from PIL import Image, ImageTk
 from tkinter import messagebox
 import time
 import os
+import heapq
+
+from t_protocol import (FrameDecoder, RECV_SIZE, BOARD_ENCODINGS, BOARD_ENCODING_PACKED,
+                        KEYFRAME_INTERVAL, encode_board, decode_board, board_changes,
+                        apply_board_changes, set_nodelay, write_frames, decode_snapshot,
+                        encode_message, decode_message)
+from t_engine import TetrisEngine, COLUMNS, ROWS
 
 # ============= Network Configuration =============
 HOST = '192.168.251.73'  # Server host address
 PORT = 5555         # Server port number
+BOARD_UPDATE_MIN_INTERVAL = 0.1   # Fastest board update rate (seconds between updates)
+BOARD_UPDATE_MAX_INTERVAL = 0.25  # Slowest rate, used on very high-latency links
+SEND_BATCH_INTERVAL = 0.016  # Seconds to collect outgoing messages into one write (one frame at 60 FPS)
+RECONNECT_MIN_DELAY = 0.25  # First wait before reconnecting after a drop (doubles per attempt)
+RECONNECT_MAX_DELAY = 2.0   # Longest wait between reconnect attempts
+LOBBY_DISPLAY_ROWS = 10     # Lobby players shown at once; the rest are summarised in one row
 
 # ============= Game Constants =============
 TILE_SIZE = 30      # Size of each block in pixels
-COLUMNS = 10        # Game board width
-ROWS = 20          # Game board height
 
 # ============= Local Storage Files =============
 SCORES_FILE = "playerscore.json"
@@ -58,16 +68,103 @@ class LinkedList:
             ll.insert(item["score"], item["timestamp"])
         return ll
 
-# ============= Tetris Piece Definitions =============
-# Each piece is defined by its shape matrix and color
-SHAPES = [
-    {"shape": [[1, 1, 1], [0, 1, 0]], "color": "purple"},   # T piece
-    {"shape": [[1, 1, 1, 1]], "color": "cyan"},             # I piece
-    {"shape": [[1, 1], [1, 1]], "color": "yellow"},         # O piece
-    {"shape": [[0, 1, 1], [1, 1, 0]], "color": "green"},    # S piece
-    {"shape": [[1, 1, 0], [0, 1, 1]], "color": "red"},      # Z piece
-    {"shape": [[1, 0], [1, 0],[1, 1]], "color": "orange"},  # L piece
-]
+# ============= Board Rendering =============
+class BoardRenderer:
+    """
+    Retained-mode drawing of one board canvas
+    The grid lines, a pool of ROWS x COLUMNS tiles and the ghost outline are
+    created once. Each render compares the wanted colour of every cell with
+    the last one drawn and only reconfigures the tiles that changed, instead
+    of deleting and re-creating every item each frame.
+    """
+
+    def __init__(self, canvas, draw_tile, grid_color="#444444", grid_on_top=False):
+        """
+        Args:
+            canvas: Board canvas (COLUMNS*TILE_SIZE x ROWS*TILE_SIZE)
+            draw_tile: Function (canvas, x, y, color, **options) creating one tile's items
+            grid_color: Colour of the grid lines
+            grid_on_top: Draw the grid over the tiles instead of under them
+        """
+        self.canvas = canvas
+        self.colors = [0] * (ROWS * COLUMNS)  # Colour each tile shows (0 = hidden)
+        self.tiles = []  # Per cell: the tag shared by its items and the item taking the colour
+        for y in range(ROWS):
+            for x in range(COLUMNS):
+                tag = f"tile{y * COLUMNS + x}"
+                items = draw_tile(canvas, x, y, "", tags=(tag,), state='hidden')
+                self.tiles.append((tag, items[0]))
+        for i in range(COLUMNS + 1):
+            canvas.create_line(i * TILE_SIZE, 0, i * TILE_SIZE, ROWS * TILE_SIZE,
+                               fill=grid_color, width=1, tags=("grid",))
+        for i in range(ROWS + 1):
+            canvas.create_line(0, i * TILE_SIZE, COLUMNS * TILE_SIZE, i * TILE_SIZE,
+                               fill=grid_color, width=1, tags=("grid",))
+        if not grid_on_top:
+            canvas.tag_lower("grid")
+        self.ghost = [canvas.create_rectangle(0, 0, 0, 0, outline="", width=2, state='hidden')
+                      for _ in range(4)]
+        self.ghost_cells = []  # (x, y, color) of each visible ghost outline
+        self.packed = None  # Last packed board string drawn, to skip unchanged updates
+        self.piece = None
+
+    def render(self, board, piece=None, ghost_y=None):
+        """
+        Show a board, optionally with a falling piece and its landing outline
+        Args:
+            board: List of rows of 0/colour, or a packed string from encode_board
+            piece: Piece dict ('shape', 'color', 'x', 'y') drawn over the board
+            ghost_y: Row where the piece would land, or None for no ghost
+        """
+        if isinstance(board, str):
+            if board == self.packed and piece == self.piece and ghost_y is None:
+                return
+            self.packed = board
+            self.piece = piece and dict(piece)
+            board = decode_board(board)
+        else:
+            self.packed = None
+
+        colors = [cell for row in board for cell in row]
+        piece_cells = []
+        if piece:
+            color = piece['color']
+            for y, row in enumerate(piece['shape']):
+                py = piece['y'] + y
+                for x, val in enumerate(row):
+                    px = piece['x'] + x
+                    if val and 0 <= py < ROWS and 0 <= px < COLUMNS:
+                        colors[py * COLUMNS + px] = color
+                        piece_cells.append((px, py))
+
+        canvas = self.canvas
+        last = self.colors
+        for i, color in enumerate(colors):
+            if color != last[i]:
+                tag, block = self.tiles[i]
+                if color:
+                    canvas.itemconfigure(block, fill=color)
+                    if not last[i]:
+                        canvas.itemconfigure(tag, state='normal')
+                else:
+                    canvas.itemconfigure(tag, state='hidden')
+        self.colors = colors
+
+        ghost_cells = []
+        if piece and ghost_y is not None and ghost_y != piece['y']:
+            offset = ghost_y - piece['y']
+            ghost_cells = [(x, y + offset, piece['color']) for x, y in piece_cells
+                           if (x, y + offset) not in piece_cells and y + offset < ROWS]
+        if ghost_cells != self.ghost_cells:
+            for item, cell in zip(self.ghost, ghost_cells + [None] * (4 - len(ghost_cells))):
+                if cell is None:
+                    canvas.itemconfigure(item, state='hidden')
+                    continue
+                x, y, color = cell
+                canvas.coords(item, x * TILE_SIZE + 2, y * TILE_SIZE + 2,
+                              (x + 1) * TILE_SIZE - 2, (y + 1) * TILE_SIZE - 2)
+                canvas.itemconfigure(item, outline=color, state='normal')
+            self.ghost_cells = ghost_cells
 
 class TetrisClient:
     """
@@ -91,30 +188,41 @@ class TetrisClient:
         self.root.geometry(f"{window_width}x{window_height}+{x}+{y}")
         
         # ============= Game State Initialization =============
-        self.next_queue = [self.new_piece() for _ in range(3)]  # Queue for next pieces
+        self.engine = TetrisEngine()  # Board, pieces, scoring and level of the current game
         self.username = None
         self.opponent_name = "OPPONENT"
         self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.conn.connect((HOST, PORT))
+        set_nodelay(self.conn)
+        self.outbox = []  # Encoded messages waiting for the next batched write
+        self.outbox_cond = threading.Condition()
+        self.write_lock = threading.Lock()  # One writer on the socket at a time (batches and send_now)
+        self.session_token = None  # Issued by the server; lets a dropped match be resumed
+        self.session_grace = 0     # Seconds the server holds the match after a drop
+        self.lobby_players = {}    # username -> lobby entry, kept current by 'lobby_diff'
+        self.lobby_version = None  # Version of lobby_players, None until a snapshot arrives
+        self.lobby_requested = False  # A snapshot request is in flight after a missed diff
+        self.lobby_labels = []     # Reused player rows of the lobby screen
+        threading.Thread(target=self.send_loop, daemon=True).start()
         self.running = False
         self.paused = False
-        self.hold_piece = None
-        self.hold_used = False
         
         # Add state tracking for board updates
         self.prev_board_state = [[0]*COLUMNS for _ in range(ROWS)]
         self.prev_piece_state = {}
         self.last_board_update = 0
-        self.board_update_interval = 0.1  # 100ms minimum between updates
+        self.board_update_interval = BOARD_UPDATE_MIN_INTERVAL  # Tuned from the server-measured RTT
+        self.rtt = None  # Smoothed round-trip time to the server in seconds
+        self.board_encoding = None  # Negotiated with the server via 'hello'
+        self.board_delta = False    # Send only changed cells between keyframes
+        self.board_seq = 0
+        self.keyframe_requested = True
+        self.opponent_board = None  # Last known opponent board (list of rows or packed string)
+        self.opponent_board_seq = None
+        self.opponent_piece = None
+        self.keyframe_pending = False
         
-        # ============= Scoring System Initialization =============
-        self.score = 0
-        self.level = 1
-        self.total_lines_cleared = 0
-        self.combo = 0
-        self.last_clear_was_tetris = False
-        self.soft_drop_points = 0
-        self.hard_drop_points = 0
+        # ============= Score History =============
         self.score_history = LinkedList()
         
         # Load existing scores and leaderboard
@@ -242,9 +350,12 @@ class TetrisClient:
     def join_lobby(self):
         self.username = self.name_entry.get()
         if self.username:
-            self.conn.send(self.username.encode())
+            self.send_frame(self.username.encode() + b'\n')
+            # Offer the compact board encodings this client understands
+            self.send_message({"type": "hello", "board_encodings": list(BOARD_ENCODINGS),
+                               "board_delta": True})
             self.lobby_screen()
-            self.conn.send(json.dumps({"type": "request_lobby"}).encode() + b'\n')
+            self.send_message({"type": "request_lobby"})
             
     def lobby_screen(self):
         self.clear_window()
@@ -273,6 +384,7 @@ class TetrisClient:
         # Players frame
         self.players_frame = tk.Frame(self.lobby_box, bg='#04143f')
         self.players_frame.pack(pady=(0, 10))
+        self.lobby_labels = []
 
         # Ready button
         self.ready = False
@@ -292,53 +404,243 @@ class TetrisClient:
     def toggle_ready(self):
         self.ready = not self.ready
         msg = {"type": "ready", "ready": self.ready}
-        self.conn.send(json.dumps(msg).encode())
+        self.send_message(msg)
         self.ready_button.config(text="Unready" if self.ready else "Ready")
         
+    def send_message(self, message):
+        """Queue a message for the server; it goes out with the rest of this tick's messages"""
+        self.send_frame(encode_message(message))
+
+    def send_now(self, message):
+        """
+        Write a message straight to the socket instead of batching it
+        For heartbeat replies: time spent waiting for the next batch would be
+        counted in the RTT the server measures.
+        """
+        try:
+            with self.write_lock:
+                write_frames(self.conn, [encode_message(message)])
+        except OSError as e:
+            # The listener notices the drop and reconnects
+            print(f"Failed to send to server: {e}")
+
+    def send_frame(self, data):
+        """Queue raw frame bytes (already newline-terminated)"""
+        with self.outbox_cond:
+            self.outbox.append(data)
+            if len(self.outbox) == 1:
+                self.outbox_cond.notify()
+
+    def send_loop(self):
+        """Flush queued messages once per SEND_BATCH_INTERVAL with a single vectored write"""
+        while True:
+            with self.outbox_cond:
+                while not self.outbox:
+                    self.outbox_cond.wait()
+            # Let the rest of this tick's messages (e.g. score + board) join the batch
+            time.sleep(SEND_BATCH_INTERVAL)
+            with self.outbox_cond:
+                frames = self.outbox
+                self.outbox = []
+            try:
+                with self.write_lock:
+                    write_frames(self.conn, frames)
+            except OSError as e:
+                # The listener notices the drop and reconnects; this batch is lost
+                print(f"Failed to send to server: {e}")
+
+    def reconnect(self):
+        """
+        Reconnect after the connection dropped mid-match and ask to resume the session
+        Retries with backoff until the server's grace window would have run out
+        Returns:
+            True if a new connection is open (the server answers with 'resume'
+            or 'resume_failed'), False if there is nothing to resume
+        """
+        if not self.session_token or not self.running:
+            return False
+        deadline = time.time() + self.session_grace
+        delay = RECONNECT_MIN_DELAY
+        while time.time() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            try:
+                conn = socket.create_connection((HOST, PORT), timeout=RECONNECT_MAX_DELAY)
+            except OSError as e:
+                print(f"Reconnect failed: {e}")
+                continue
+            conn.settimeout(None)
+            set_nodelay(conn)
+            resume = {"type": "resume", "token": self.session_token, "username": self.username}
+            hello = {"type": "hello", "board_encodings": list(BOARD_ENCODINGS), "board_delta": True}
+            with self.outbox_cond, self.write_lock:
+                # Release the dead socket's descriptor; no writer is using it under the lock
+                try:
+                    self.conn.close()
+                except OSError:
+                    pass
+                # Anything still queued was meant for the old connection
+                self.conn = conn
+                self.outbox = [encode_message(resume), encode_message(hello)]
+                self.outbox_cond.notify()
+            print("Reconnected, resuming session")
+            return True
+        return False
+
     def listen_server(self):
-        buffer = ""
+        decoder = FrameDecoder()
         last_update_time = 0
         update_interval = 1/60  # 60 FPS
+
+        def redraw_opponent():
+            nonlocal last_update_time
+            current_time = time.time()
+            if current_time - last_update_time >= update_interval:
+                if hasattr(self, 'opponent_canvas') and self.opponent_canvas.winfo_exists():
+                    try:
+                        self.draw_board(self.opponent_canvas, self.opponent_board, self.opponent_piece)
+                    except ValueError as e:
+                        print("Skipping malformed board:", e)
+                last_update_time = current_time
         
         while True:
             try:
-                data = self.conn.recv(4096)
+                data = self.conn.recv(RECV_SIZE)
                 if not data:
+                    if self.reconnect():
+                        decoder = FrameDecoder()
+                        continue
                     break
-                buffer += data.decode()
 
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
+                for line in decoder.feed(data):
                     if not line.strip():
                         continue
-                    msg = json.loads(line)
+                    msg = decode_message(line)
 
-                    if msg['type'] == 'lobby' and hasattr(self, 'players_frame') and self.players_frame.winfo_exists():
-                        self.update_lobby(msg['players'])
-                        # Set opponent name from the player list
+                    if msg['type'] == 'lobby':
+                        # Snapshot, possibly over several pages
+                        if msg.get('page', 0) == 0:
+                            self.lobby_players = {}
+                        for p in msg['players']:
+                            self.lobby_players[p['name']] = p
+                        if msg.get('page', 0) + 1 >= msg.get('pages', 1):
+                            self.lobby_version = msg.get('version')
+                            self.lobby_requested = False
+                            self.refresh_lobby()
+
+                    elif msg['type'] == 'lobby_diff':
+                        if self.lobby_version is None or msg['version'] != self.lobby_version + 1:
+                            # Missed a diff: start over from a snapshot (asked for once)
+                            if not self.lobby_requested:
+                                self.lobby_requested = True
+                                self.send_message({"type": "request_lobby"})
+                            continue
+                        for name in msg['removed']:
+                            self.lobby_players.pop(name, None)
                         for p in msg['players']:
-                            if p['name'] != self.username:
-                                self.opponent_name = p['name']
+                            self.lobby_players[p['name']] = p
+                        self.lobby_version = msg['version']
+                        self.refresh_lobby()
 
                     elif msg['type'] == 'start':
+                        # The server pairs players into rooms and names the opponent
+                        if msg.get('opponent'):
+                            self.opponent_name = msg['opponent']
                         self.show_countdown_and_start()
 
                     elif msg['type'] == 'score':
                         if hasattr(self, 'opponent_score_box') and self.opponent_score_box.winfo_exists():
                             self.opponent_score_box.config(text=str(msg['value']))
-                        players_scores = [(self.username, self.score), (self.opponent_name, msg['value'])]
+                        players_scores = [(self.username, self.engine.score), (self.opponent_name, msg['value'])]
                         self.update_leaderboard(players_scores)
 
+                    elif msg['type'] == 'ping':
+                        # Heartbeat: answer at once, outside the batch; the server reports the RTT it measured
+                        self.send_now({"type": "pong", "id": msg.get('id')})
+                        if msg.get('rtt') is not None:
+                            self.rtt = msg['rtt'] / 1000
+                            # No point sending updates faster than they can make a round trip
+                            self.board_update_interval = min(BOARD_UPDATE_MAX_INTERVAL,
+                                                             max(BOARD_UPDATE_MIN_INTERVAL, self.rtt))
+
+                    elif msg['type'] == 'leaderboard':
+                        # Server leaderboard replaces the local one in an open popup
+                        listbox = getattr(self, 'leaderboard_popup_list', None)
+                        if msg.get('total') and listbox is not None and listbox.winfo_exists():
+                            self.fill_leaderboard_list(listbox, [
+                                (e['rank'], e['name'], e['score']) for e in msg['entries']])
+
+                    elif msg['type'] == 'leaderboard_rank':
+                        label = getattr(self, 'leaderboard_rank_label', None)
+                        if msg.get('rank') and label is not None and label.winfo_exists():
+                            label.config(text=f"Your rank: #{msg['rank']} of {msg['total']} ({msg['score']:,})")
+
+                    elif msg['type'] == 'hello':
+                        self.board_encoding = msg.get('board_encoding')
+                        self.board_delta = msg.get('board_delta', False)
+
+                    elif msg['type'] == 'session':
+                        self.session_token = msg.get('token')
+                        self.session_grace = msg.get('grace') or 0
+
+                    elif msg['type'] == 'resume':
+                        # Back in the match: one snapshot restores what we missed
+                        snapshot = decode_snapshot(msg['snapshot'])
+                        for name, player in snapshot['players'].items():
+                            if name == self.username:
+                                continue
+                            self.opponent_name = name
+                            self.opponent_board = player['board']  # Packed string, or None
+                            self.opponent_board_seq = player['seq']
+                            self.opponent_piece = player['current_piece']
+                            self.keyframe_pending = False
+                            if (player['score'] is not None and hasattr(self, 'opponent_score_box')
+                                    and self.opponent_score_box.winfo_exists()):
+                                self.opponent_score_box.config(text=str(player['score']))
+                            redraw_opponent()
+                        # Updates sent just before the drop may be lost; resend board and score in full
+                        self.keyframe_requested = True
+                        self.send_message({"type": "score", "value": self.engine.score, "level": self.engine.level})
+                        if not msg.get('in_progress') and msg.get('winner') and self.running:
+                            # The game ended while we were away
+                            self.running = False
+                            self.show_end_screen("🎉 You Win!" if msg['winner'] == self.username
+                                                 else "💀 You Lose!")
+
+                    elif msg['type'] == 'resume_failed':
+                        # The match is gone; the server took us back as a new lobby player
+                        self.session_token = None
+                        if self.running:
+                            self.running = False
+                            self.lobby_screen()
+                            self.send_message({"type": "request_lobby"})
+
                     elif msg['type'] == 'board':
-                        current_time = time.time()
-                        if current_time - last_update_time >= update_interval:
-                            if hasattr(self, 'opponent_canvas') and self.opponent_canvas.winfo_exists():
-                                self.draw_board(
-                                    self.opponent_canvas,
-                                    msg['board'],
-                                    msg.get('current_piece')
-                                )
-                            last_update_time = current_time
+                        # Keyframe: packed boards stay as a string until something needs the cells
+                        self.opponent_board = msg['cells'] if msg.get('encoding') == BOARD_ENCODING_PACKED else msg['board']
+                        self.opponent_board_seq = msg.get('seq')
+                        self.opponent_piece = msg.get('current_piece')
+                        self.keyframe_pending = False
+                        redraw_opponent()
+
+                    elif msg['type'] == 'board_delta':
+                        seq = msg.get('seq')
+                        if (self.opponent_board is None or self.opponent_board_seq is None
+                                or seq != self.opponent_board_seq + 1):
+                            # Missed an update; ask once for a keyframe and skip deltas until it arrives
+                            if not self.keyframe_pending:
+                                self.keyframe_pending = True
+                                self.send_message({"type": "keyframe_request"})
+                            continue
+                        if isinstance(self.opponent_board, str):
+                            self.opponent_board = decode_board(self.opponent_board)
+                        apply_board_changes(self.opponent_board, msg['changes'])
+                        self.opponent_board_seq = seq
+                        self.opponent_piece = msg.get('current_piece')
+                        redraw_opponent()
+
+                    elif msg['type'] == 'keyframe_request':
+                        self.keyframe_requested = True
 
                     elif msg['type'] == 'chat':
                         self.display_chat_message(msg['from'], msg['message'])
@@ -397,25 +699,15 @@ class TetrisClient:
 
                     elif msg['type'] == 'rematch_accepted':
                         # Reset game state and return to lobby
-                        self.score = 0
-                        self.level = 1
-                        self.total_lines_cleared = 0
-                        self.combo = 0
-                        self.last_clear_was_tetris = False
-                        self.soft_drop_points = 0
-                        self.hard_drop_points = 0
-                        self.board = [[0]*COLUMNS for _ in range(ROWS)]
-                        self.next_queue = [self.new_piece() for _ in range(3)]
-                        self.current_piece = self.next_queue.pop(0)
-                        self.current_piece['x'] = COLUMNS // 2 - 1
-                        self.current_piece['y'] = 0
-                        self.hold_piece = None
-                        self.hold_used = False
+                        self.engine.reset()
                         self.lobby_screen()
-                        self.conn.send(json.dumps({"type": "request_lobby"}).encode() + b'\n')
+                        self.send_message({"type": "request_lobby"})
 
             except Exception as e:
                 print("Error in client listener:", e)
+                if isinstance(e, OSError) and self.reconnect():
+                    decoder = FrameDecoder()
+                    continue
                 break
 
     def show_countdown_and_start(self):
@@ -447,26 +739,58 @@ class TetrisClient:
         self.root.after(1000, update_countdown, 2)  # Already showed 3, continue with 2, 1...
 
 
-    def update_lobby(self, players):
-        # Clear existing players display
-        for widget in self.players_frame.winfo_children():
-            widget.destroy()
-        
-        # Display each player's status
-        for player in players:
-            text = f"{player['name']} - {'Ready' if player['ready'] else 'Not Ready'}"
-            label = tk.Label(self.players_frame, text=text, font=('Arial', 18), 
+    def refresh_lobby(self):
+        """Show the first LOBBY_DISPLAY_ROWS lobby players (not ready first, then by name)"""
+        if not (hasattr(self, 'players_frame') and self.players_frame.winfo_exists()):
+            return
+        players = self.lobby_players.values()
+        shown = heapq.nsmallest(LOBBY_DISPLAY_ROWS, players, key=lambda p: (p['ready'], p['name']))
+        ready_count = sum(1 for p in players if p['ready'])
+        self.update_lobby(shown, len(self.lobby_players), ready_count)
+        # Set opponent name from the player list
+        for p in shown:
+            if p['name'] != self.username:
+                self.opponent_name = p['name']
+
+    def update_lobby(self, players, total=None, ready_count=None):
+        """
+        Show lobby players, reusing the row labels from the previous update
+        Args:
+            players: Entries to show
+            total: Players in the whole lobby (defaults to len(players))
+            ready_count: Ready players in the whole lobby
+        """
+        total = len(players) if total is None else total
+        if ready_count is None:
+            ready_count = sum(1 for player in players if player['ready'])
+        rows = [f"{player['name']} - {'Ready' if player['ready'] else 'Not Ready'}" for player in players]
+        if total > len(players):
+            rows.append(f"... and {total - len(players)} more")
+
+        # Grow the label pool as needed and only touch rows whose text changed
+        while len(self.lobby_labels) < len(rows):
+            label = tk.Label(self.players_frame, text="", font=('Arial', 18),
                            fg='white', bg='#34495E', anchor='center', 
                            width=30, justify='center')
-            label.pack(pady=5, padx=10)
+            self.lobby_labels.append(label)
+        for i, label in enumerate(self.lobby_labels):
+            if i < len(rows):
+                if label.cget('text') != rows[i]:
+                    label.config(text=rows[i])
+                if not label.winfo_manager():
+                    label.pack(pady=5, padx=10)
+            elif label.winfo_manager():
+                label.pack_forget()
 
         # Update status label based on number of players
-        if len(players) < 2:
-            self.status_label.config(text="Waiting for opponent...")
-        elif all(player['ready'] for player in players):
-            self.status_label.config(text="Both players ready! Game starting soon...")
+        if total < 2:
+            status = "Waiting for opponent..."
+        elif ready_count == total:
+            status = "Both players ready! Game starting soon..."
         else:
-            self.status_label.config(text="Waiting for opponent to be ready...")
+            status = "Waiting for opponent to be ready..."
+        if self.status_label.cget('text') != status:
+            self.status_label.config(text=status)
 
     def start_game(self):
         self.clear_window()
@@ -505,6 +829,7 @@ class TetrisClient:
   # Game board canvas (unchanged size)
         self.canvas = tk.Canvas(player_frame, width=COLUMNS*TILE_SIZE, height=ROWS*TILE_SIZE, bg='black', highlightthickness=2, highlightbackground="#ffd369")
         self.canvas.pack()
+        self.canvas.board_renderer = BoardRenderer(self.canvas, self.draw_tile, grid_color="gray", grid_on_top=True)
 
         # Next/Hold panel
         side_panel = tk.Frame(main_frame, bg="#393e46")
@@ -611,22 +936,24 @@ class TetrisClient:
         self.tooltip_label.place_forget()  # Hide initially
 
         # --- Game logic setup ---
-        self.board = [[0]*COLUMNS for _ in range(ROWS)]
-        self.current_piece = self.next_queue.pop(0)
-        self.current_piece['x'] = COLUMNS // 2 - 1
-        self.current_piece['y'] = 0
-        self.next_queue.append(self.new_piece())
-        self.hold_piece = None
-        self.hold_used = False
-        self.score = 0
+        self.engine.reset()
         self.running = True
 
+        # Board sync starts over with a keyframe each match
+        self.prev_board_state = [[0]*COLUMNS for _ in range(ROWS)]
+        self.board_seq = 0
+        self.keyframe_requested = True
+        self.opponent_board = None
+        self.opponent_board_seq = None
+        self.opponent_piece = None
+        self.keyframe_pending = False
+
         self.root.bind("<Key>", self.key_press)
 
         # Add leaderboard setup here
         self.setup_leaderboard()
         self.update_leaderboard([
-            (self.username or "You", self.score),
+            (self.username or "You", self.engine.score),
             (self.opponent_name, 0)
         ])
         self.game_loop()
@@ -775,11 +1102,11 @@ class TetrisClient:
         if message:
             try:
             # Send message to server
-                self.conn.send(json.dumps({
+                self.send_message({
                 'type': 'chat',
                 'from': self.username, 
                 'message': message
-            }).encode())
+            })
             # Clear the entry
                 self.chat_entry.delete(0, tk.END)
             except Exception as e:
@@ -798,224 +1125,98 @@ class TetrisClient:
             self.chat_log.config(state='disabled')
         except Exception as e:
             print(f"Error displaying chat message: {e}")
-# QUEUE
-    def new_piece(self):
-        piece = random.choice(SHAPES)
-        return {"shape": piece["shape"], "color": piece["color"], "x": COLUMNS // 2 - 1, "y": 0}
-    
-    def draw_tile(self, canvas, x, y, color):
-        """Draw a single tile"""
+    def draw_tile(self, canvas, x, y, color, **options):
+        """
+        Draw a single tile
+        Extra options (e.g. tags, state) are passed to every item it creates
+        Returns:
+            Item ids, the coloured main block first
+        """
         # Main block
-        canvas.create_rectangle(
+        block = canvas.create_rectangle(
             x * TILE_SIZE, y * TILE_SIZE,
             (x + 1) * TILE_SIZE, (y + 1) * TILE_SIZE,
-            fill=color, outline="#444444", width=1
+            fill=color, outline="#444444", width=1, **options
         )
         # Shine stripe (top left)
-        canvas.create_rectangle(
+        shine = canvas.create_rectangle(
             x * TILE_SIZE + 2, y * TILE_SIZE + 2,
             x * TILE_SIZE + TILE_SIZE // 2, y * TILE_SIZE + 6,
-            fill="white", outline="", stipple="gray25"
+            fill="white", outline="", stipple="gray25", **options
         )
         # Shadow stripe (bottom right)
-        canvas.create_rectangle(
+        shadow = canvas.create_rectangle(
             x * TILE_SIZE + TILE_SIZE // 2, y * TILE_SIZE + TILE_SIZE - 6,
             (x + 1) * TILE_SIZE - 2, (y + 1) * TILE_SIZE - 2,
-            fill="#222831", outline="", stipple="gray25"
+            fill="#222831", outline="", stipple="gray25", **options
         )
         # Subtle border
-        canvas.create_rectangle(
+        border = canvas.create_rectangle(
             x * TILE_SIZE, y * TILE_SIZE,
             (x + 1) * TILE_SIZE, (y + 1) * TILE_SIZE,
-            outline="#888888", width=1
+            outline="#888888", width=1, **options
         )
+        return [block, shine, shadow, border]
 
-    def draw_board(self, canvas, board, piece=None):
-        """Draw the game board with optimized rendering"""
+    def draw_board(self, canvas, board, piece=None, ghost_y=None):
+        """Draw the game board, updating only the tiles that changed
+        board may be a list of rows or a packed string from encode_board"""
         if not canvas.winfo_exists():
             return
-            
-        # Store the current state to prevent unnecessary redraws
-        if not hasattr(self, '_last_board_state'):
-            self._last_board_state = {}
-            
-        # Create a unique key for this canvas
-        canvas_id = str(canvas)
-        
-        # Check if the board state has changed
-        current_state = (str(board), str(piece) if piece else None)
-        if canvas_id in self._last_board_state and self._last_board_state[canvas_id] == current_state:
-            return
-            
-        # Update the stored state
-        self._last_board_state[canvas_id] = current_state
-        
-        # Clear the canvas
-        canvas.delete("all")
-        
-        # Draw grid
-        for i in range(COLUMNS + 1):
-            canvas.create_line(
-                i * TILE_SIZE, 0,
-                i * TILE_SIZE, ROWS * TILE_SIZE,
-                fill="#444444",
-                width=1
-            )
-        for i in range(ROWS + 1):
-            canvas.create_line(
-                0, i * TILE_SIZE,
-                COLUMNS * TILE_SIZE, i * TILE_SIZE,
-                fill="#444444",
-                width=1
-            )
-        
-        # Draw the board pieces
-        for y in range(ROWS):
-            for x in range(COLUMNS):
-                if board[y][x]:
-                    self.draw_tile(canvas, x, y, board[y][x])
-        
-        # Draw current piece if provided
-        if piece:
-            for y, row in enumerate(piece['shape']):
-                for x, val in enumerate(row):
-                    if val:
-                        self.draw_tile(canvas, piece['x'] + x, piece['y'] + y, piece['color'])
+        # Each canvas keeps its renderer (and so its item pool) for its lifetime
+        renderer = getattr(canvas, 'board_renderer', None)
+        if renderer is None:
+            renderer = canvas.board_renderer = BoardRenderer(canvas, self.draw_tile)
+        renderer.render(board, piece, ghost_y)
         
         # Update the canvas
         canvas.update_idletasks()
 
-    def draw_next(self):
-            self.next_canvas1.delete("all")
-            self.next_canvas2.delete("all")
-            self.next_canvas3.delete("all")
-            next_canvases = [self.next_canvas1, self.next_canvas2, self.next_canvas3]
-            for idx, piece in enumerate(self.next_queue):
-                    canvas = next_canvases[idx]
-                    for y, row in enumerate(piece['shape']):
-                            for x, val in enumerate(row):
-                                    if val:
-                                            canvas.create_rectangle(x*20, y*20, (x+1)*20, (y+1)*20, fill=piece["color"], outline="white")
-    def draw_hold(self):
-        self.hold_canvas.delete("all")
-        if not self.hold_piece:
+    def draw_preview(self, canvas, piece):
+        """Draw a piece in a NEXT/HOLD box, only when it differs from what the box shows"""
+        key = (piece['color'], piece['shape']) if piece else None
+        if getattr(canvas, 'preview_key', False) == key:
+            return
+        canvas.preview_key = key
+        canvas.delete("all")
+        if not piece:
             return
-        for y, row in enumerate(self.hold_piece['shape']):
+        for y, row in enumerate(piece['shape']):
             for x, val in enumerate(row):
                 if val:
-                    self.hold_canvas.create_rectangle(x*20, y*20, (x+1)*20, (y+1)*20, fill=self.hold_piece["color"], outline="white")
+                    canvas.create_rectangle(x*20, y*20, (x+1)*20, (y+1)*20, fill=piece["color"], outline="white")
+
+    def draw_next(self):
+        next_canvases = [self.next_canvas1, self.next_canvas2, self.next_canvas3]
+        for canvas, piece in zip(next_canvases, self.engine.next_queue):
+            self.draw_preview(canvas, piece)
+
+    def draw_hold(self):
+        self.draw_preview(self.hold_canvas, self.engine.hold_piece)
 
     def draw(self):
-        self.canvas.delete("all")
-        for y in range(ROWS):
-            for x in range(COLUMNS):
-                if self.board[y][x]:
-                    self.draw_tile(self.canvas, x, y, self.board[y][x])
-        for y, row in enumerate(self.current_piece['shape']):
-            for x, val in enumerate(row):
-                if val:
-                    self.draw_tile(self.canvas, self.current_piece['x'] + x, self.current_piece['y'] + y, self.current_piece["color"])
-        for i in range(COLUMNS + 1):
-            self.canvas.create_line(i * TILE_SIZE, 0, i * TILE_SIZE, ROWS * TILE_SIZE, fill="gray")
-        for i in range(ROWS + 1):
-            self.canvas.create_line(0, i * TILE_SIZE, COLUMNS * TILE_SIZE, i * TILE_SIZE, fill="gray")
+        # The ghost's landing row comes straight from the engine's column heights
+        self.draw_board(self.canvas, self.engine.board, self.engine.current_piece, self.engine.ghost_y())
         self.draw_next()
         self.draw_hold()
 
     def move(self, dx, dy):
         if dy == 1:  # Soft drop
-            self.soft_drop_points += 1
             self.drop_sound.play()
-        self.current_piece['x'] += dx
-        self.current_piece['y'] += dy
-        if self.collision():
-            self.current_piece['x'] -= dx
-            self.current_piece['y'] -= dy
-            if dy == 1:
-                self.soft_drop_points -= 1  # Undo if move failed
-            return False
-        return True
+        return self.engine.move(dx, dy)
     
     def rotate(self):
-        shape = self.current_piece['shape']
-        rotated = list(zip(*shape[::-1]))
-        self.current_piece['shape'] = rotated
-        if self.collision():
-            self.current_piece['shape'] = shape
-
-    def collision(self):
-        shape = self.current_piece['shape']
-        for y, row in enumerate(shape):
-            for x, val in enumerate(row):
-                if val:
-                    px = self.current_piece['x'] + x
-                    py = self.current_piece['y'] + y
-                    if px < 0 or px >= COLUMNS or py >= ROWS or (py >= 0 and self.board[py][px]):
-                        return True
-        return False
+        self.engine.rotate()
 
     def freeze(self):
-        shape = self.current_piece['shape']
-        for y, row in enumerate(shape):
-            for x, val in enumerate(row):
-                if val:
-                    px = self.current_piece['x'] + x
-                    py = self.current_piece['y'] + y
-                    if 0 <= py < ROWS:
-                        self.board[py][px] = self.current_piece["color"]
-        self.clear_lines()
-        self.current_piece = self.next_queue.pop(0)
-        self.current_piece['x'] = COLUMNS // 2 - 1
-        self.current_piece['y'] = 0
-        self.next_queue.append(self.new_piece())
-        self.hold_used = False
-        if self.collision():
-            self.running = False
-            try:
-                # Send lose message to server
-                self.conn.send(json.dumps({"type": "lose"}).encode() + b'\n')
-                # Show game over screen immediately
-                self.show_end_screen("💀 You Lose!")
-            except Exception as e:
-                print(f"Failed to send lose message: {e}")
-                # Still show game over screen even if message fails
-                self.show_end_screen("💀 You Lose!")
+        self.piece_locked(self.engine.freeze())
 
-    def clear_lines(self):
+    def piece_locked(self, lines_cleared):
         """
-        Handle line clearing and scoring system
-        - Removes completed lines
-        - Updates score based on lines cleared
-        - Applies combo and Tetris bonuses
-        - Updates level based on total lines cleared
+        Sound, score display and network updates after the engine locked a piece
+        Args:
+            lines_cleared: Lines cleared by the lock
         """
-        score_gained = 0 
-        lines_cleared = 0
-        new_board = []
-        
-        # Check for and remove completed lines
-        for row in self.board:
-            if all(row):
-                lines_cleared += 1
-            else:
-                new_board.append(row)
-        
-        # Add new empty lines at top
-        for _ in range(lines_cleared):
-            new_board.insert(0, [0]*COLUMNS)
-        self.board = new_board
-        
-        # Update total lines and level
-        self.total_lines_cleared += lines_cleared
-        self.level = self.total_lines_cleared // 10 + 1
-        
-        # Calculate score multiplier based on level
-        multiplier = 1 + (self.level - 1) * 0.1
-        
-        # Base scores for different line clears
-        base_scores = {1: 100, 2: 300, 3: 500, 4: 800}
-        
-        # Handle line clear sound and scoring
         if lines_cleared > 0:
             # Play clear sound
             if not self.clear_line_channel.get_busy():
@@ -1023,42 +1224,30 @@ class TetrisClient:
             else:
                 self.clear_line_channel.stop()
                 self.clear_line_channel.play(self.clear_sound)
-            
-            # Calculate score with bonuses
-            if lines_cleared == 4:  # Tetris
-                if self.last_clear_was_tetris:
-                    score_gained += 400 * multiplier  # Back-to-back Tetris bonus
-                self.last_clear_was_tetris = True
-            else:
-                self.last_clear_was_tetris = False
-            
-            # Add combo bonus
-            if self.combo > 0:
-                score_gained += 50 * self.combo * multiplier
-            self.combo += 1
-            
-            self.score += int(score_gained)
-        else:
-            self.combo = 0
-            self.last_clear_was_tetris = False
-        
-        # Add drop points
-        self.score += int(self.soft_drop_points * multiplier)
-        self.score += int(self.hard_drop_points * multiplier)
-        self.soft_drop_points = 0
-        self.hard_drop_points = 0
-        
+
         # Track score in history
         current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-        self.score_history.insert(self.score, current_time)
+        self.score_history.insert(self.engine.score, current_time)
         
         # Update display and send score to server
-        self.score_box.config(text=str(self.score))
-        self.conn.send(json.dumps({
+        self.score_box.config(text=str(self.engine.score))
+        self.send_message({
             "type": "score",
-            "value": self.score,
-            "level": self.level
-        }).encode())
+            "value": self.engine.score,
+            "level": self.engine.level
+        })
+
+        if self.engine.game_over:
+            self.running = False
+            try:
+                # Send lose message to server
+                self.send_message({"type": "lose"})
+                # Show game over screen immediately
+                self.show_end_screen("💀 You Lose!")
+            except Exception as e:
+                print(f"Failed to send lose message: {e}")
+                # Still show game over screen even if message fails
+                self.show_end_screen("💀 You Lose!")
 
     def game_loop(self):
         """Main game loop"""
@@ -1073,24 +1262,39 @@ class TetrisClient:
         
         # Only send board update if enough time has passed and state has changed
         if (current_time - self.last_board_update >= self.board_update_interval and 
-            (self.prev_board_state != self.board or 
-             self.prev_piece_state != self.current_piece)):
+            (self.prev_board_state != self.engine.board or 
+             self.prev_piece_state != self.engine.current_piece)):
             
             try:
-                self.conn.send(json.dumps({
-                    "type": "board",
-                    "board": self.board,
-                    "current_piece": {
-                        "shape": self.current_piece['shape'],
-                        "color": self.current_piece['color'],
-                        "x": self.current_piece['x'],
-                        "y": self.current_piece['y']
+                piece = {
+                    "shape": self.engine.current_piece['shape'],
+                    "color": self.engine.current_piece['color'],
+                    "x": self.engine.current_piece['x'],
+                    "y": self.engine.current_piece['y']
+                }
+                if (self.board_delta and not self.keyframe_requested
+                        and self.board_seq % KEYFRAME_INTERVAL):
+                    # Only the cells that changed since the last update
+                    message = {
+                        "type": "board_delta",
+                        "seq": self.board_seq,
+                        "changes": board_changes(self.prev_board_state, self.engine.board),
+                        "current_piece": piece
                     }
-                }).encode() + b'\n')
+                else:
+                    message = {"type": "board", "seq": self.board_seq, "current_piece": piece}
+                    if self.board_encoding == BOARD_ENCODING_PACKED:
+                        message["encoding"] = BOARD_ENCODING_PACKED
+                        message["cells"] = encode_board(self.engine.board)
+                    else:
+                        message["board"] = self.engine.board
+                    self.keyframe_requested = False
+                self.send_message(message)
+                self.board_seq += 1
                 
                 # Update state tracking
-                self.prev_board_state = [row[:] for row in self.board]  # Deep copy
-                self.prev_piece_state = self.current_piece.copy()
+                self.prev_board_state = [row[:] for row in self.engine.board]  # Deep copy
+                self.prev_piece_state = self.engine.current_piece.copy()
                 self.last_board_update = current_time
                 
             except BrokenPipeError:
@@ -1103,34 +1307,20 @@ class TetrisClient:
         self.draw()
         
         # Schedule next frame with speed based on level
-        speed = max(50, 500 - (self.level - 1) * 50)  # Decrease delay as level increases
+        speed = self.engine.fall_delay()  # Decrease delay as level increases
         self.root.after(speed, self.game_loop)
 
 # STACK LIFO
     def hold_current_piece(self):
-        if self.hold_used:
-            return
-        self.hold_used = True
-        if not self.hold_piece:
-            self.hold_piece = self.current_piece
-            self.current_piece = self.new_piece()
-            self.next_piece = self.new_piece()
-        else:
-            self.hold_piece, self.current_piece = self.current_piece, self.hold_piece
-        self.current_piece['x'] = COLUMNS // 2 - 1
-        self.current_piece['y'] = 0
-        self.draw_hold()
+        if self.engine.hold():
+            self.draw_hold()
 
     def hard_drop(self):
-        drop_distance = 0
-        while self.move(0, 1):
-            drop_distance += 1
-        self.hard_drop_points += drop_distance * 2
-        if not self.drop_sound_channel.get_busy():
-            self.drop_sound_channel.play(self.drop_sound)
-        else:
+        lines_cleared = self.engine.hard_drop()
+        if self.drop_sound_channel.get_busy():
             self.drop_sound_channel.stop()
-            self.freeze()
+        self.drop_sound_channel.play(self.drop_sound)
+        self.piece_locked(lines_cleared)
 
     def key_press(self, event):
         if not self.running or self.paused:
@@ -1160,7 +1350,7 @@ class TetrisClient:
 
         # Add final score to history with timestamp
         current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-        self.score_history.insert(self.score, current_time)
+        self.score_history.insert(self.engine.score, current_time)
         self.save_local_data()  # Save to local file
 
         # Load and set the background image
@@ -1180,7 +1370,7 @@ class TetrisClient:
         message_label.pack(pady=(20, 40))
 
         # Show final score
-        score_label = tk.Label(container, text=f"Final Score: {self.score}", font=('Lucida Sans Typewriter', 24, "bold"), fg="#ffd369", bg="#04143f")
+        score_label = tk.Label(container, text=f"Final Score: {self.engine.score}", font=('Lucida Sans Typewriter', 24, "bold"), fg="#ffd369", bg="#04143f")
         score_label.pack(pady=(0, 20))
 
         # Create a frame to hold the buttons side by side
@@ -1254,7 +1444,7 @@ class TetrisClient:
 
     def request_rematch(self):
         try:
-            self.conn.send(json.dumps({"type": "rematch_request"}).encode() + b'\n')
+            self.send_message({"type": "rematch_request"})
             self.rematch_status.config(text="Waiting for opponent...")
         except Exception as e:
             print(f"Failed to send rematch request: {e}")
@@ -1284,9 +1474,11 @@ class TetrisClient:
         return -1  # Not found
 
     def show_lobby_leaderboard(self):
-        """Show the local leaderboard in a popup window with enhanced design"""
+        """Show the leaderboard in a popup window with enhanced design
+        Starts with the local scores and switches to the server leaderboard
+        when the server answers"""
         popup = tk.Toplevel(self.root)
-        popup.title("Local Leaderboard")
+        popup.title("Leaderboard")
         popup.geometry("400x500")
         popup.configure(bg="#222831")
 
@@ -1322,7 +1514,7 @@ class TetrisClient:
         leaderboard_list.pack(side="left", fill="both", expand=True)
         scrollbar.config(command=leaderboard_list.yview)
 
-        # Get and sort the leaderboard data
+        # Get and sort the local leaderboard data
         player_scores = []
         for player_name, scores in self.leaderboard_data.items():
             if scores:  # If player has any scores
@@ -1331,21 +1523,21 @@ class TetrisClient:
 
         # Sort players by highest score in descending order
         sorted_players = sorted(player_scores, key=lambda x: x[1], reverse=True)
+        self.fill_leaderboard_list(leaderboard_list, [
+            (i, player_name, highest_score) for i, (player_name, highest_score) in enumerate(sorted_players, 1)])
 
-        # Populate the list with sorted leaderboard data
-        for i, (player_name, highest_score) in enumerate(sorted_players, 1):
-            # Add rank number with medal emoji for top 3
-            rank = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i:2d}."
-            
-            # Format the entry with fixed-width spacing
-            # Using a format that ensures perfect alignment
-            entry = f"{rank} {player_name:15} {highest_score:8,}"
-            leaderboard_list.insert(tk.END, entry)
-            
-            # Add a subtle separator line between entries
-            if i < len(sorted_players):
-                separator = "─" * 35  # Fixed width separator
-                leaderboard_list.insert(tk.END, separator)
+        # Our own rank on the server leaderboard
+        self.leaderboard_rank_label = tk.Label(popup, text="", font=("Helvetica", 12),
+                                               bg="#222831", fg="#ffd369")
+        self.leaderboard_rank_label.pack()
+
+        # Ask the server for the authoritative leaderboard; listen_server fills it in
+        self.leaderboard_popup_list = leaderboard_list
+        try:
+            self.send_message({"type": "leaderboard_top", "limit": 50})
+            self.send_message({"type": "leaderboard_rank"})
+        except Exception as e:
+            print(f"Failed to request leaderboard: {e}")
 
         # Close button with modern styling
         close_btn = tk.Button(popup, 
@@ -1368,9 +1560,26 @@ class TetrisClient:
         popup.grab_set()
         self.root.wait_window(popup)
 
+    def fill_leaderboard_list(self, leaderboard_list, ranked):
+        """Fill a leaderboard listbox with (rank, name, score) entries"""
+        leaderboard_list.delete(0, tk.END)
+        for index, (i, player_name, highest_score) in enumerate(ranked, 1):
+            # Add rank number with medal emoji for top 3
+            rank = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i:2d}."
+            
+            # Format the entry with fixed-width spacing
+            # Using a format that ensures perfect alignment
+            entry = f"{rank} {player_name:15} {highest_score:8,}"
+            leaderboard_list.insert(tk.END, entry)
+            
+            # Add a subtle separator line between entries
+            if index < len(ranked):
+                separator = "─" * 35  # Fixed width separator
+                leaderboard_list.insert(tk.END, separator)
+
     def accept_rematch(self):
         try:
-            self.conn.send(json.dumps({"type": "rematch_accepted"}).encode() + b'\n')
+            self.send_message({"type": "rematch_accepted"})
             self.rematch_status.config(text="")
             # Clear the window and show the start button page
             self.clear_window()
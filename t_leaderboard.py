@@ -0,0 +1,252 @@
+# Server-side leaderboard for Tetris Battle
+# Every finished game is stored in an embedded SQLite database; each player's
+# best score is also kept in an in-memory rank index so "top K", "rank of X"
+# and "players around X" stay O(log n) with millions of games on record.
+# Queries only read the index; writes go to SQLite from a background thread,
+# so recording a game never waits for a commit.
+import bisect
+import queue
+import sqlite3
+import threading
+import time
+
+from t_log import log
+
+LEADERBOARD_DB = 'leaderboard.db'
+BLOCK_SIZE = 512  # Keys per block of the rank index (split at twice this)
+MAX_ENTRIES = 100  # Largest page returned by top/around queries
+
+class RankIndex:
+    """
+    Sorted list of keys with O(log n) rank and select
+    Keys live in sorted blocks of up to 2 * BLOCK_SIZE. A Fenwick tree over
+    the block lengths turns "position of key" and "key at position" into a
+    tree walk plus one bisect inside a block, and an insert or removal only
+    moves the keys of one block.
+    """
+
+    def __init__(self, keys=()):
+        """
+        Args:
+            keys: Initial keys, already sorted
+        """
+        keys = list(keys)
+        self.blocks = [keys[i:i + BLOCK_SIZE] for i in range(0, len(keys), BLOCK_SIZE)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(keys)
+        self._rebuild()
+
+    def __len__(self):
+        return self.size
+
+    def _rebuild(self):
+        """Rebuild the Fenwick tree after blocks were split or removed"""
+        tree = [0] * (len(self.blocks) + 1)
+        for i, block in enumerate(self.blocks, 1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def _grow(self, block, amount):
+        tree = self.tree
+        i = block + 1
+        while i < len(tree):
+            tree[i] += amount
+            i += i & -i
+
+    def _before(self, block):
+        """Number of keys in the blocks before the given block"""
+        total = 0
+        i = block
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def add(self, key):
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            self.size = 1
+            self._rebuild()
+            return
+        b = bisect.bisect_left(self.maxes, key)
+        if b == len(self.blocks):
+            b -= 1
+        block = self.blocks[b]
+        bisect.insort(block, key)
+        self.maxes[b] = block[-1]
+        self.size += 1
+        if len(block) > 2 * BLOCK_SIZE:
+            self.blocks[b:b + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+            self.maxes[b:b + 1] = [block[BLOCK_SIZE - 1], block[-1]]
+            self._rebuild()
+        else:
+            self._grow(b, 1)
+
+    def remove(self, key):
+        """Remove one occurrence of key; raises KeyError if absent"""
+        b = bisect.bisect_left(self.maxes, key)
+        if b == len(self.blocks):
+            raise KeyError(key)
+        block = self.blocks[b]
+        i = bisect.bisect_left(block, key)
+        if i == len(block) or block[i] != key:
+            raise KeyError(key)
+        del block[i]
+        self.size -= 1
+        if block:
+            self.maxes[b] = block[-1]
+            self._grow(b, -1)
+        else:
+            del self.blocks[b]
+            del self.maxes[b]
+            self._rebuild()
+
+    def rank(self, key):
+        """Number of keys smaller than key (its 0-based position when present)"""
+        b = bisect.bisect_left(self.maxes, key)
+        if b == len(self.blocks):
+            return self.size
+        return self._before(b) + bisect.bisect_left(self.blocks[b], key)
+
+    def __getitem__(self, position):
+        """Key at a 0-based position"""
+        if not 0 <= position < self.size:
+            raise IndexError(position)
+        # Walk down the Fenwick tree to the block holding the position
+        tree = self.tree
+        block = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            nxt = block + step
+            if nxt < len(tree) and tree[nxt] <= position:
+                block = nxt
+                position -= tree[nxt]
+            step >>= 1
+        return self.blocks[block][position]
+
+    def slice(self, start, stop):
+        """Keys at positions start..stop-1 (clamped to the list)"""
+        start = max(0, start)
+        stop = min(self.size, stop)
+        return [self[i] for i in range(start, stop)]
+
+class Leaderboard:
+    """
+    Persistent store of game scores with ranked best-score queries
+    Ranks order players by their best score (highest first), then by name.
+    record() updates the rank index at once and queues the rows for a writer
+    thread, which commits everything queued so far in one transaction.
+    Not thread-safe on its own; the server calls it with its lock held.
+    """
+
+    def __init__(self, path=LEADERBOARD_DB):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')  # Commits don't wait for fsync in WAL mode
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS games (
+                id INTEGER PRIMARY KEY,
+                player TEXT NOT NULL,
+                score INTEGER NOT NULL,
+                played REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS best (
+                player TEXT PRIMARY KEY,
+                score INTEGER NOT NULL,
+                played REAL NOT NULL
+            );
+        ''')
+        self.best = {}  # player -> best score
+        rows = self.db.execute('SELECT player, score FROM best ORDER BY score DESC, player')
+        keys = []
+        for player, score in rows:
+            self.best[player] = score
+            keys.append((-score, player))
+        self.index = RankIndex(keys)
+        self.pending = queue.SimpleQueue()  # (player, score, played, improved), None to stop
+        self.writer = threading.Thread(target=self._write_loop, name='leaderboard-writer', daemon=True)
+        self.writer.start()
+
+    def __len__(self):
+        return len(self.index)
+
+    def record(self, player, score, played=None):
+        """
+        Store a finished game and update the player's best score
+        Args:
+            player: Username
+            score: Final score of the game
+            played: Unix time the game ended (defaults to now)
+        Returns:
+            True if this is the player's new best score
+        """
+        played = played if played is not None else time.time()
+        score = int(score)
+        previous = self.best.get(player)
+        improved = previous is None or score > previous
+        self.pending.put((player, score, played, improved))
+        if improved:
+            if previous is not None:
+                self.index.remove((-previous, player))
+            self.index.add((-score, player))
+            self.best[player] = score
+        return improved
+
+    def _write_loop(self):
+        """Writer thread: commit queued games in batches until close()"""
+        while True:
+            batch = [self.pending.get()]
+            while not self.pending.empty():
+                batch.append(self.pending.get())
+            stop = None in batch
+            games = [game for game in batch if game is not None]
+            try:
+                with self.db:
+                    self.db.executemany('INSERT INTO games (player, score, played) VALUES (?, ?, ?)',
+                                        [game[:3] for game in games])
+                    self.db.executemany('INSERT OR REPLACE INTO best (player, score, played) '
+                                        'VALUES (?, ?, ?)', [game[:3] for game in games if game[3]])
+            except sqlite3.Error as e:
+                log.error("Leaderboard write failed", extra={'games': len(games), 'error': str(e)})
+            if stop:
+                return
+
+    def _entries(self, start, stop):
+        return [{'rank': start + i + 1, 'name': player, 'score': -negative}
+                for i, (negative, player) in enumerate(self.index.slice(start, stop))]
+
+    def top(self, limit=10):
+        """The best `limit` players as [{'rank', 'name', 'score'}]"""
+        return self._entries(0, max(0, min(limit, MAX_ENTRIES)))
+
+    def rank(self, player):
+        """
+        A player's position on the board
+        Returns:
+            (rank starting at 1, best score), or (None, None) if they have no games
+        """
+        score = self.best.get(player)
+        if score is None:
+            return None, None
+        return self.index.rank((-score, player)) + 1, score
+
+    def around(self, player, radius=5):
+        """Entries from `radius` places above the player to `radius` places below"""
+        rank, _ = self.rank(player)
+        if rank is None:
+            return []
+        radius = max(0, min(radius, MAX_ENTRIES // 2))
+        # Clamp here rather than in slice(): _entries numbers rows from start
+        start = max(0, rank - 1 - radius)
+        return self._entries(start, rank + radius)
+
+    def close(self):
+        """Commit the queued games, stop the writer and close the database"""
+        if self.writer.is_alive():
+            self.pending.put(None)
+            self.writer.join()
+        self.db.close()
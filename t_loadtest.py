@@ -0,0 +1,357 @@
+# Load generator for the Tetris server
+# Spins up N headless bot players that speak the same protocol as TetrisClient
+# and reports throughput, relay latency percentiles and errors for each N.
+#
+#   python t_loadtest.py --host 127.0.0.1 --clients 10,100,500 --duration 20
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.request
+
+from t_protocol import (FrameDecoder, RECV_SIZE, BOARD_ENCODINGS, BOARD_ENCODING_PACKED,
+                        KEYFRAME_INTERVAL, encode_board, board_changes, PALETTE)
+
+HOST = '127.0.0.1'
+PORT = 5555
+COLUMNS = 10
+ROWS = 20
+BOARD_RATE = 10.0  # Board updates per second per bot (TetrisClient sends at most 10/s)
+FREEZE_EVERY = 8  # Board updates between piece locks
+SCORE_EVERY = 4  # Piece locks between score updates
+GAME_LENGTH = (20.0, 60.0)  # Seconds a bot plays before topping out (random in range)
+CONNECT_RATE = 200  # New connections per second while ramping up
+LATENCY_HORIZON = 10.0  # Seconds to remember a sent board waiting for its relay
+SPECTATE_RETRY = 1.0  # Seconds between a spectator's attempts to find a match to watch
+
+class RunStats:
+    """Counters shared by every bot in one load level"""
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.connected = 0
+        self.matches = 0
+        self.spectator_frames = 0
+        self.errors = {}  # error kind -> count
+        self.latencies = []  # Seconds from board send to opponent receipt
+        self.sent_at = {}  # (username, seq) -> send time
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def expire(self, now):
+        """Forget sent boards whose relay never arrived (dropped frames)"""
+        stale = [key for key, sent in self.sent_at.items() if now - sent > LATENCY_HORIZON]
+        for key in stale:
+            del self.sent_at[key]
+        if stale:
+            self.errors['board_not_relayed'] = self.errors.get('board_not_relayed', 0) + len(stale)
+
+class Bot:
+    """
+    One simulated player
+    Handshake, lobby and ready like TetrisClient.join_lobby/toggle_ready,
+    then board deltas/keyframes and scores at game_loop rates, a loss after a
+    random game length, and rematch requests/accepts after every game.
+    """
+
+    def __init__(self, name, stats, host, port, board_rate):
+        self.name = name
+        self.stats = stats
+        self.host = host
+        self.port = port
+        self.interval = 1.0 / board_rate
+        self.writer = None
+        self.opponent = None
+        self.playing = asyncio.Event()
+        self.board_encoding = None
+        self.board_delta = False
+        self.keyframe_requested = True
+
+    def send(self, message):
+        data = (json.dumps(message) + '\n').encode()
+        self.writer.write(data)
+        self.stats.sent += 1
+        self.stats.bytes_sent += len(data)
+
+    async def run(self, stop):
+        try:
+            reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self.stats.error('connect')
+            return
+        self.stats.connected += 1
+        self.writer.write(self.name.encode() + b'\n')
+        self.send({'type': 'hello', 'board_encodings': list(BOARD_ENCODINGS), 'board_delta': True})
+        self.send({'type': 'request_lobby'})
+        self.send({'type': 'ready', 'ready': True})
+        listener = asyncio.ensure_future(self.listen(reader))
+        try:
+            while not stop.is_set():
+                await self.playing.wait()
+                await self.play(stop)
+        finally:
+            listener.cancel()
+            self.writer.close()
+
+    async def listen(self, reader):
+        decoder = FrameDecoder()
+        stats = self.stats
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    stats.error('server_closed')
+                    return
+                stats.bytes_received += len(data)
+                for frame in decoder.feed(data):
+                    stats.received += 1
+                    msg = json.loads(frame)
+                    kind = msg.get('type')
+                    if kind in ('board', 'board_delta'):
+                        sent = stats.sent_at.pop((self.opponent, msg.get('seq')), None)
+                        if sent is not None:
+                            stats.latencies.append(time.perf_counter() - sent)
+                    elif kind == 'hello':
+                        self.board_encoding = msg.get('board_encoding')
+                        self.board_delta = msg.get('board_delta', False)
+                    elif kind == 'start':
+                        self.opponent = msg.get('opponent')
+                        stats.matches += 1
+                        self.playing.set()
+                    elif kind == 'game_over':
+                        self.playing.clear()
+                        if msg.get('result') == 'lose':
+                            # The loser asks, the winner accepts
+                            self.send({'type': 'rematch_request'})
+                    elif kind == 'rematch_request':
+                        self.send({'type': 'rematch_accepted'})
+                    elif kind == 'keyframe_request':
+                        self.keyframe_requested = True
+                    elif kind == 'ping':
+                        self.send({'type': 'pong', 'id': msg.get('id')})
+                    elif kind == 'system' and msg.get('event') == 'opponent_left':
+                        # Match over; go back to the matchmaking queue. Other
+                        # notices (opponent held for a resume, reconnected)
+                        # leave the game running
+                        self.playing.clear()
+                        self.send({'type': 'ready', 'ready': True})
+        except (ConnectionError, OSError):
+            stats.error('connection_reset')
+        except ValueError:
+            stats.error('bad_frame')
+
+    async def play(self, stop):
+        """Play one game until we top out, the opponent does, or the run ends"""
+        board = [[0] * COLUMNS for _ in range(ROWS)]
+        sent_board = [row[:] for row in board]
+        seq = 0
+        locks = 0
+        self.keyframe_requested = True
+        game_end = time.monotonic() + random.uniform(*GAME_LENGTH)
+        piece = {'shape': [[1, 1, 1], [0, 1, 0]], 'color': 'purple', 'x': 4, 'y': 0}
+        while self.playing.is_set() and not stop.is_set():
+            if time.monotonic() >= game_end:
+                self.send({'type': 'lose'})
+                self.playing.clear()
+                return
+            piece['y'] += 1
+            if seq % FREEZE_EVERY == FREEZE_EVERY - 1:
+                # Lock a few cells into the stack like freeze() would
+                y = random.randrange(ROWS // 2, ROWS)
+                for x in random.sample(range(COLUMNS), 4):
+                    board[y][x] = random.choice(PALETTE[1:])
+                piece['y'] = 0
+                locks += 1
+                if locks % SCORE_EVERY == 0:
+                    self.send({'type': 'score', 'value': locks * 25, 'level': 1})
+            if self.board_delta and not self.keyframe_requested and seq % KEYFRAME_INTERVAL:
+                message = {'type': 'board_delta', 'seq': seq,
+                           'changes': board_changes(sent_board, board), 'current_piece': piece}
+            else:
+                message = {'type': 'board', 'seq': seq, 'current_piece': piece}
+                if self.board_encoding == BOARD_ENCODING_PACKED:
+                    message['encoding'] = BOARD_ENCODING_PACKED
+                    message['cells'] = encode_board(board)
+                else:
+                    message['board'] = board
+                self.keyframe_requested = False
+            self.stats.sent_at[(self.name, seq)] = time.perf_counter()
+            self.send(message)
+            sent_board = [row[:] for row in board]
+            seq += 1
+            await asyncio.sleep(self.interval * random.uniform(0.9, 1.1))
+
+class Spectator:
+    """
+    One simulated viewer
+    Every spectator watches the same match (the first listed one whose players
+    are both connected) so a single room gets the whole audience, and moves on
+    to another match when it ends.
+    """
+
+    def __init__(self, name, stats, host, port):
+        self.name = name
+        self.stats = stats
+        self.host = host
+        self.port = port
+        self.writer = None
+        self.watching = False
+
+    def send(self, message):
+        self.writer.write((json.dumps(message) + '\n').encode())
+
+    async def run(self, stop):
+        try:
+            reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self.stats.error('connect')
+            return
+        self.writer.write(self.name.encode() + b'\n')
+        self.send({'type': 'hello', 'board_encodings': list(BOARD_ENCODINGS), 'board_delta': True})
+        listener = asyncio.ensure_future(self.listen(reader))
+        try:
+            while not stop.is_set():
+                if not self.watching:
+                    self.send({'type': 'list_rooms'})
+                await asyncio.sleep(SPECTATE_RETRY)
+        finally:
+            listener.cancel()
+            self.writer.close()
+
+    async def listen(self, reader):
+        decoder = FrameDecoder()
+        stats = self.stats
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    stats.error('server_closed')
+                    return
+                stats.bytes_received += len(data)
+                for frame in decoder.feed(data):
+                    msg = json.loads(frame)
+                    kind = msg.get('type')
+                    if kind in ('board', 'score'):
+                        stats.spectator_frames += 1
+                    elif kind == 'ping':
+                        self.send({'type': 'pong', 'id': msg.get('id')})
+                    elif kind == 'rooms':
+                        if not self.watching:
+                            room = next((r for r in msg['rooms'] if len(r['players']) == 2
+                                         and not r.get('held')), None)
+                            if room is not None:
+                                self.send({'type': 'spectate', 'room': room['room']})
+                    elif kind == 'spectate':
+                        self.watching = True
+                    elif kind == 'system' and msg.get('event') in ('match_ended',
+                                                                   'match_unavailable'):
+                        # Look for another match
+                        self.watching = False
+        except (ConnectionError, OSError):
+            stats.error('connection_reset')
+        except ValueError:
+            stats.error('bad_frame')
+
+def scrape_messages(metrics_url):
+    """Total messages the server has handled, read from its metrics endpoint"""
+    try:
+        with urllib.request.urlopen(metrics_url, timeout=2) as response:
+            text = response.read().decode()
+    except OSError:
+        return None
+    total = 0
+    for line in text.splitlines():
+        if line.startswith('tetris_messages_received_total'):
+            total += int(line.rsplit(' ', 1)[1])
+    return total
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def run_level(clients, args):
+    """Run one load level with the given number of bots and return its stats"""
+    stats = RunStats()
+    stop = asyncio.Event()
+    prefix = f"bot{clients}_{random.randrange(1 << 16):04x}_"
+    tasks = []
+    for i in range(clients):
+        bot = Bot(f"{prefix}{i}", stats, args.host, args.port, args.board_rate)
+        tasks.append(asyncio.ensure_future(bot.run(stop)))
+        await asyncio.sleep(1.0 / CONNECT_RATE)
+    for i in range(args.spectators):
+        spectator = Spectator(f"{prefix}watch{i}", stats, args.host, args.port)
+        tasks.append(asyncio.ensure_future(spectator.run(stop)))
+        await asyncio.sleep(1.0 / CONNECT_RATE)
+
+    server_before = scrape_messages(args.metrics_url) if args.metrics_url else None
+    measure_start = time.perf_counter()
+    sent_before, received_before = stats.sent, stats.received
+    spectated_before = stats.spectator_frames
+    stats.latencies.clear()
+    while time.perf_counter() - measure_start < args.duration:
+        await asyncio.sleep(1.0)
+        stats.expire(time.perf_counter())
+    elapsed = time.perf_counter() - measure_start
+    server_after = scrape_messages(args.metrics_url) if args.metrics_url else None
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    stats.send_rate = (stats.sent - sent_before) / elapsed
+    stats.receive_rate = (stats.received - received_before) / elapsed
+    stats.spectator_rate = (stats.spectator_frames - spectated_before) / elapsed
+    stats.server_rate = None
+    if server_before is not None and server_after is not None:
+        stats.server_rate = (server_after - server_before) / elapsed
+    return stats
+
+def report(clients, stats):
+    latencies = sorted(stats.latencies)
+    ms = lambda value: f"{value * 1000:8.2f}"
+    server_rate = f"{stats.server_rate:9.0f}" if stats.server_rate is not None else "        -"
+    errors = ', '.join(f"{kind}={count}" for kind, count in sorted(stats.errors.items())) or '-'
+    print(f"{clients:6d} {stats.connected:6d} {stats.matches:7d} {stats.send_rate:9.0f} "
+          f"{stats.receive_rate:9.0f} {server_rate} {stats.spectator_rate:9.0f} "
+          f"{ms(percentile(latencies, 0.5))} {ms(percentile(latencies, 0.9))} "
+          f"{ms(percentile(latencies, 0.99))} {ms(latencies[-1] if latencies else float('nan'))}  {errors}")
+
+async def main(args):
+    levels = [int(n) for n in args.clients.split(',')]
+    print(f"{'N':>6} {'conn':>6} {'matches':>7} {'sent/s':>9} {'recv/s':>9} {'server/s':>9} "
+          f"{'watch/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  errors")
+    for clients in levels:
+        report(clients, await run_level(clients, args))
+        await asyncio.sleep(args.cooldown)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the Tetris server with bot players")
+    parser.add_argument('--host', default=HOST, help="Server address")
+    parser.add_argument('--port', type=int, default=PORT, help="Server port")
+    parser.add_argument('--clients', default='10,50,100',
+                        help="Comma-separated bot counts to run, one load level each")
+    parser.add_argument('--duration', type=float, default=20.0,
+                        help="Seconds to measure at each load level (after ramp-up)")
+    parser.add_argument('--board-rate', type=float, default=BOARD_RATE,
+                        help="Board updates per second per bot")
+    parser.add_argument('--spectators', type=int, default=0,
+                        help="Spectator bots at each load level, all watching the same match")
+    parser.add_argument('--cooldown', type=float, default=2.0,
+                        help="Seconds to wait between load levels")
+    parser.add_argument('--metrics-url', default='http://127.0.0.1:5556/metrics',
+                        help="Server metrics endpoint for server-side throughput ('' to skip)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,139 @@
+# Structured logging for the Tetris server
+# Records go through a bounded queue to a background writer thread that emits
+# one JSON object per line, so the request path never waits on console or
+# disk I/O. Per-message tracing is DEBUG level and can be sampled per type.
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG_QUEUE_SIZE = 10000  # Records waiting for the writer before new ones are dropped
+LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO,
+          'warning': logging.WARNING, 'error': logging.ERROR}
+
+# Attributes every LogRecord has; anything else was passed with extra= and is a field
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+log = logging.getLogger('tetris')
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format a record as one JSON line: time, level, message, then the extra fields
+    """
+
+    def __init__(self, static_fields=None):
+        super().__init__()
+        self.static_fields = static_fields or {}  # Added to every line (e.g. worker id)
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                  .isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'msg': record.getMessage()
+        }
+        entry.update(self.static_fields)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops records instead of blocking when the writer falls behind
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class Sampler:
+    """
+    Keep one in every N records per message type
+    Counting instead of drawing random numbers keeps the check to a dict
+    lookup and an increment; types without a rate are always kept.
+    """
+
+    def __init__(self, rates=None):
+        self.set_rates(rates)
+
+    def set_rates(self, rates):
+        self.rates = dict(rates or {})  # message type -> N (keep 1 in N)
+        self.counts = dict.fromkeys(self.rates, 0)
+
+    def keep(self, msg_type):
+        rate = self.rates.get(msg_type)
+        if rate is None:
+            return True
+        count = self.counts[msg_type]
+        self.counts[msg_type] = count + 1
+        return count % rate == 0
+
+sampler = Sampler()
+
+def parse_sample_rates(text):
+    """
+    Parse a sampling option such as "board=100,board_delta=100"
+    Returns:
+        Dict of message type -> N (keep 1 in N)
+    """
+    rates = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        msg_type, _, rate = item.partition('=')
+        rates[msg_type.strip()] = max(1, int(rate))
+    return rates
+
+def setup_logging(level='info', sample=None, path=None, static_fields=None):
+    """
+    Route the 'tetris' logger through the background JSON writer
+    Safe to call again (e.g. in a forked worker); the previous writer is replaced.
+    Args:
+        level: Level name ('debug', 'info', 'warning' or 'error')
+        sample: Dict of message type -> N for sampled DEBUG message tracing
+        path: File to append to, or None for stderr
+        static_fields: Fields added to every line
+    Returns:
+        The DroppingQueueHandler, whose 'dropped' count is worth exporting
+    """
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except Exception:
+            pass  # Writer thread didn't survive a fork
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+
+    target = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+    target.setFormatter(JsonFormatter(static_fields))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    log.addHandler(handler)
+    log.setLevel(LEVELS[level])
+    log.propagate = False
+    sampler.set_rates(sample)
+
+    _listener = logging.handlers.QueueListener(log_queue, target)
+    _listener.start()
+    return handler
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
@@ -0,0 +1,270 @@
+# Matchmaking for the Tetris server
+# Ready players wait in rating buckets and are paired with the closest-rated
+# opponent inside a match window that widens the longer they wait.
+import time
+
+DEFAULT_RATING = 1200
+ELO_K = 32  # Maximum rating change per game
+BUCKET_WIDTH = 50  # Rating points per bucket
+BASE_WINDOW = 100  # Rating difference accepted immediately
+WINDOW_GROWTH = 25  # Extra rating difference accepted per second of waiting
+MAX_WINDOW = 800  # Widest rating difference ever accepted
+
+class IndexedPriorityQueue:
+    """
+    Binary min-heap that also indexes entries by key
+    push/update/remove are O(log n) and membership is O(1), so changing one
+    player's priority never requires rebuilding the heap
+    """
+
+    def __init__(self):
+        self.heap = []  # [priority, key] pairs
+        self.index = {}  # key -> position in heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        """Iterate keys in heap (not sorted) order"""
+        return (key for _, key in self.heap)
+
+    # Both sifts move a hole rather than swapping: entries on the way shift
+    # by one slot and the moving entry is written (and indexed) once at the end
+
+    def _sift_up(self, i):
+        heap = self.heap
+        index = self.index
+        item = heap[i]
+        priority = item[0]
+        while i > 0:
+            parent = (i - 1) // 2
+            above = heap[parent]
+            if priority < above[0]:
+                heap[i] = above
+                index[above[1]] = i
+                i = parent
+            else:
+                break
+        heap[i] = item
+        index[item[1]] = i
+
+    def _sift_down(self, i):
+        heap = self.heap
+        index = self.index
+        size = len(heap)
+        item = heap[i]
+        priority = item[0]
+        child = 2 * i + 1
+        while child < size:
+            right = child + 1
+            if right < size and heap[right][0] < heap[child][0]:
+                child = right
+            below = heap[child]
+            if below[0] < priority:
+                heap[i] = below
+                index[below[1]] = i
+                i = child
+                child = 2 * i + 1
+            else:
+                break
+        heap[i] = item
+        index[item[1]] = i
+
+    def push(self, key, priority):
+        """Insert a key, or change its priority if it is already queued"""
+        if key in self.index:
+            self.update(key, priority)
+            return
+        self.heap.append([priority, key])
+        self.index[key] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def update(self, key, priority):
+        """Change the priority of a queued key"""
+        i = self.index[key]
+        old = self.heap[i][0]
+        self.heap[i][0] = priority
+        if priority < old:
+            self._sift_up(i)
+        else:
+            self._sift_down(i)
+
+    def remove(self, key):
+        """Remove a key if present; returns True if it was queued"""
+        i = self.index.pop(key, None)
+        if i is None:
+            return False
+        last = self.heap.pop()
+        if i < len(self.heap):
+            self.heap[i] = last
+            self.index[last[1]] = i
+            self._sift_up(i)
+            self._sift_down(self.index[last[1]])
+        return True
+
+    def peek(self):
+        """Return (priority, key) of the smallest entry, or None"""
+        return tuple(self.heap[0]) if self.heap else None
+
+    def pop(self):
+        """Remove and return (priority, key) of the smallest entry"""
+        priority, key = self.heap[0]
+        self.remove(key)
+        return priority, key
+
+    def priority(self, key):
+        return self.heap[self.index[key]][0]
+
+    def sorted_items(self):
+        """All (priority, key) pairs in priority order"""
+        return sorted((priority, key) for priority, key in self.heap)
+
+class Matchmaker:
+    """
+    Skill-based matchmaking queue
+    Each waiting player sits in the bucket for their Elo rating. A player can
+    be paired with anyone whose rating is within their match window, which
+    starts at BASE_WINDOW and grows by WINDOW_GROWTH per second of waiting up
+    to MAX_WINDOW. An indexed queue holds each player under the time their
+    window next grows by a bucket, so a sweep only pops the players that are
+    due for another try.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.ratings = {}  # username -> Elo rating, kept for the server's lifetime
+        self.retries = IndexedPriorityQueue()  # username -> time of the next wider try
+        self.buckets = {}  # bucket number -> {username: None} in arrival order
+        self.entries = {}  # username -> (rating, payload, last window tried, enqueue time)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, username):
+        return username in self.entries
+
+    def rating(self, username):
+        return self.ratings.get(username, DEFAULT_RATING)
+
+    def window(self, username, now=None):
+        """Current accepted rating difference for a waiting player"""
+        waited = (now if now is not None else self.clock()) - self.entries[username][3]
+        return min(MAX_WINDOW, BASE_WINDOW + WINDOW_GROWTH * waited)
+
+    def _schedule(self, username, since, tried):
+        """
+        Queue (or move) the next try for when the window has grown by a
+        bucket or reached MAX_WINDOW; a player already at the cap is dropped
+        from the retry queue
+        """
+        if tried < MAX_WINDOW:
+            grown = min(tried + BUCKET_WIDTH, MAX_WINDOW)
+            self.retries.push(username, since + (grown - BASE_WINDOW) / WINDOW_GROWTH)
+        else:
+            self.retries.remove(username)
+
+    def enqueue(self, username, payload=None, rating=None):
+        """
+        Add a ready player and try to pair them immediately
+        Args:
+            username: Player name (or any unique queue key)
+            payload: Anything to hand back with the pair (e.g. the client record)
+            rating: Rating to match on; defaults to the stored rating for username
+        Returns:
+            (payload_a, payload_b) if a match was made, otherwise None
+        """
+        if username in self.entries:
+            return None
+        if rating is None:
+            rating = self.rating(username)
+        now = self.clock()
+        self.buckets.setdefault(rating // BUCKET_WIDTH, {})[username] = None
+        self.entries[username] = (rating, payload, BASE_WINDOW, now)
+        pair = self._try_match(username, BASE_WINDOW)
+        if pair is None:
+            self._schedule(username, now, BASE_WINDOW)
+        return pair
+
+    def remove(self, username):
+        """Take a player out of the queue (unready or disconnected)"""
+        entry = self.entries.pop(username, None)
+        if entry is None:
+            return False
+        self.retries.remove(username)
+        rating = entry[0]
+        bucket_id = rating // BUCKET_WIDTH
+        bucket = self.buckets[bucket_id]
+        del bucket[username]
+        if not bucket:
+            del self.buckets[bucket_id]
+        return True
+
+    def _try_match(self, username, window):
+        rating, payload = self.entries[username][:2]
+        best = None
+        best_diff = None
+        center = rating // BUCKET_WIDTH
+        reach = int(window) // BUCKET_WIDTH + 1
+        # Walk outwards from the player's own bucket so the closest rating wins
+        for distance in range(reach + 1):
+            for bucket_id in ((center,) if distance == 0 else (center - distance, center + distance)):
+                for other in self.buckets.get(bucket_id, ()):
+                    if other == username:
+                        continue
+                    diff = abs(self.entries[other][0] - rating)
+                    if diff <= window:
+                        if best is None or diff < best_diff:
+                            best, best_diff = other, diff
+                        break  # Buckets are in arrival order; the first fit is the longest waiting
+            if best is not None and best_diff <= distance * BUCKET_WIDTH:
+                break  # Nothing in a farther bucket can be closer
+        if best is None:
+            return None
+        other_payload = self.entries[best][1]
+        self.remove(username)
+        self.remove(best)
+        return (other_payload, payload)
+
+    def tick(self):
+        """
+        Retry waiting players whose match window has grown by at least one bucket
+        Only players due for a retry are touched: O(k log n) for k of them.
+        Players at MAX_WINDOW are not retried; new arrivals try to pair with
+        them instead.
+        Returns:
+            List of (payload_a, payload_b) pairs made
+        """
+        now = self.clock()
+        pairs = []
+        retries = self.retries
+        while retries:
+            due, username = retries.peek()
+            if due > now:
+                break
+            rating, payload, _, since = self.entries[username]
+            window = self.window(username, now)
+            self.entries[username] = (rating, payload, window, since)
+            pair = self._try_match(username, window)
+            if pair:
+                pairs.append(pair)
+            else:
+                # Moves the entry down the heap in place: one sift, not a pop and a push
+                self._schedule(username, since, window)
+        return pairs
+
+    def record_result(self, winner, loser):
+        """
+        Update both players' Elo ratings after a match
+        Args:
+            winner: Username of the winner
+            loser: Username of the loser
+        """
+        winner_rating = self.rating(winner)
+        loser_rating = self.rating(loser)
+        expected = 1 / (1 + 10 ** ((loser_rating - winner_rating) / 400))
+        change = round(ELO_K * (1 - expected))
+        self.ratings[winner] = winner_rating + change
+        self.ratings[loser] = loser_rating - change
@@ -0,0 +1,159 @@
+# Runtime metrics for the Tetris server
+# Counters and latency histograms, rendered as Prometheus-style plain text
+import bisect
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from t_log import log
+
+# Histogram bucket upper bounds in seconds (10us .. 1s)
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+class Histogram:
+    """Fixed-bucket latency histogram"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels=''):
+        """Return Prometheus text lines for this histogram"""
+        lines = []
+        cumulative = 0
+        sep = ',' if labels else ''
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {self.total:.6f}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+class Metrics:
+    """
+    Process-wide counters and histograms
+    Updates take a small private lock so they are safe from handler threads,
+    writer threads and the asyncio loop alike
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}  # (name, label value) -> int
+        self.histograms = {}  # (name, label value) -> Histogram
+
+    def count(self, name, amount=1, label=None):
+        key = (name, label)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, label=None):
+        key = (name, label)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self, gauges=()):
+        """
+        Render every metric as Prometheus-style text
+        Args:
+            gauges: Iterable of (name, labels, value) for point-in-time values
+        """
+        lines = [f'tetris_uptime_seconds {time.time() - self.started:.0f}']
+        with self.lock:
+            for (name, label), value in sorted(self.counters.items(), key=_sort_key):
+                labels = f'{{type="{label}"}}' if label is not None else ''
+                lines.append(f'{name}{labels} {value}')
+            for (name, label), histogram in sorted(self.histograms.items(), key=_sort_key):
+                lines.extend(histogram.render(name, f'type="{label}"' if label is not None else ''))
+        for name, labels, value in gauges:
+            lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+def _sort_key(item):
+    name, label = item[0]
+    return name, '' if label is None else str(label)
+
+class TimedLock:
+    """
+    Drop-in replacement for threading.Lock that records how long it is held
+    Hold times go into the 'tetris_lock_hold_seconds' histogram
+    """
+
+    def __init__(self, metrics, name='tetris_lock_hold_seconds'):
+        self._lock = threading.Lock()
+        self.metrics = metrics
+        self.name = name
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        ok = self._lock.acquire(blocking, timeout)
+        if ok:
+            self._acquired_at = time.perf_counter()
+        return ok
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        self.metrics.observe(self.name, held)
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+def start_metrics_server(host, port, render):
+    """
+    Serve metrics as plain text on http://host:port/metrics in a daemon thread
+    Args:
+        host: Address to bind (keep it local, e.g. 127.0.0.1)
+        port: Port for the endpoint
+        render: Callable returning the metrics text
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the server console
+
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    log.info("Metrics endpoint listening", extra={'host': host, 'port': port, 'path': '/metrics'})
+    return httpd
+
+def start_stats_dump(interval, render):
+    """
+    Print the metrics text every interval seconds from a daemon thread
+    The dump goes straight to stdout rather than through the logger: it is
+    a multi-line Prometheus text block meant to be read or piped as is, and
+    the logs go to stderr as JSON lines.
+    """
+    def dump_loop():
+        while True:
+            time.sleep(interval)
+            sys.stdout.write(render() + '\n')
+            sys.stdout.flush()
+
+    threading.Thread(target=dump_loop, daemon=True).start()
@@ -0,0 +1,270 @@
+# Wire protocol helpers shared by the Tetris server and client
+# Messages are JSON objects, one per line ('\n' delimited)
+import base64
+import json
+import socket
+import zlib
+
+DELIMITER = b'\n'
+MAX_FRAME_SIZE = 64 * 1024  # Largest accepted single message in bytes
+RECV_SIZE = 65536  # Bytes requested per recv() call
+
+class FrameError(ValueError):
+    """Raised when a peer sends a frame larger than the allowed maximum"""
+
+class FrameDecoder:
+    """
+    Incremental newline-delimited frame decoder
+    Feed it raw bytes as they arrive from recv(); it returns every complete
+    frame and keeps any trailing partial frame buffered for the next call.
+    Splitting happens on bytes, so a multi-byte UTF-8 character cut across
+    two TCP segments is reassembled before it is ever decoded.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, delimiter=DELIMITER):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+        self.delimiter = delimiter
+        self._scan_from = 0  # Buffer offset already known to contain no delimiter
+
+    def feed(self, data):
+        """
+        Add received bytes and return the list of complete frames
+        Args:
+            data: Bytes read from the socket
+        Returns:
+            List of frames (bytes, without the delimiter); empty frames are skipped
+        Raises:
+            FrameError: If a frame grows past max_frame_size
+        """
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        start = 0
+        pos = buffer.find(self.delimiter, self._scan_from)
+        while pos != -1:
+            if pos - start > self.max_frame_size:
+                raise FrameError(f"frame of {pos - start} bytes exceeds {self.max_frame_size}")
+            if pos > start:
+                frames.append(bytes(buffer[start:pos]))
+            start = pos + len(self.delimiter)
+            pos = buffer.find(self.delimiter, start)
+
+        # Drop consumed bytes once per feed instead of once per frame
+        if start:
+            del buffer[:start]
+        if len(buffer) > self.max_frame_size:
+            raise FrameError(f"partial frame of {len(buffer)} bytes exceeds {self.max_frame_size}")
+        # A multi-byte delimiter may straddle the next feed() boundary
+        self._scan_from = max(0, len(buffer) - len(self.delimiter) + 1)
+        return frames
+
+# ============= Message Encoding =============
+# encode_message/decode_message use orjson when it is installed and the
+# stdlib json module otherwise. Both write compact UTF-8 JSON, so peers see
+# the same bytes whichever codec the sender has.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CODEC = 'orjson' if orjson is not None else 'json'
+_json_encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+if orjson is not None:
+    def encode_message(message):
+        """Serialize a message to one newline-terminated frame (bytes)"""
+        return orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE)
+
+    decode_message = orjson.loads  # Raises orjson.JSONDecodeError, a json.JSONDecodeError
+else:
+    def encode_message(message):
+        """Serialize a message to one newline-terminated frame (bytes)"""
+        return (_json_encode(message) + '\n').encode()
+
+    decode_message = json.loads
+
+# ============= Socket Writes =============
+IOV_MAX = 1024  # Most buffers passed to one sendmsg() call
+
+def set_nodelay(sock):
+    """Disable Nagle's algorithm; writes are already batched by the sender"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+def write_frames(sock, frames):
+    """
+    Write a batch of frames to a blocking socket in as few syscalls as possible
+    Uses one vectored sendmsg() per IOV_MAX frames where the platform has it
+    (falls back to a single sendall of the joined bytes, e.g. on Windows)
+    Args:
+        sock: Connected blocking socket
+        frames: List of encoded frames
+    Returns:
+        Number of write syscalls made
+    """
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(frames))
+        return 1
+    buffers = [memoryview(frame) for frame in frames if frame]
+    calls = 0
+    i = 0
+    while i < len(buffers):
+        sent = sock.sendmsg(buffers[i:i + IOV_MAX])
+        calls += 1
+        # Skip fully written buffers and trim a partially written one
+        while sent and i < len(buffers):
+            size = len(buffers[i])
+            if sent >= size:
+                sent -= size
+                i += 1
+            else:
+                buffers[i] = buffers[i][sent:]
+                sent = 0
+    return calls
+
+# ============= Board Encoding =============
+# Board cells are 0 (empty) or a colour name. The "packed" encoding stores a
+# palette index per cell in 4 bits, two cells per byte, as base64 text:
+# a 20x10 board becomes 136 characters instead of ~1.5 KB of JSON lists.
+BOARD_ENCODING_PACKED = 'packed'
+BOARD_ENCODINGS = (BOARD_ENCODING_PACKED,)  # Encodings this build can send and receive
+BOARD_COLUMNS = 10
+
+PALETTE = (0, "purple", "cyan", "yellow", "green", "red", "orange", "gray")
+PALETTE_INDEX = {color: index for index, color in enumerate(PALETTE)}
+UNKNOWN_COLOR_INDEX = PALETTE_INDEX["gray"]  # Fallback for colours not in the palette
+_NIBBLE_COLORS = PALETTE + ("gray",) * (16 - len(PALETTE))  # Any 4-bit value decodes safely
+
+def pack_board(board):
+    """
+    Pack a board (list of rows of 0/colour) into raw bytes, one nibble per cell
+    Args:
+        board: List of rows, each a list of 0 or colour names
+    Returns:
+        bytes of length ceil(cells / 2)
+    """
+    index = PALETTE_INDEX
+    cells = [index.get(cell, UNKNOWN_COLOR_INDEX) if cell else 0 for row in board for cell in row]
+    if len(cells) % 2:
+        cells.append(0)
+    return bytes((cells[i] << 4) | cells[i + 1] for i in range(0, len(cells), 2))
+
+def unpack_board(packed, columns=BOARD_COLUMNS):
+    """
+    Unpack bytes made by pack_board back into a list-of-rows board
+    Args:
+        packed: Raw nibble-packed cells
+        columns: Board width in cells
+    Returns:
+        List of rows, each a list of 0 or colour names
+    """
+    cells = []
+    for byte in packed:
+        cells.append(_NIBBLE_COLORS[byte >> 4])
+        cells.append(_NIBBLE_COLORS[byte & 0x0F])
+    rows = len(cells) // columns
+    return [cells[y * columns:(y + 1) * columns] for y in range(rows)]
+
+def encode_board(board):
+    """
+    Pack a board (list of rows of 0/colour) into a base64 palette string
+    Args:
+        board: List of rows, each a list of 0 or colour names
+    Returns:
+        ASCII string suitable for a JSON message
+    """
+    return base64.b64encode(pack_board(board)).decode('ascii')
+
+def decode_board(data, columns=BOARD_COLUMNS):
+    """
+    Unpack a string made by encode_board back into a list-of-rows board
+    Args:
+        data: base64 palette string
+        columns: Board width in cells
+    Returns:
+        List of rows, each a list of 0 or colour names
+    """
+    return unpack_board(base64.b64decode(data), columns)
+
+def choose_board_encoding(offered):
+    """
+    Pick the board encoding to use with a peer
+    Args:
+        offered: Encodings the peer said it supports
+    Returns:
+        The first mutually supported encoding, or None for plain JSON lists
+    """
+    for encoding in BOARD_ENCODINGS:
+        if encoding in offered:
+            return encoding
+    return None
+
+# ============= Delta Board Sync =============
+# Between keyframes ('board' messages carrying a 'seq') senders only send
+# 'board_delta' messages with the cells that changed since the previous
+# message plus the current piece. Receivers that see a gap in 'seq' send a
+# 'keyframe_request' and ignore deltas until the next keyframe arrives.
+KEYFRAME_INTERVAL = 50  # Send a full board at least every N board messages
+
+def board_changes(old, new):
+    """
+    List the cells that differ between two boards
+    Args:
+        old: Previous board (list of rows)
+        new: Current board (list of rows)
+    Returns:
+        Flat list [cell_index, palette_index, ...] where cell_index = y * columns + x
+    """
+    changes = []
+    columns = len(new[0]) if new else BOARD_COLUMNS
+    index = PALETTE_INDEX
+    for y, (old_row, new_row) in enumerate(zip(old, new)):
+        if old_row == new_row:
+            continue
+        for x, cell in enumerate(new_row):
+            if cell != old_row[x]:
+                changes.append(y * columns + x)
+                changes.append(index.get(cell, UNKNOWN_COLOR_INDEX) if cell else 0)
+    return changes
+
+def apply_board_changes(board, changes):
+    """
+    Apply a change list from board_changes to a board in place
+    Args:
+        board: Board to update (list of rows)
+        changes: Flat list [cell_index, palette_index, ...]
+    """
+    columns = len(board[0])
+    for i in range(0, len(changes), 2):
+        y, x = divmod(changes[i], columns)
+        board[y][x] = _NIBBLE_COLORS[changes[i + 1] & 0x0F]
+
+# ============= Session Resume =============
+# A player who reconnects within the server's grace window sends
+# {"type": "resume", "token": ..., "username": ...} as the handshake frame
+# instead of a bare username, and gets back one 'resume' message whose
+# 'snapshot' holds both boards and scores, zlib-compressed and base64 encoded.
+
+def encode_snapshot(state):
+    """
+    Compress a resume snapshot for a JSON message
+    Args:
+        state: JSON-serializable snapshot (boards already packed with encode_board)
+    Returns:
+        ASCII string suitable for a JSON message
+    """
+    data = json.dumps(state, separators=(',', ':')).encode()
+    return base64.b64encode(zlib.compress(data, 9)).decode('ascii')
+
+def decode_snapshot(data):
+    """
+    Unpack a string made by encode_snapshot
+    Args:
+        data: base64 string of the compressed snapshot
+    Returns:
+        The snapshot as a dict
+    """
+    return json.loads(zlib.decompress(base64.b64decode(data)))
@@ -0,0 +1,116 @@
+# Player records and the connection registry for the Tetris server
+# Every connected player has one Player record. The registry indexes the
+# records by connection and by username, and keeps the lobby (players not in
+# a room and not spectating) as its own index so lobby snapshots only touch
+# lobby players.
+
+class Player:
+    """
+    Server-side state of one connected player
+    A __slots__ record: smaller than a dict per player and faster attribute
+    access on the per-message path
+    """
+
+    __slots__ = ('conn', 'addr', 'username',
+                 'room',  # Room this player is playing in (back-pointer), or None
+                 'spectating',  # Room this player is watching, or None
+                 'board_encoding', 'board_delta',
+                 # Latest board of this player, kept so deltas can be expanded
+                 'board_keyframe', 'board_state', 'board_seq', 'current_piece', 'score',
+                 # Heartbeat state: last receive time, outstanding ping, smoothed RTT
+                 'last_seen', 'ping_id', 'ping_sent', 'rtt',
+                 # Token the client presents to resume after a drop; set while held for it
+                 'session', 'detached_at',
+                 # asyncio mode: handler task, reader and decoder, kept for worker hand-offs
+                 'task', 'reader', 'decoder',
+                 # Lobby version this client has seen; None until it gets a full snapshot
+                 'lobby_version',
+                 # Worker mode: key in the supervisor's queue, and whether the socket is being moved
+                 'shard_key', 'handoff')
+
+    def __init__(self, conn, addr, username, session=None, last_seen=0.0):
+        self.conn = conn
+        self.addr = addr
+        self.username = username
+        self.room = None
+        self.spectating = None
+        self.board_encoding = None
+        self.board_delta = False
+        self.board_keyframe = None
+        self.board_state = None
+        self.board_seq = None
+        self.current_piece = None
+        self.score = None
+        self.last_seen = last_seen
+        self.ping_id = 0
+        self.ping_sent = None
+        self.rtt = None
+        self.session = session
+        self.detached_at = None
+        self.task = None
+        self.reader = None
+        self.decoder = None
+        self.lobby_version = None
+        self.shard_key = None
+        self.handoff = False
+
+    def __repr__(self):
+        return f"Player({self.username!r}, {self.addr!r})"
+
+class PlayerRegistry:
+    """
+    Connected players indexed by connection and by username
+    Insertion-ordered dicts make add, remove and both lookups O(1) while
+    iteration stays in join order. Callers must hold the server lock and
+    call relocate() after changing a player's room or spectating pointer.
+    """
+
+    def __init__(self):
+        self.by_conn = {}  # connection -> Player
+        self.by_name = {}  # username -> Player (latest connection using that name)
+        self.lobby = {}  # connection -> Player, for players not in a room and not spectating
+
+    def __len__(self):
+        return len(self.by_conn)
+
+    def __iter__(self):
+        return iter(list(self.by_conn.values()))
+
+    def __contains__(self, player):
+        return self.by_conn.get(player.conn) is player
+
+    def add(self, player):
+        self.by_conn[player.conn] = player
+        self.by_name[player.username] = player
+        self.relocate(player)
+
+    def remove(self, player):
+        """Forget a player; returns False if they were not registered"""
+        if self.by_conn.get(player.conn) is not player:
+            return False
+        del self.by_conn[player.conn]
+        self.lobby.pop(player.conn, None)
+        if self.by_name.get(player.username) is player:
+            del self.by_name[player.username]
+        return True
+
+    def get(self, conn):
+        """Player using a connection, or None"""
+        return self.by_conn.get(conn)
+
+    def find(self, username):
+        """Player with a username, or None"""
+        return self.by_name.get(username)
+
+    def relocate(self, player):
+        """Update the lobby index after the player's room or spectating pointer changed"""
+        if self.by_conn.get(player.conn) is not player:
+            return
+        if player.room is None and player.spectating is None:
+            self.lobby[player.conn] = player
+        elif self.lobby.pop(player.conn, None) is not None:
+            player.lobby_version = None  # Needs a full snapshot when it comes back
+
+    def in_lobby(self):
+        """Players in the lobby, in join order"""
+        return list(self.lobby.values())
@@ -0,0 +1,392 @@
+# Match replays for Tetris Battle
+# The server records every game as a compact binary log (see ReplayRecorder)
+# and this module plays it back, either headless (--info) or in a Tk window
+# drawn with TetrisClient's board renderer.
+#
+#   python t_replay.py replays/20250101-120000_room3_alice_vs_bob.trpl --speed 2
+#
+# File layout: MAGIC, version byte, uint32 metadata length, metadata JSON,
+# then records of RECORD_HEADER (kind, player index, ms since start,
+# payload length) followed by the payload.
+import argparse
+import base64
+import bisect
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+from t_protocol import (PALETTE, PALETTE_INDEX, UNKNOWN_COLOR_INDEX, pack_board, unpack_board,
+                        apply_board_changes)
+
+MAGIC = b'TTRP'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sBI')  # magic, version, metadata length
+RECORD_HEADER = struct.Struct('<BBIH')  # kind, player, ms since start, payload length
+PIECE = struct.Struct('<BbbBBH')  # colour index, x, y, rows, columns, shape bits
+SCORE = struct.Struct('<i')
+CHECKSUM = struct.Struct('<I')
+
+# Record kinds
+REC_KEYFRAME = 1  # Payload: nibble-packed board (pack_board)
+REC_DELTA = 2  # Payload: (cell index, palette index) byte pairs
+REC_PIECE = 3  # Payload: PIECE, or empty when the player has no falling piece
+REC_SCORE = 4  # Payload: SCORE
+REC_CHECKSUM = 5  # Payload: CRC32 of the packed board after the preceding deltas
+REC_END = 6  # Player index is the winner (NO_PLAYER if unknown); no payload
+
+NO_PLAYER = 255
+REPLAY_BUFFER_SIZE = 64 * 1024  # Bytes buffered before a recording touches the disk
+CHECKSUM_INTERVAL = 10  # Deltas between board checksums
+REPLAY_SUFFIX = '.trpl'
+
+# ============= Recording =============
+
+def pack_piece(piece):
+    """Encode a falling piece dict as PIECE bytes (b'' for no piece)"""
+    if not piece:
+        return b''
+    shape = piece['shape']
+    bits = 0
+    for row in shape:
+        for cell in row:
+            bits = (bits << 1) | (1 if cell else 0)
+    color = PALETTE_INDEX.get(piece['color'], UNKNOWN_COLOR_INDEX)
+    return PIECE.pack(color, piece['x'], piece['y'], len(shape), len(shape[0]), bits)
+
+def unpack_piece(payload):
+    """Decode PIECE bytes back into a piece dict (None for no piece)"""
+    if not payload:
+        return None
+    color, x, y, rows, columns, bits = PIECE.unpack(payload)
+    shape = []
+    shift = rows * columns
+    for _ in range(rows):
+        row = []
+        for _ in range(columns):
+            shift -= 1
+            row.append((bits >> shift) & 1)
+        shape.append(row)
+    return {'shape': shape, 'color': PALETTE[color] if 0 < color < len(PALETTE) else 'gray',
+            'x': x, 'y': y}
+
+def replay_path(directory, room_id, players):
+    """File name for a new recording: start time, room and players"""
+    names = '_vs_'.join(''.join(c if c.isalnum() else '-' for c in name)[:24] for name in players)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(directory, f"{stamp}_room{room_id}_{names}{REPLAY_SUFFIX}")
+
+class ReplayRecorder:
+    """
+    Append-only writer for one game
+    Each record is built in memory and handed to a buffered file in a single
+    write() call, so recording adds a struct.pack and a memcpy to the relay
+    path and only touches the disk every REPLAY_BUFFER_SIZE bytes.
+    """
+
+    def __init__(self, path, players, meta=None):
+        """
+        Args:
+            path: File to create
+            players: Usernames in player-index order
+            meta: Extra JSON-serializable details stored in the header
+        """
+        self.players = {name: index for index, name in enumerate(players)}
+        self.pieces = [None] * len(players)  # Last recorded piece per player
+        self.deltas = [0] * len(players)  # Deltas since the last checksum
+        self.started = time.monotonic()
+        header = dict(meta or {}, players=list(players), started=time.time())
+        data = json.dumps(header).encode()
+        self.file = open(path, 'wb', buffering=REPLAY_BUFFER_SIZE)
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, len(data)) + data)
+        self.file.flush()  # A server killed mid-game still leaves a readable header
+
+    def _write(self, kind, player, payload=b''):
+        elapsed = int((time.monotonic() - self.started) * 1000)
+        try:
+            self.file.write(RECORD_HEADER.pack(kind, player, elapsed, len(payload)) + payload)
+        except ValueError:
+            pass  # Closed by the other player's thread at game end
+
+    def board(self, username, message):
+        """Record a keyframe from a 'board' message (packed or JSON lists)"""
+        player = self.players.get(username)
+        if player is None:
+            return
+        if 'cells' in message:
+            packed = base64.b64decode(message['cells'])
+        else:
+            packed = pack_board(message['board'])
+        self.deltas[player] = 0
+        self._write(REC_KEYFRAME, player, packed)
+        self.piece(username, message.get('current_piece'))
+
+    def delta(self, username, changes, board, piece=None):
+        """
+        Record a board delta, plus a checksum every CHECKSUM_INTERVAL deltas
+        Args:
+            username: Sender of the delta
+            changes: Flat [cell_index, palette_index, ...] list
+            board: Sender's board after applying the changes (for the checksum)
+            piece: Sender's current piece
+        """
+        player = self.players.get(username)
+        if player is None:
+            return
+        self._write(REC_DELTA, player, bytes(changes))
+        self.deltas[player] += 1
+        if self.deltas[player] >= CHECKSUM_INTERVAL:
+            self.deltas[player] = 0
+            self._write(REC_CHECKSUM, player, CHECKSUM.pack(zlib.crc32(pack_board(board))))
+        self.piece(username, piece)
+
+    def piece(self, username, piece):
+        """Record the falling piece when it moved, rotated or was replaced"""
+        player = self.players.get(username)
+        if player is None or piece == self.pieces[player]:
+            return
+        self.pieces[player] = piece
+        self._write(REC_PIECE, player, pack_piece(piece))
+
+    def score(self, username, value):
+        player = self.players.get(username)
+        if player is not None:
+            self._write(REC_SCORE, player, SCORE.pack(int(value)))
+
+    def end(self, winner):
+        """Record the result and close the file"""
+        self._write(REC_END, self.players.get(winner, NO_PLAYER))
+        self.close()
+
+    def close(self):
+        try:
+            self.file.close()
+        except (OSError, ValueError):
+            pass
+
+# ============= Playback =============
+
+def read_replay(path):
+    """
+    Load a replay file
+    Returns:
+        (metadata dict, list of (kind, player, ms, payload) records)
+    Raises:
+        ValueError: If the file is not a replay, or is empty or truncated
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < FILE_HEADER.size:
+        raise ValueError(f"{path} is empty or truncated ({len(data)} bytes)")
+    magic, version, meta_length = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} replay")
+    offset = FILE_HEADER.size
+    if offset + meta_length > len(data):
+        raise ValueError(f"{path} is truncated inside its metadata")
+    meta = json.loads(data[offset:offset + meta_length])
+    offset += meta_length
+    records = []
+    while offset < len(data):
+        if offset + RECORD_HEADER.size > len(data):
+            raise ValueError(f"{path} is truncated inside a record header at byte {offset}")
+        kind, player, ms, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(data):
+            raise ValueError(f"{path} is truncated inside a record payload at byte {offset}")
+        records.append((kind, player, ms, data[offset:offset + length]))
+        offset += length
+    return meta, records
+
+class ReplayState:
+    """Boards, pieces and scores of every player at one point of a replay"""
+
+    def __init__(self, player_count, rows=20, columns=10):
+        self.rows = rows
+        self.columns = columns
+        self.boards = [[[0] * columns for _ in range(rows)] for _ in range(player_count)]
+        self.pieces = [None] * player_count
+        self.scores = [0] * player_count
+        self.winner = None
+        self.checksum_errors = 0
+        self.time = 0
+
+    def apply(self, record):
+        kind, player, ms, payload = record
+        self.time = ms
+        if kind == REC_KEYFRAME:
+            self.boards[player] = unpack_board(payload, self.columns)
+        elif kind == REC_DELTA:
+            apply_board_changes(self.boards[player], list(payload))
+        elif kind == REC_PIECE:
+            self.pieces[player] = unpack_piece(payload)
+        elif kind == REC_SCORE:
+            self.scores[player] = SCORE.unpack(payload)[0]
+        elif kind == REC_CHECKSUM:
+            if zlib.crc32(pack_board(self.boards[player])) != CHECKSUM.unpack(payload)[0]:
+                self.checksum_errors += 1
+        elif kind == REC_END:
+            self.winner = player if player != NO_PLAYER else None
+
+    def copy(self):
+        state = ReplayState.__new__(ReplayState)
+        state.__dict__.update(self.__dict__)
+        state.boards = [[row[:] for row in board] for board in self.boards]
+        state.pieces = list(self.pieces)
+        state.scores = list(self.scores)
+        return state
+
+class Replay:
+    """
+    A loaded replay with a seek index
+    While loading, the full state is snapshotted at every keyframe record,
+    so seeking restores the nearest earlier snapshot and applies at most one
+    keyframe interval of records.
+    """
+
+    def __init__(self, path):
+        self.meta, self.records = read_replay(path)
+        self.players = self.meta.get('players', [])
+        self.duration = self.records[-1][2] if self.records else 0
+        self.snapshots = []  # (ms, index of next record, state)
+        state = ReplayState(len(self.players))
+        for index, record in enumerate(self.records):
+            state.apply(record)
+            if record[0] == REC_KEYFRAME:
+                self.snapshots.append((record[2], index + 1, state.copy()))
+        self.final = state
+        self.snapshot_times = [ms for ms, _, _ in self.snapshots]
+
+    def seek(self, ms):
+        """
+        Rebuild the state at a time offset
+        Returns:
+            (state, index of the next record to apply)
+        """
+        i = bisect.bisect_right(self.snapshot_times, ms) - 1
+        if i >= 0:
+            _, index, snapshot = self.snapshots[i]
+            state = snapshot.copy()
+        else:
+            index, state = 0, ReplayState(len(self.players))
+        index = self.advance(state, index, ms)
+        state.time = ms
+        return state, index
+
+    def advance(self, state, index, ms):
+        """Apply records up to and including time ms; returns the next record index"""
+        records = self.records
+        while index < len(records) and records[index][2] <= ms:
+            state.apply(records[index])
+            index += 1
+        return index
+
+class ReplayViewer:
+    """
+    Tk window that plays a replay with TetrisClient's board renderer
+    Space pauses, Left/Right seek by SEEK_STEP seconds, Home restarts
+    """
+
+    FRAME_MS = 16
+    SEEK_STEP = 5.0
+
+    def __init__(self, replay, speed=1.0, start=0.0):
+        import tkinter as tk
+        from t_client import TetrisClient, TILE_SIZE, COLUMNS, ROWS
+
+        # Borrow the client's drawing code so replays look like the live game
+        self.draw_board = TetrisClient.draw_board.__get__(self)
+        self.draw_tile = TetrisClient.draw_tile.__get__(self)
+
+        self.replay = replay
+        self.speed = speed
+        self.paused = False
+        self.root = tk.Tk()
+        self.root.title(f"Tetris Replay - {' vs '.join(replay.players)}")
+        self.root.configure(bg="#1a1a2e")
+        self.canvases = []
+        self.labels = []
+        for column, name in enumerate(replay.players):
+            label = tk.Label(self.root, text=name, font=('Helvetica', 14, 'bold'),
+                             fg="#ffd369", bg="#1a1a2e")
+            label.grid(row=0, column=column, pady=5)
+            canvas = tk.Canvas(self.root, width=COLUMNS * TILE_SIZE, height=ROWS * TILE_SIZE,
+                               bg="black", highlightthickness=0)
+            canvas.grid(row=1, column=column, padx=10)
+            self.labels.append(label)
+            self.canvases.append(canvas)
+        self.clock_label = tk.Label(self.root, font=('Helvetica', 12), fg="white", bg="#1a1a2e")
+        self.clock_label.grid(row=2, column=0, columnspan=max(1, len(replay.players)), pady=5)
+
+        self.root.bind('<space>', lambda e: self.toggle_pause())
+        self.root.bind('<Left>', lambda e: self.seek(self.position - self.SEEK_STEP * 1000))
+        self.root.bind('<Right>', lambda e: self.seek(self.position + self.SEEK_STEP * 1000))
+        self.root.bind('<Home>', lambda e: self.seek(0))
+        self.seek(start * 1000)
+        self.last_frame = time.perf_counter()
+        self.root.after(self.FRAME_MS, self.tick)
+        self.root.mainloop()
+
+    def seek(self, ms):
+        self.position = max(0.0, min(float(self.replay.duration), ms))
+        self.state, self.index = self.replay.seek(self.position)
+        self.render()
+
+    def toggle_pause(self):
+        self.paused = not self.paused
+
+    def tick(self):
+        now = time.perf_counter()
+        if not self.paused and self.position < self.replay.duration:
+            self.position = min(self.replay.duration,
+                                self.position + (now - self.last_frame) * 1000 * self.speed)
+            self.index = self.replay.advance(self.state, self.index, self.position)
+            self.render()
+        self.last_frame = now
+        self.root.after(self.FRAME_MS, self.tick)
+
+    def render(self):
+        state = self.state
+        for player, canvas in enumerate(self.canvases):
+            self.draw_board(canvas, state.boards[player], state.pieces[player])
+            text = f"{self.replay.players[player]}  -  {state.scores[player]}"
+            if state.winner == player and self.index >= len(self.replay.records):
+                text += "  (winner)"
+            self.labels[player].config(text=text)
+        status = "paused" if self.paused else f"x{self.speed:g}"
+        self.clock_label.config(text=f"{self.position / 1000:6.1f}s / {self.replay.duration / 1000:.1f}s  {status}")
+
+def print_info(path, replay):
+    """Summarize a replay without opening a window"""
+    counts = {}
+    for kind, _, _, _ in replay.records:
+        counts[kind] = counts.get(kind, 0) + 1
+    names = {REC_KEYFRAME: 'keyframes', REC_DELTA: 'deltas', REC_PIECE: 'pieces',
+             REC_SCORE: 'scores', REC_CHECKSUM: 'checksums', REC_END: 'end'}
+    final = replay.final
+    winner = replay.players[final.winner] if final.winner is not None else '-'
+    print(f"{path}: {os.path.getsize(path)} bytes, {replay.duration / 1000:.1f}s, "
+          f"players {', '.join(replay.players)}, winner {winner}")
+    print('  ' + ', '.join(f"{names[kind]}={count}" for kind, count in sorted(counts.items())))
+    print(f"  scores {final.scores}, checksum mismatches {final.checksum_errors}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Play back a recorded Tetris Battle match")
+    parser.add_argument('path', help="Replay file written by the server")
+    parser.add_argument('--speed', type=float, default=1.0, help="Playback speed multiplier")
+    parser.add_argument('--seek', type=float, default=0.0, help="Start at this many seconds")
+    parser.add_argument('--info', action='store_true', help="Print a summary instead of playing")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        replay = Replay(args.path)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Cannot read replay: {e}")
+    if args.info:
+        print_info(args.path, replay)
+    else:
+        ReplayViewer(replay, args.speed, args.seek)
@@ -1,303 +1,1817 @@
 # Import required libraries
+import atexit
 import socket
 import threading
 import json
-import heapq  # For the priority queue implementation
+import logging
+import asyncio  # For the event-loop server mode
+import argparse
+import base64
+import os
+import itertools
+import collections
+import secrets
+import time
+
+from t_leaderboard import Leaderboard, LEADERBOARD_DB
+from t_log import log, sampler, setup_logging, parse_sample_rates
+from t_matchmaking import Matchmaker
+from t_registry import Player, PlayerRegistry
+from t_metrics import Metrics, TimedLock, start_metrics_server, start_stats_dump
+from t_protocol import (FrameDecoder, RECV_SIZE, BOARD_ENCODING_PACKED,
+                        encode_board, decode_board, choose_board_encoding,
+                        apply_board_changes, set_nodelay, write_frames,
+                        encode_snapshot, encode_message, decode_message, CODEC)
+from t_replay import ReplayRecorder, replay_path
+from t_shard import ShardLink, run_supervisor
 
 # Server configuration
 HOST = '192.168.251.73'  # Bind to all interfaces
 PORT = 5555
+SERVER_MODE = 'thread'  # 'thread' (one OS thread per client) or 'asyncio' (single event loop)
+BACKLOG = 1024  # Pending connection queue size for the listening socket
+
+# Outbound queue limits per connection (see OutboundQueue for the overflow policy)
+SEND_QUEUE_MAX_FRAMES = 256  # Frames waiting to be written to one client
+SEND_QUEUE_MAX_BYTES = 1024 * 1024  # Bytes waiting to be written to one client
+SEND_QUEUE_MAX_DROPS = 200  # Dropped frames without write progress before disconnecting
+TRANSPORT_HIGH_WATER = 64 * 1024  # asyncio transport buffer before drain() waits
+CLOSE_FLUSH_TIMEOUT = 5.0  # Seconds a closing socket may spend flushing its queue
+SEND_BATCH_INTERVAL = 0.0  # Seconds to collect outbound frames into one write (0 writes at once)
+MATCHMAKING_INTERVAL = 1.0  # Seconds between retries that widen waiting players' match windows
+LOBBY_UPDATE_INTERVAL = 0.1  # Seconds between coalesced lobby broadcasts
+LOBBY_PAGE_SIZE = 200  # Players per 'lobby' snapshot message
+HEARTBEAT_INTERVAL = 5.0  # Seconds between pings to each client
+IDLE_TIMEOUT = 20.0  # Seconds without any data from a client before it is disconnected
+SESSION_GRACE = 30.0  # Seconds a dropped player's match is held for them to resume (0 disables)
+RTT_SMOOTHING = 0.125  # Weight of a new sample in the smoothed round-trip time
+METRICS_HOST = '127.0.0.1'  # Metrics endpoint is local-only
+METRICS_PORT = 5556  # Plain-text metrics at http://127.0.0.1:5556/metrics (0 disables)
+STATS_INTERVAL = 0  # Seconds between metrics dumps to stdout (0 disables)
+WORKERS = 1  # Worker processes sharing the port (more than 1 implies asyncio mode)
+SPECTATOR_MAX_BACKLOG = 4  # Queued frames at which a spectator starts skipping board snapshots
+REPLAY_DIR = 'replays'  # Directory for match recordings (empty disables recording)
+LEADERBOARD_PATH = LEADERBOARD_DB  # SQLite file for the server leaderboard (empty disables it)
+LOG_LEVEL = 'info'  # 'debug' also traces every received message (see --log-sample)
+LOG_SAMPLE = 'board=50,board_delta=50,pong=10'  # Trace 1 in N messages of these types at debug level
+
+# Message types counted under their own label; anything else is counted as 'other'
+MESSAGE_TYPES = {'hello', 'ready', 'score', 'board', 'board_delta', 'keyframe_request', 'lose',
+                 'chat', 'request_lobby', 'rematch_request', 'rematch_accepted',
+                 'list_rooms', 'spectate', 'stop_spectating',
+                 'leaderboard_top', 'leaderboard_rank', 'leaderboard_around', 'pong'}
+
+# 'event' values on 'system' notices, for clients that react to a notice
+# rather than just showing its text
+EVENT_OPPONENT_LEFT = 'opponent_left'  # The other player is gone; the match is over
+EVENT_OPPONENT_HELD = 'opponent_held'  # The other player dropped; their seat is held for a resume
+EVENT_OPPONENT_RESUMED = 'opponent_resumed'
+EVENT_MATCH_ENDED = 'match_ended'  # Sent to spectators
+EVENT_MATCH_UNAVAILABLE = 'match_unavailable'
+
+# Messages that never change, encoded once
+KEYFRAME_REQUEST_FRAME = encode_message({'type': 'keyframe_request'})
+REMATCH_ACCEPTED_FRAME = encode_message({'type': 'rematch_accepted'})
+RESUME_FAILED_FRAME = encode_message({'type': 'resume_failed'})
+MATCH_ENDED_FRAME = encode_message({'type': 'system', 'event': EVENT_MATCH_ENDED,
+                                    'message': 'The match has ended.'})
+MATCH_UNAVAILABLE_FRAME = encode_message({'type': 'system', 'event': EVENT_MATCH_UNAVAILABLE,
+                                          'message': 'That match is not available.'})
 
 # Global data structures for managing game state
-clients = []  # List of connected clients with their connection info and usernames
-ready_status = {}  # Dictionary tracking whether each player is ready
-lock = threading.Lock()  # Thread safety for shared data access
-rematch_requests = {}  # Dictionary tracking rematch requests
+registry = PlayerRegistry()  # Connected players by connection and by username
+ready_status = {}  # Lobby players -> ready flag; its keys are the players listed in the lobby
+metrics = Metrics()  # Runtime counters and histograms (see t_metrics)
+lock = TimedLock(metrics)  # Thread safety for shared data access; hold times are recorded
+rooms = {}  # Active match rooms keyed by room id
+sessions = {}  # Session token -> client record, including players held after a drop
+matchmaker = Matchmaker()  # Ready lobby players waiting to be paired by rating
+leaderboard = None  # Leaderboard of finished games, opened at startup
+log_handler = None  # Queue handler in front of the log writer thread, set up at startup
+next_room_id = itertools.count(1)
+
+# Lobby broadcast state: changes are coalesced and sent as versioned diffs
+lobby_dirty = False  # Lobby changed since the last broadcast
+lobby_view = {}  # username -> lobby entry as last broadcast
+lobby_version = 0  # Version of lobby_view; every broadcast diff bumps it
+
+# Priority queue for managing lobby order (indexed heap keyed by username)
+# Readiness changes and disconnects update one entry in O(log n)
+
+# Worker state when running as one of several processes (see t_shard)
+shard = None  # ShardLink to the supervisor, which does the matchmaking for all workers
+shard_clients = {}  # shard key -> client record queued with the supervisor
+shard_keys = itertools.count(1)
+
+class Room:
+    """
+    An isolated 1v1 match
+    Holds its own player connections, ready state and rematch state so
+    messages are routed only between the two players of the match
+    """
+
+    def __init__(self, room_id, players):
+        self.room_id = room_id
+        self.players = {client.username: client for client in players}
+        self.ready = {name: False for name in self.players}  # Per-room ready state
+        self.rematch_requests = {}  # Requesting username -> opponent username
+        self.in_progress = False
+        self.spectators = {}  # Connection -> client record of everyone watching
+        self.recorder = None  # ReplayRecorder for the game in progress
+        self.winner = None  # Winner of the last finished game, told to players who resume later
+
+    def opponent_of(self, username):
+        """Return the Player record of the other player, or None"""
+        for name, client in self.players.items():
+            if name != username:
+                return client
+        return None
+
+    def send(self, message, sender_conn=None):
+        """
+        Send a message to every player in the room except the sender
+        Args:
+            message: The message to send, or an already-encoded frame (bytes)
+            sender_conn: Optional connection to exclude
+        """
+        data = message if isinstance(message, bytes) else encode_message(message)
+        for client in list(self.players.values()):
+            conn = client.conn
+            if conn != sender_conn:
+                try:
+                    conn.send(data)
+                except:
+                    pass
+
+    def send_board(self, message, sender_conn=None):
+        """
+        Relay a board snapshot to the opponent in the encoding they negotiated
+        Packed boards are forwarded untouched to packed receivers and only
+        expanded to JSON lists for receivers that did not negotiate an encoding
+        Args:
+            message: The board message as received from the sender
+            sender_conn: Connection of the sender, excluded from the relay
+        """
+        encoded = {}  # One serialization per target encoding
+        for client in list(self.players.values()):
+            conn = client.conn
+            if conn == sender_conn:
+                continue
+            encoding = client.board_encoding
+            data = encoded.get(encoding)
+            if data is None:
+                data = encode_message(board_message(message, encoding))
+                encoded[encoding] = data
+            try:
+                conn.send(data, droppable=True)
+            except:
+                pass
+
+    def send_board_delta(self, sender, message):
+        """
+        Relay a board delta to the opponent
+        Receivers that negotiated deltas get the delta as-is; others get a
+        full board rebuilt from the sender's server-side board state
+        Args:
+            sender: Client record of the sender (its board state is already updated)
+            message: The board_delta message as received
+        """
+        encoded = {}  # One serialization per target format
+        for client in list(self.players.values()):
+            if client is sender:
+                continue
+            key = 'delta' if client.board_delta else client.board_encoding
+            data = encoded.get(key)
+            if data is None:
+                if key == 'delta':
+                    out = {'type': 'board_delta', 'seq': message['seq'], 'changes': message['changes']}
+                    if 'current_piece' in message:
+                        out['current_piece'] = message['current_piece']
+                else:
+                    out = board_message(keyframe_of(sender), key)
+                data = encode_message(out)
+                encoded[key] = data
+            try:
+                client.conn.send(data, droppable=True)
+            except:
+                pass
+
+    def send_spectators(self, data, droppable=False):
+        """
+        Send one already-encoded frame to every spectator
+        Board snapshots (droppable) are skipped for spectators whose send
+        queue is backed up, so slow viewers see a lower frame rate instead
+        of building a backlog
+        Args:
+            data: Encoded frame, shared by all spectators
+            droppable: True for board snapshots
+        """
+        skipped = 0
+        for conn in list(self.spectators):
+            if droppable and len(conn.queue) >= SPECTATOR_MAX_BACKLOG:
+                skipped += 1
+                continue
+            try:
+                conn.send(data, droppable=droppable)
+            except:
+                pass
+        if skipped:
+            metrics.count('tetris_spectator_frames_skipped_total', skipped)
+
+    def send_spectator_board(self, player, message):
+        """
+        Send a player's full board to the spectators
+        Serialized once per board encoding in use, whatever the number of viewers
+        Args:
+            player: Username of the board's owner
+            message: Full board message ('board' list or packed 'cells')
+        """
+        groups = {}  # Board encoding -> spectator connections
+        for conn, client in list(self.spectators.items()):
+            if len(conn.queue) >= SPECTATOR_MAX_BACKLOG:
+                metrics.count('tetris_spectator_frames_skipped_total')
+                continue
+            groups.setdefault(client.board_encoding, []).append(conn)
+        for encoding, conns in groups.items():
+            out = board_message(message, encoding)
+            out['player'] = player
+            data = encode_message(out)
+            for conn in conns:
+                try:
+                    conn.send(data, droppable=True)
+                except:
+                    pass
+
+    def remove(self, username):
+        """Drop a player and any rematch requests involving them"""
+        self.players.pop(username, None)
+        self.ready.pop(username, None)
+        self.rematch_requests = {k: v for k, v in self.rematch_requests.items()
+                                 if k != username and v != username}
+
+def board_message(message, encoding):
+    """
+    Build the outgoing board message for a receiver's board encoding
+    Args:
+        message: Board message from the sender ('board' list or packed 'cells')
+        encoding: Receiver's negotiated board encoding, or None for JSON lists
+    """
+    out = {'type': 'board'}
+    if encoding == BOARD_ENCODING_PACKED:
+        out['encoding'] = BOARD_ENCODING_PACKED
+        if message.get('encoding') == BOARD_ENCODING_PACKED:
+            out['cells'] = message['cells']
+        else:
+            out['cells'] = encode_board(message['board'])
+    elif message.get('encoding') == BOARD_ENCODING_PACKED:
+        out['board'] = decode_board(message['cells'])
+    else:
+        out['board'] = message['board']
+    if 'seq' in message:
+        out['seq'] = message['seq']
+    if message.get('current_piece') is not None:
+        out['current_piece'] = message['current_piece']
+    return out
+
+def board_state(client):
+    """
+    Return a player's latest board as a list of rows
+    The last keyframe is only decoded when a delta or snapshot needs it
+    Args:
+        client: Client record of the board's owner
+    Returns:
+        The board, or None if no keyframe has been received yet
+    """
+    if client.board_state is None and client.board_keyframe is not None:
+        keyframe = client.board_keyframe
+        if keyframe.get('encoding') == BOARD_ENCODING_PACKED:
+            client.board_state = decode_board(keyframe['cells'])
+        else:
+            client.board_state = [list(row) for row in keyframe['board']]
+    return client.board_state
 
-# Priority queue for managing ready players (using a heap)
-# This ensures fair matching of players based on their readiness
-priority_queue = []  # A min-heap based priority queue (priority queue by readiness)
+def keyframe_of(client):
+    """
+    Build a full board message from a player's server-side board state
+    Args:
+        client: Client record of the board's owner
+    """
+    return {
+        'type': 'board',
+        'board': board_state(client),
+        'seq': client.board_seq,
+        'current_piece': client.current_piece
+    }
+
+def create_room(players):
+    """
+    Put a pair of lobby players into a new room and start their match
+    Must be called with the lock held
+    Args:
+        players: The two Player records to pair
+    """
+    room = Room(next(next_room_id), players)
+    rooms[room.room_id] = room
+    for client in players:
+        client.room = room
+        registry.relocate(client)
+        ready_status[client.username] = False
+        matchmaker.remove(client.username)
+    log.info("Room created", extra={'room': room.room_id, 'players': list(room.players)})
+    start_game(room)
+    return room
+
+def close_room(room):
+    """
+    Dissolve a room and send any remaining player back to the lobby
+    Must be called with the lock held
+    """
+    rooms.pop(room.room_id, None)
+    for client in room.players.values():
+        client.room = None
+        registry.relocate(client)
+        ready_status[client.username] = False
+    room.players.clear()
+    stop_recording(room)
+    # Spectators go back to the lobby too
+    room.send_spectators(MATCH_ENDED_FRAME)
+    for client in room.spectators.values():
+        client.spectating = None
+        registry.relocate(client)
+    room.spectators.clear()
+    log.info("Room closed", extra={'room': room.room_id})
+
+def start_recording(room):
+    """
+    Start recording the room's new game to REPLAY_DIR
+    Must be called with the lock held
+    """
+    stop_recording(room)
+    if not REPLAY_DIR:
+        return
+    try:
+        os.makedirs(REPLAY_DIR, exist_ok=True)
+        path = replay_path(REPLAY_DIR, room.room_id, list(room.players))
+        room.recorder = ReplayRecorder(path, list(room.players), {'room': room.room_id})
+    except OSError as e:
+        log.warning("Could not start recording", extra={'room': room.room_id, 'error': str(e)})
+
+def stop_recording(room, winner=None):
+    """
+    Finish the room's recording, if any, storing the winner
+    Must be called with the lock held
+    """
+    recorder = room.recorder
+    room.recorder = None
+    if recorder is not None:
+        recorder.end(winner)
 
 def broadcast(message, sender_conn=None):
     """
-    Broadcast a message to all connected clients except the sender
+    Broadcast a message to all connected lobby clients except the sender
     Args:
         message: The message to broadcast
         sender_conn: Optional connection to exclude from broadcast
     """
     with lock:
-        for client in clients:
-            conn = client['conn']
+        data = encode_message(message)
+        for client in registry.in_lobby():
+            conn = client.conn
             if conn != sender_conn:
                 try:
-                    conn.send((json.dumps(message) + '\n').encode())
+                    conn.send(data)
                 except:
                     pass
 
-def notify_opponent_left(disconnected_username):
+def notify_opponent_left(room, disconnected_username):
     """
-    Notify remaining players when someone disconnects
+    Notify the remaining player of a room when their opponent disconnects
     Args:
+        room: Room the disconnected player was in
         disconnected_username: Username of the player who disconnected
     """
-    for client in clients:
-        if client['username'] != disconnected_username:
-            try:
-                client['conn'].send(json.dumps({
-                    'type': 'system',
-                    'message': f'Opponent {disconnected_username} has left the game.'
-                }).encode() + b'\n')
-            except:
-                pass
+    room.send({
+        'type': 'system',
+        'event': EVENT_OPPONENT_LEFT,
+        'player': disconnected_username,
+        'message': f'Opponent {disconnected_username} has left the game.'
+    })
+
+def room_summary(room):
+    """Describe a room for the 'rooms' list sent to would-be spectators"""
+    return {'room': room.room_id, 'players': list(room.players),
+            'in_progress': room.in_progress, 'spectators': len(room.spectators),
+            # Players whose connection dropped and whose seat is held for a resume
+            'held': [name for name, client in room.players.items()
+                     if client.detached_at is not None]}
 
-def handle_client(conn, addr):
+def spectate(client, room):
     """
-    Handle communication with a connected client
+    Start watching a room: announce its players, then send their current boards and scores
+    Must be called with the lock held
     Args:
-        conn: Client socket connection
+        client: Client record of the spectator
+        room: Room to watch
+    """
+    if client.spectating is not None:
+        stop_spectating(client)
+    client.spectating = room
+    registry.relocate(client)
+    room.spectators[client.conn] = client
+    conn = client.conn
+    conn.send(encode_message(dict(room_summary(room), type='spectate')))
+    for name, player in room.players.items():
+        if board_state(player) is not None:
+            message = board_message(keyframe_of(player), client.board_encoding)
+            message['player'] = name
+            conn.send(encode_message(message), droppable=True)
+        if player.score is not None:
+            conn.send(encode_message({'type': 'score', 'player': name, 'value': player.score}))
+
+def stop_spectating(client):
+    """
+    Stop watching the current room, if any
+    Must be called with the lock held
+    """
+    room = client.spectating
+    if room is not None:
+        room.spectators.pop(client.conn, None)
+        client.spectating = None
+        registry.relocate(client)
+
+def register_client(conn, addr, username):
+    """
+    Add a newly connected player to the shared game state
+    Args:
+        conn: Client connection (socket or StreamConnection)
         addr: Client address
+        username: Username sent by the client on connect
+    Returns:
+        The client record used by handle_message
     """
-    global clients, ready_status, priority_queue, rematch_requests
-    try:
-        # Get username from client
-        username = conn.recv(1024).decode()
-        print(f"[{username}] Connected from {addr}")
-        
-        # Add client to tracking structures
-        with lock:
-            clients.append({'conn': conn, 'addr': addr, 'username': username})
+    log.info("Connected", extra={'player': username, 'addr': addr})
+    metrics.count('tetris_connections_total')
+
+    # Add client to tracking structures
+    client = Player(conn, addr, username, session=secrets.token_urlsafe(16), last_seen=time.monotonic())
+    with lock:
+        registry.add(client)
+        sessions[client.session] = client
+        ready_status[username] = False
+    conn.send(encode_message({'type': 'session', 'token': client.session,
+                           'grace': SESSION_GRACE}))
+    update_lobby()
+    return client
+
+def handshake(conn, addr, frame):
+    """
+    Handle a connection's first frame: a username, or a request to resume a session
+    A resume that can't be honoured falls back to a normal join under the
+    given username, after a 'resume_failed' so the client drops its old token
+    Args:
+        conn: Client connection (socket or StreamConnection)
+        addr: Client address
+        frame: Raw first frame without the delimiter
+    Returns:
+        The client record used by handle_message
+    """
+    request = None
+    if frame.startswith(b'{'):
+        try:
+            request = decode_message(frame)
+        except ValueError:
+            pass
+    if not isinstance(request, dict) or request.get('type') != 'resume':
+        return register_client(conn, addr, frame.decode(errors='replace').strip())
+    client = resume_client(conn, addr, request.get('token'))
+    if client is None:
+        metrics.count('tetris_resumes_total', label='failed')
+        conn.send(RESUME_FAILED_FRAME)
+        client = register_client(conn, addr, str(request.get('username') or ''))
+    return client
+
+def resume_client(conn, addr, token):
+    """
+    Reattach a dropped player to their match on a new connection
+    Works both while the player is held after a drop and when the old
+    connection has not been noticed as dead yet; the old one is then aborted.
+    Sends the player one compressed snapshot of both boards and scores.
+    Args:
+        conn: The new connection
+        addr: Client address
+        token: Session token from the player's 'session' message
+    Returns:
+        The player's client record, or None if there is no match to resume
+    """
+    with lock:
+        client = sessions.get(token)
+        if client is None or client.room is None:
+            return None
+        old_conn = client.conn
+        room = client.room
+        username = client.username
+        attached = client.detached_at is None
+        if attached:
+            registry.remove(client)
+        else:
             ready_status[username] = False
+        client.conn = conn
+        client.addr = addr
+        client.detached_at = None
+        client.last_seen = time.monotonic()
+        client.ping_sent = None
+        registry.add(client)
+        if attached:
+            # Half-open old connection: swapped out first, so its handler skips cleanup
+            old_conn.abort()
+        players = {}
+        for name, player in room.players.items():
+            board = board_state(player)
+            players[name] = {'board': encode_board(board) if board is not None else None,
+                             'seq': player.board_seq, 'current_piece': player.current_piece,
+                             'score': player.score}
+        opponent = room.opponent_of(username)
+        conn.send(encode_message({
+            'type': 'resume',
+            'room': room.room_id,
+            'opponent': opponent.username if opponent else None,
+            'in_progress': room.in_progress,
+            'winner': room.winner,
+            'snapshot': encode_snapshot({'players': players})
+        }))
+    log.info("Resumed session", extra={'player': username, 'addr': addr, 'room': room.room_id})
+    metrics.count('tetris_resumes_total', label='resumed')
+    room.send({'type': 'system', 'event': EVENT_OPPONENT_RESUMED, 'player': username,
+               'message': f'{username} reconnected.'}, sender_conn=conn)
+    return client
+
+def handle_message(client, msg):
+    """
+    Process a single decoded message from a client
+    Shared by the threaded and the asyncio server modes
+    Args:
+        client: Client record of the sender
+        msg: Decoded JSON message
+    """
+    conn = client.conn
+    username = client.username
+    room = client.room
+    if log.isEnabledFor(logging.DEBUG) and sampler.keep(msg['type']):
+        # Per-message tracing; costs one level check when DEBUG is off
+        log.debug("Received", extra={'player': username, 'type': msg['type']})
+
+    # Handle different message types
+    if msg['type'] == 'ready':
+        if room is not None:
+            # Ready inside a room (e.g. after a rematch) restarts that match
+            with lock:
+                room.ready[username] = msg['ready']
+                if not room.in_progress and len(room.players) == 2 and all(room.ready.values()):
+                    start_game(room)
+            return
+
+        # Update player's ready status
+        with lock:
+            # Queueing for a match ends spectating
+            stop_spectating(client)
+            ready_status[username] = msg['ready']
+
+            # Queue for a rating-matched opponent, or leave the queue
+            if shard is not None:
+                # The supervisor pairs players across all workers
+                if ready_status[username]:
+                    queue_sharded(client)
+                else:
+                    unqueue_sharded(client)
+            elif ready_status[username]:
+                pair = matchmaker.enqueue(username, client)
+                if pair:
+                    create_room(list(pair))
+            else:
+                matchmaker.remove(username)
         update_lobby()
 
-        # Add player to priority queue with initial readiness (0)
-        heapq.heappush(priority_queue, (0, username))
+    elif msg['type'] == 'score':
+        # Forward score updates to the opponent and the spectators
+        client.score = msg['value']
+        if room is not None:
+            room.send({'type': 'score', 'value': msg['value']}, sender_conn=conn)
+            recorder = room.recorder
+            if recorder is not None:
+                recorder.score(username, msg['value'])
+            if room.spectators:
+                room.send_spectators(encode_message({'type': 'score', 'player': username,
+                                                  'value': msg['value']}))
 
-        # Main message handling loop
+    elif msg['type'] == 'board':
+        # Remember the keyframe (decoded lazily) and forward it to the opponent
+        client.board_keyframe = msg
+        client.board_state = None
+        client.board_seq = msg.get('seq')
+        client.current_piece = msg.get('current_piece')
+        if room is not None:
+            room.send_board(msg, sender_conn=conn)
+            if room.spectators:
+                room.send_spectator_board(username, msg)
+            recorder = room.recorder
+            if recorder is not None:
+                recorder.board(username, msg)
+
+    elif msg['type'] == 'board_delta':
+        board = board_state(client)
+        seq = msg.get('seq')
+        if board is None or client.board_seq is None or seq != client.board_seq + 1:
+            # Lost track of the sender's board; drop deltas until a new keyframe
+            conn.send(KEYFRAME_REQUEST_FRAME)
+            return
+        apply_board_changes(board, msg['changes'])
+        client.board_seq = seq
+        client.current_piece = msg.get('current_piece')
+        if room is not None:
+            room.send_board_delta(client, msg)
+            if room.spectators:
+                # Spectators get full snapshots so a skipped frame never needs a keyframe
+                room.send_spectator_board(username, keyframe_of(client))
+            recorder = room.recorder
+            if recorder is not None:
+                recorder.delta(username, msg['changes'], board, client.current_piece)
+
+    elif msg['type'] == 'keyframe_request':
+        # Answer from the opponent's server-side board when we have it
+        if room is None:
+            return
+        opponent = room.opponent_of(username)
+        if opponent is None:
+            return
+        if board_state(opponent) is not None:
+            conn.send(encode_message(board_message(keyframe_of(opponent), client.board_encoding)))
+        else:
+            opponent.conn.send(KEYFRAME_REQUEST_FRAME)
+
+    elif msg['type'] == 'hello':
+        # Negotiate the board encoding this connection sends and receives
+        client.board_encoding = choose_board_encoding(msg.get('board_encodings', []))
+        client.board_delta = bool(msg.get('board_delta'))
+        conn.send(encode_message({
+            'type': 'hello',
+            'board_encoding': client.board_encoding,
+            'board_delta': client.board_delta
+        }))
+
+    elif msg['type'] == 'lose':
+        log.info("Lost the game", extra={'player': username})
+        if room is None:
+            return
+        # Handle game over when a player loses
+        with lock:
+            loser_conn = conn
+            winner = room.opponent_of(username)
+            winner_conn = winner.conn if winner else None
+            winner_name = winner.username if winner else None
+            if winner_name and room.in_progress:
+                # Rate each match once, even if both players report a loss
+                if shard is not None:
+                    shard.send({'op': 'result', 'winner': winner_name, 'loser': username})
+                else:
+                    matchmaker.record_result(winner_name, username)
+                stop_recording(room, winner_name)
+                if leaderboard is not None:
+                    # Both final scores go on the server leaderboard; record() only
+                    # updates the in-memory ranks, the commit happens on its writer thread
+                    for player in (client, winner):
+                        if player.score is not None:  # Never reported a score
+                            leaderboard.record(player.username, player.score)
+            room.in_progress = False
+            room.winner = winner_name
+            for name in room.ready:
+                room.ready[name] = False
+
+        if room.spectators:
+            room.send_spectators(encode_message({'type': 'game_over', 'winner': winner_name}))
+
+        # Send game over messages to both players
+        try:
+            # Send lose message to loser
+            loser_conn.send(encode_message({
+                'type': 'game_over',
+                'result': 'lose',
+                'winner': winner_name
+            }))
+        except Exception as e:
+            log.warning("Failed to send lose message", extra={'player': username, 'error': str(e)})
+
+        if winner_conn:
+            try:
+                # Send win message to winner
+                winner_conn.send(encode_message({
+                    'type': 'game_over',
+                    'result': 'win',
+                    'winner': winner_name
+                }))
+            except Exception as e:
+                log.warning("Failed to send win message", extra={'player': winner_name, 'error': str(e)})
+
+    elif msg['type'] == 'chat':
+        # Handle chat messages (in-match chat stays inside the room)
+        chat = {
+            'type': 'chat',
+            'from': username,
+            'message': msg['message']
+        }
+        if room is not None:
+            data = encode_message(chat)
+            room.send(data)
+            room.send_spectators(data)
+        elif client.spectating is not None:
+            # Spectator chat stays among the spectators of the match
+            client.spectating.send_spectators(encode_message(chat))
+        else:
+            broadcast(chat)
+
+    elif msg['type'] == 'request_lobby':
+        # Full lobby snapshot: every page, or the one asked for
+        with lock:
+            page = msg.get('page')
+            for frame in lobby_snapshot(page):
+                conn.send(frame)
+            if page is None and client.room is None and client.spectating is None:
+                # Diffs from the next broadcast apply on top of this snapshot
+                client.lobby_version = lobby_version
+
+    elif msg['type'] == 'list_rooms':
+        # Matches that can be watched
+        with lock:
+            summaries = [room_summary(r) for r in rooms.values()]
+        conn.send(encode_message({'type': 'rooms', 'rooms': summaries}))
+
+    elif msg['type'] == 'spectate':
+        # Watch a match, chosen by room id or by one of its players
+        if room is not None:
+            return
+        with lock:
+            target = rooms.get(msg.get('room'))
+            if target is None and msg.get('player'):
+                player = registry.find(msg['player'])
+                target = player.room if player else None
+            if target is not None:
+                # Spectators leave the matchmaking queue
+                ready_status[username] = False
+                matchmaker.remove(username)
+                if shard is not None:
+                    unqueue_sharded(client)
+                spectate(client, target)
+        if target is None:
+            conn.send(MATCH_UNAVAILABLE_FRAME)
+        update_lobby()
+
+    elif msg['type'] == 'stop_spectating':
+        with lock:
+            stop_spectating(client)
+        update_lobby()
+
+    elif msg['type'] == 'pong':
+        # Round trip of our last ping; smoothed like TCP's SRTT
+        if msg.get('id') == client.ping_id and client.ping_sent is not None:
+            sample = time.monotonic() - client.ping_sent
+            client.ping_sent = None
+            rtt = client.rtt
+            client.rtt = sample if rtt is None else rtt + RTT_SMOOTHING * (sample - rtt)
+            metrics.observe('tetris_rtt_seconds', sample)
+
+    elif msg['type'] in ('leaderboard_top', 'leaderboard_rank', 'leaderboard_around'):
+        conn.send(encode_message(leaderboard_reply(msg, username)))
+
+    elif msg['type'] == 'rematch_request':
+        log.info("Requested rematch", extra={'player': username})
+        if room is None:
+            return
+        # Handle rematch request
+        with lock:
+            opponent = room.opponent_of(username)
+            if opponent:
+                # Store rematch request
+                room.rematch_requests[username] = opponent.username
+                # Send rematch request to opponent
+                try:
+                    opponent.conn.send(encode_message({
+                        'type': 'rematch_request',
+                        'from': username
+                    }))
+                except Exception as e:
+                    log.warning("Failed to send rematch request", extra={'player': username, 'error': str(e)})
+
+    elif msg['type'] == 'rematch_accepted':
+        log.info("Accepted rematch", extra={'player': username})
+        if room is None:
+            return
+        # Handle rematch acceptance
+        with lock:
+            opponent = room.opponent_of(username)
+            if opponent:
+                # Clear rematch requests for both players
+                room.rematch_requests.clear()
+
+                # Send rematch accepted to both players, then restart the match
+                room.send(REMATCH_ACCEPTED_FRAME)
+                start_game(room)
+
+def leaderboard_reply(msg, username):
+    """
+    Answer a leaderboard query
+    Args:
+        msg: 'leaderboard_top' (limit), 'leaderboard_rank' (name) or
+             'leaderboard_around' (name, radius); name defaults to the sender
+        username: Username of the sender
+    Returns:
+        'leaderboard' message with ranked entries, or a 'leaderboard_rank' message
+    """
+    kind = msg['type']
+    name = msg.get('name') or username
+    if leaderboard is None:
+        return {'type': 'leaderboard', 'query': kind, 'entries': [], 'total': 0}
+    with lock:
+        if kind == 'leaderboard_rank':
+            rank, score = leaderboard.rank(name)
+            return {'type': 'leaderboard_rank', 'name': name, 'rank': rank, 'score': score,
+                    'total': len(leaderboard)}
+        if kind == 'leaderboard_top':
+            entries = leaderboard.top(int(msg.get('limit', 10)))
+        else:
+            entries = leaderboard.around(name, int(msg.get('radius', 5)))
+        return {'type': 'leaderboard', 'query': kind, 'name': name, 'entries': entries,
+                'total': len(leaderboard)}
+
+def unregister_client(client):
+    """
+    Handle a player's connection closing
+    Players in a running match are held for SESSION_GRACE seconds so they
+    can resume; everyone else is removed at once
+    Args:
+        client: Client record of the disconnected player
+    """
+    if not hold_session(client):
+        remove_client(client)
+
+def hold_session(client):
+    """
+    Keep a dropped player's match open for them to resume
+    The player leaves the lobby and heartbeat lists; their room, board and
+    score stay, and messages sent to the closed connection are dropped.
+    Returns:
+        True if the player is now held, False if they should be removed
+    """
+    with lock:
+        room = client.room
+        if not SESSION_GRACE or room is None or not room.in_progress:
+            return False
+        remove_from_lobby(client)
+        client.detached_at = time.monotonic()
+    client.conn.close()
+    username = client.username
+    log.info("Connection lost, holding the match", extra={'player': username, 'grace': SESSION_GRACE})
+    metrics.count('tetris_sessions_held_total')
+    room.send({'type': 'system', 'event': EVENT_OPPONENT_HELD, 'player': username,
+               'message': f'{username} lost connection, waiting for them to reconnect...'})
+    return True
+
+def expire_sessions(now):
+    """
+    Remove held players whose grace window ran out or whose match has ended
+    Called from run_heartbeat
+    """
+    with lock:
+        expired = [client for client in sessions.values() if client.detached_at is not None
+                   and (now - client.detached_at > SESSION_GRACE or client.room is None)]
+        for client in expired:
+            client.detached_at = None
+    for client in expired:
+        metrics.count('tetris_resumes_total', label='expired')
+        remove_client(client)
+
+def remove_client(client):
+    """
+    Remove a disconnected player from the shared game state
+    Args:
+        client: Client record of the disconnected player
+    """
+    conn = client.conn
+    username = client.username
+    log.info("Disconnecting", extra={'player': username})
+    with lock:
+        sessions.pop(client.session, None)
+        remove_from_lobby(client)
+        stop_spectating(client)
+        # Leave the room; the remaining player goes back to the lobby
+        room = client.room
+        if room is not None:
+            room.remove(username)
+            client.room = None
+
+    if room is not None:
+        # Notify the opponent about disconnection
+        notify_opponent_left(room, username)
+        with lock:
+            close_room(room)
+    conn.close()
+    update_lobby()
+
+def remove_from_lobby(client):
+    """
+    Forget a player's lobby and matchmaking state
+    Must be called with the lock held
+    Args:
+        client: Client record of the player leaving this server process
+    """
+    conn = client.conn
+    username = client.username
+    registry.remove(client)
+    if username in ready_status:
+        del ready_status[username]
+    matchmaker.remove(username)
+    if shard is not None:
+        unqueue_sharded(client)
+
+def dispatch_frame(client, frame):
+    """
+    Decode one JSON frame and hand it to handle_message
+    Bad frames are logged and skipped without dropping the connection
+    Args:
+        client: Client record of the sender
+        frame: Raw frame bytes without the delimiter
+    """
+    started = time.perf_counter()
+    msg_type = 'invalid'
+    try:
+        msg = decode_message(frame)
+        msg_type = msg['type'] if msg.get('type') in MESSAGE_TYPES else 'other'
+        handle_message(client, msg)
+    except json.JSONDecodeError as e:
+        log.warning("Invalid JSON received", extra={'player': client.username, 'error': str(e)})
+    except Exception as e:
+        metrics.count('tetris_handler_errors_total', label=msg_type)
+        log.error("Error processing message", extra={'player': client.username, 'type': msg_type,
+                                                      'error': str(e)})
+    metrics.count('tetris_messages_received_total', label=msg_type)
+    metrics.observe('tetris_handler_seconds', time.perf_counter() - started, label=msg_type)
+
+class OutboundQueue:
+    """
+    Bounded queue of encoded frames waiting to be written to one client
+    Overflow policy: when the queue is over its frame or byte limit, queued
+    droppable frames (board snapshots/deltas, which newer ones supersede) are
+    discarded first. If that is not enough the new droppable frame is dropped,
+    and a non-droppable frame that still does not fit, or too many drops
+    since the last successful write, means the client must be disconnected.
+    """
+
+    def __init__(self, max_frames=None, max_bytes=None, max_drops=None):
+        self.frames = collections.deque()  # (data, droppable) pairs
+        self.queued_bytes = 0
+        self.max_frames = max_frames or SEND_QUEUE_MAX_FRAMES
+        self.max_bytes = max_bytes or SEND_QUEUE_MAX_BYTES
+        self.max_drops = max_drops or SEND_QUEUE_MAX_DROPS
+        self.drops_since_write = 0
+        self.dropped_total = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _full(self, extra_bytes):
+        return (len(self.frames) >= self.max_frames or
+                self.queued_bytes + extra_bytes > self.max_bytes)
+
+    def push(self, data, droppable=False):
+        """
+        Queue a frame, applying the overflow policy
+        Args:
+            data: Encoded frame bytes
+            droppable: True for frames a newer frame makes obsolete
+        Returns:
+            False if the client should be disconnected, True otherwise
+        """
+        if self._full(len(data)):
+            # Drop every stale board frame still waiting in the queue
+            kept = collections.deque(item for item in self.frames if not item[1])
+            dropped = len(self.frames) - len(kept)
+            if dropped:
+                self.frames = kept
+                self.queued_bytes = sum(len(item[0]) for item in kept)
+                self.drops_since_write += dropped
+                self.dropped_total += dropped
+                metrics.count('tetris_frames_dropped_total', dropped)
+            if self._full(len(data)):
+                if not droppable:
+                    return False
+                self.drops_since_write += 1
+                self.dropped_total += 1
+                metrics.count('tetris_frames_dropped_total')
+                return self.drops_since_write < self.max_drops
+        self.frames.append((data, droppable))
+        self.queued_bytes += len(data)
+        return self.drops_since_write < self.max_drops
+
+    def pop_all(self):
+        """Remove every queued frame and return them for one vectored write"""
+        frames = [item[0] for item in self.frames]
+        self.frames.clear()
+        self.queued_bytes = 0
+        return frames
+
+    def written(self):
+        """Record that the writer made progress; resets the drop threshold"""
+        self.drops_since_write = 0
+
+class SocketConnection:
+    """
+    Socket wrapper with its own outbound queue and writer thread
+    send() only enqueues, so handlers holding the lock never block on a
+    client with a full TCP window
+    """
+
+    def __init__(self, sock, addr=None):
+        self.sock = sock
+        self.addr = addr
+        self.queue = OutboundQueue()
+        self.cond = threading.Condition()
+        self.closed = False
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def send(self, data, droppable=False):
+        with self.cond:
+            if self.closed:
+                return 0
+            was_empty = not self.queue
+            ok = self.queue.push(data, droppable)
+            if was_empty:
+                # The writer only needs waking for the first frame of a batch
+                self.cond.notify()
+        if not ok:
+            log.warning("Send queue overflow, disconnecting", extra={'addr': self.addr})
+            metrics.count('tetris_overflow_disconnects_total')
+            self.abort()
+        return len(data)
+
+    def _write_loop(self):
         while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if SEND_BATCH_INTERVAL and not self.closed:
+                    # Collect everything sent during this tick into one write
+                    deadline = time.monotonic() + SEND_BATCH_INTERVAL
+                    remaining = SEND_BATCH_INTERVAL
+                    while remaining > 0 and not self.closed:
+                        self.cond.wait(remaining)
+                        remaining = deadline - time.monotonic()
+                if not self.queue:
+                    break
+                frames = self.queue.pop_all()
             try:
-                data = conn.recv(2048)
-                if not data:
-                    print(f"[{username}] Disconnected (no data)")
+                writes = write_frames(self.sock, frames)
+                metrics.count('tetris_socket_writes_total', writes)
+                metrics.count('tetris_bytes_sent_total', sum(len(frame) for frame in frames))
+            except OSError:
+                self.abort()
+                break
+            with self.cond:
+                self.queue.written()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def abort(self):
+        """Drop the connection now; the reader sees EOF and runs the normal cleanup"""
+        # Shut down before waking the writer: once it closes the socket, a
+        # shutdown can no longer reach the peer or the blocked reader
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        with self.cond:
+            self.closed = True
+            self.queue.pop_all()
+            self.cond.notify()
+
+    def close(self):
+        """Close once the writer has flushed what is already queued"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        try:
+            self.sock.settimeout(CLOSE_FLUSH_TIMEOUT)
+        except OSError:
+            pass  # Already closed by the writer after an abort
+
+def handle_client(sock, addr):
+    """
+    Handle communication with a connected client (thread-per-connection mode)
+    Args:
+        sock: Client socket connection
+        addr: Client address
+    """
+    conn = SocketConnection(sock, addr)
+    username = None
+    client = None
+    decoder = FrameDecoder()
+    try:
+        # Main message handling loop
+        while True:
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                log.info("Disconnected", extra={'player': username})
+                break
+            metrics.count('tetris_bytes_received_total', len(data))
+            if client is not None:
+                client.last_seen = time.monotonic()
+
+            for frame in decoder.feed(data):
+                if client is None:
+                    # The first frame is the username handshake (or a session resume)
+                    client = handshake(conn, addr, frame)
+                    username = client.username
+                    continue
+                dispatch_frame(client, frame)
+
+    except Exception as e:
+        log.warning("Error handling client", extra={'player': username, 'addr': addr, 'error': str(e)})
+    finally:
+        # Cleanup when client disconnects (unless the session was resumed elsewhere)
+        if client is not None and client.conn is conn:
+            unregister_client(client)
+        else:
+            conn.close()
+
+class StreamConnection:
+    """
+    Socket-like wrapper around an asyncio StreamWriter
+    Lets the shared handlers call conn.send()/conn.close() in asyncio mode;
+    frames go through an OutboundQueue drained by a per-connection writer task
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.queue = OutboundQueue()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.aborted = False
+        # Keep the transport buffer small so slow clients back up in our queue
+        writer.transport.set_write_buffer_limits(high=TRANSPORT_HIGH_WATER)
+        self.task = asyncio.ensure_future(self._write_loop())
+
+    def send(self, data, droppable=False):
+        if self.closed:
+            return 0
+        was_empty = not self.queue
+        if not self.queue.push(data, droppable):
+            log.warning("Send queue overflow, disconnecting",
+                        extra={'addr': self.writer.get_extra_info('peername')})
+            metrics.count('tetris_overflow_disconnects_total')
+            self.abort()
+            return 0
+        if was_empty:
+            self.wakeup.set()
+        return len(data)
+
+    async def _write_loop(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                if SEND_BATCH_INTERVAL and not self.closed:
+                    # Collect everything sent during this tick into one write
+                    await asyncio.sleep(SEND_BATCH_INTERVAL)
+                while self.queue:
+                    frames = self.queue.pop_all()
+                    self.writer.writelines(frames)
+                    metrics.count('tetris_socket_writes_total')
+                    metrics.count('tetris_bytes_sent_total', sum(len(frame) for frame in frames))
+                    if self.closed:
+                        # Don't let a stuck peer keep a closing connection alive
+                        await asyncio.wait_for(self.writer.drain(), CLOSE_FLUSH_TIMEOUT)
+                    else:
+                        await self.writer.drain()
+                    self.queue.written()
+                if self.closed:
                     break
-                    
-                msg = json.loads(data.decode())
-                print(f"[{username}] received: {msg['type']}")
-
-                # Handle different message types
-                if msg['type'] == 'ready':
-                    # Update player's ready status
-                    with lock:
-                        ready_status[username] = msg['ready']
-                    update_lobby()
-
-                    # Update priority queue with new readiness status
-                    with lock:
-                        priority_queue = [(status, user) for status, user in priority_queue if user != username]
-                        heapq.heapify(priority_queue)
-                        heapq.heappush(priority_queue, (1 if ready_status[username] else 0, username))
-
-                    # Start game if exactly 2 players are ready
-                    with lock:
-                        if len(clients) == 2 and all(ready_status[c['username']] for c in clients):
-                            start_game()
-
-                elif msg['type'] == 'score':
-                    # Broadcast score updates to other players
-                    broadcast({'type': 'score', 'value': msg['value']}, sender_conn=conn)
-                
-                elif msg['type'] == 'board':
-                    # Broadcast board state to other players
-                    broadcast({'type': 'board', 'board': msg['board']}, sender_conn=conn)
-                
-                elif msg['type'] == 'lose':
-                    print(f"[{username}] Lost the game")
-                    # Handle game over when a player loses
-                    with lock:
-                        loser_conn = conn
-                        loser_name = None
-                        winner_conn = None
-                        winner_name = None
-
-                        # Find loser and winner information
-                        for client in clients:
-                            if client['conn'] == loser_conn:
-                                loser_name = client['username']
-                                break
-
-                        for client in clients:
-                            if client['conn'] != loser_conn:
-                                winner_conn = client['conn']
-                                winner_name = client['username']
-                                break
-
-                    # Send game over messages to both players
-                    try:
-                        # Send lose message to loser
-                        loser_conn.send((json.dumps({
-                            'type': 'game_over',
-                            'result': 'lose',
-                            'winner': winner_name
-                        }) + '\n').encode())
-                        print(f"[{username}] Sent lose message to loser")
-                    except Exception as e:
-                        print(f"[{username}] Failed to send lose message: {e}")
-
-                    if winner_conn:
-                        try:
-                            # Send win message to winner
-                            winner_conn.send((json.dumps({
-                                'type': 'game_over',
-                                'result': 'win',
-                                'winner': winner_name
-                            }) + '\n').encode())
-                            print(f"[{username}] Sent win message to winner")
-                        except Exception as e:
-                            print(f"[{username}] Failed to send win message: {e}")
-
-                elif msg['type'] == 'chat':
-                    # Handle chat messages
-                    broadcast({
-                        'type': 'chat',
-                        'from': username,
-                        'message': msg['message']
-                    })
-                
-                elif msg['type'] == 'request_lobby':
-                    # Send updated lobby information
-                    update_lobby()
-
-                elif msg['type'] == 'rematch_request':
-                    print(f"[{username}] Requested rematch")
-                    # Handle rematch request
-                    with lock:
-                        # Find opponent
-                        opponent_conn = None
-                        opponent_name = None
-                        for client in clients:
-                            if client['conn'] != conn:
-                                opponent_conn = client['conn']
-                                opponent_name = client['username']
-                                break
-                        
-                        if opponent_conn:
-                            # Store rematch request
-                            rematch_requests[username] = opponent_name
-                            # Send rematch request to opponent
-                            try:
-                                opponent_conn.send((json.dumps({
-                                    'type': 'rematch_request',
-                                    'from': username
-                                }) + '\n').encode())
-                            except Exception as e:
-                                print(f"[{username}] Failed to send rematch request: {e}")
-
-                elif msg['type'] == 'rematch_accepted':
-                    print(f"[{username}] Accepted rematch")
-                    # Handle rematch acceptance
-                    with lock:
-                        # Find opponent
-                        opponent_conn = None
-                        opponent_name = None
-                        for client in clients:
-                            if client['conn'] != conn:
-                                opponent_conn = client['conn']
-                                opponent_name = client['username']
-                                break
-                        
-                        if opponent_conn:
-                            # Clear rematch requests for both players
-                            if username in rematch_requests:
-                                del rematch_requests[username]
-                            if opponent_name in rematch_requests:
-                                del rematch_requests[opponent_name]
-                            
-                            # Send rematch accepted to both players
-                            try:
-                                opponent_conn.send((json.dumps({
-                                    'type': 'rematch_accepted'
-                                }) + '\n').encode())
-                                conn.send((json.dumps({
-                                    'type': 'rematch_accepted'
-                                }) + '\n').encode())
-                                
-                                # Send start message to both players
-                                opponent_conn.send((json.dumps({
-                                    'type': 'start'
-                                }) + '\n').encode())
-                                conn.send((json.dumps({
-                                    'type': 'start'
-                                }) + '\n').encode())
-                            except Exception as e:
-                                print(f"[{username}] Failed to send rematch accepted: {e}")
-
-            except json.JSONDecodeError as e:
-                print(f"[{username}] Invalid JSON received: {e}")
-                continue
-            except Exception as e:
-                print(f"[{username}] Error processing message: {e}")
-                continue
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            self.abort()
+        finally:
+            self.writer.close()
+
+    def abort(self):
+        """Drop the connection now; the reader sees EOF and runs the normal cleanup"""
+        self.closed = True
+        self.aborted = True
+        self.queue.pop_all()
+        self.writer.transport.abort()
+        self.wakeup.set()
+
+    def close(self):
+        """Close once the writer task has flushed what is already queued"""
+        self.closed = True
+        self.wakeup.set()
+
+    async def detach(self):
+        """
+        Flush what is queued and let go of the socket without ending the TCP connection
+        Returns:
+            A duplicate of the socket's file descriptor for another process, or
+            None if the connection failed while flushing
+        """
+        fd = os.dup(self.writer.get_extra_info('socket').fileno())
+        self.close()
+        try:
+            # Closing our transport only closes our fd; the duplicate keeps the connection open
+            await asyncio.wait_for(asyncio.shield(self.task), CLOSE_FLUSH_TIMEOUT)
+            await asyncio.wait_for(self.writer.wait_closed(), CLOSE_FLUSH_TIMEOUT)
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            self.aborted = True
+        if self.aborted:
+            os.close(fd)
+            return None
+        return fd
+
+async def handle_client_async(reader, writer, adopted=None):
+    """
+    Handle communication with a connected client (asyncio mode)
+    Args:
+        reader: asyncio StreamReader for the connection
+        writer: asyncio StreamWriter for the connection
+        adopted: Hand-off details when the player was moved here from another worker
+    """
+    conn = StreamConnection(writer)
+    addr = writer.get_extra_info('peername')
+    username = None
+    client = None
+    decoder = FrameDecoder()
+    try:
+        if adopted is not None:
+            # Already past the handshake on the other worker
+            username = adopted['username']
+            client = register_client(conn, addr, username)
+            client.board_encoding = adopted['board_encoding']
+            client.board_delta = adopted['board_delta']
+            client.task, client.reader, client.decoder = asyncio.current_task(), reader, decoder
+            pair_adopted(client, adopted['partner'])
+            for frame in decoder.feed(base64.b64decode(adopted['pending'])):
+                dispatch_frame(client, frame)
+
+        # Main message handling loop
+        while True:
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                if client is None or not client.handoff:
+                    log.info("Disconnected", extra={'player': username})
+                break
+            metrics.count('tetris_bytes_received_total', len(data))
+            if client is not None:
+                client.last_seen = time.monotonic()
+
+            for frame in decoder.feed(data):
+                if client is None:
+                    # The first frame is the username handshake (or a session resume)
+                    client = handshake(conn, addr, frame)
+                    username = client.username
+                    # Kept so the connection can be handed to another worker
+                    client.task, client.reader, client.decoder = asyncio.current_task(), reader, decoder
+                    continue
+                dispatch_frame(client, frame)
 
     except Exception as e:
-        print(f"[{username}] Error handling client {addr}: {e}")
+        log.warning("Error handling client", extra={'player': username, 'addr': addr, 'error': str(e)})
     finally:
-        # Cleanup when client disconnects
-        print(f"[{username}] Disconnecting")
-        with lock:
-            clients[:] = [c for c in clients if c['conn'] != conn]
-            if username in ready_status:
-                del ready_status[username]
-            priority_queue[:] = [(status, user) for status, user in priority_queue if user != username]
-            heapq.heapify(priority_queue)
-            # Clean up any rematch requests involving this player
-            rematch_requests = {k: v for k, v in rematch_requests.items() 
-                              if k != username and v != username}
-
-        # Notify other players about disconnection
-        notify_opponent_left(username)
-        conn.close()
-        update_lobby()
+        # Cleanup when client disconnects (unless it was handed to another worker
+        # or the session was resumed on a new connection)
+        if client is not None and client.conn is conn:
+            if not client.handoff:
+                unregister_client(client)
+        else:
+            conn.close()
 
 def update_lobby():
     """
-    Send updated lobby information to all clients
-    Includes player list and their ready status
+    Schedule a lobby broadcast
+    Any number of changes within LOBBY_UPDATE_INTERVAL go out as one diff
+    from flush_lobby, instead of a full player list per change
+    """
+    global lobby_dirty
+    lobby_dirty = True
+
+def lobby_entry(username):
+    """A player's row in the lobby list"""
+    return {'name': username, 'ready': ready_status.get(username, False),
+            'rating': matchmaker.rating(username)}
+
+def lobby_snapshot(page=None):
+    """
+    Encode the broadcast lobby as 'lobby' messages of up to LOBBY_PAGE_SIZE players
+    Players are ordered not ready first, then by name
+    Must be called with the lock held
+    Args:
+        page: Only this 0-based page, or None for every page
+    Returns:
+        List of encoded frames
+    """
+    players = sorted(lobby_view.values(), key=lambda entry: (entry['ready'], entry['name']))
+    pages = max(1, -(-len(players) // LOBBY_PAGE_SIZE))
+    numbers = range(pages) if page is None else [min(max(int(page), 0), pages - 1)]
+    return [encode_message({'type': 'lobby', 'version': lobby_version, 'page': number,
+                            'pages': pages, 'total': len(players),
+                            'players': players[number * LOBBY_PAGE_SIZE:(number + 1) * LOBBY_PAGE_SIZE]})
+            for number in numbers]
+
+def flush_lobby():
+    """
+    Send lobby clients what changed since the last broadcast
+    Clients holding the previous version get one 'lobby_diff' (encoded once)
+    with the added or changed rows and the removed names; clients that just
+    arrived in the lobby get a full snapshot instead.
+    Called every LOBBY_UPDATE_INTERVAL seconds by either server mode
     """
+    global lobby_dirty, lobby_view, lobby_version
+    if not lobby_dirty:
+        return
     with lock:
-        sorted_players = [{'name': user, 'ready': ready_status.get(user, False)} for _, user in sorted(priority_queue)]
-        message = {'type': 'lobby', 'players': sorted_players}
-        for client in clients:
+        lobby_dirty = False
+        in_lobby = registry.in_lobby()
+        current = {client.username: lobby_entry(client.username) for client in in_lobby
+                   if client.username in ready_status}
+        changed = [entry for name, entry in current.items() if lobby_view.get(name) != entry]
+        removed = [name for name in lobby_view if name not in current]
+        previous = lobby_version
+        diff = None
+        if changed or removed:
+            lobby_version += 1
+            diff = encode_message({'type': 'lobby_diff', 'version': lobby_version,
+                                   'players': changed, 'removed': removed})
+        lobby_view = current
+        snapshot = None
+        for client in in_lobby:
+            if client.lobby_version == previous:
+                frames = [diff] if diff is not None else ()
+            else:
+                if snapshot is None:
+                    snapshot = lobby_snapshot()
+                frames = snapshot
+            client.lobby_version = lobby_version
+            for frame in frames:
+                try:
+                    client.conn.send(frame)
+                except:
+                    pass
+    metrics.count('tetris_lobby_flushes_total')
+
+def start_game(room):
+    """
+    Notify both players of a room to start the game
+    Each start message names the player's opponent
+    Must be called with the lock held
+    Args:
+        room: Room whose match is starting
+    """
+    room.in_progress = True
+    room.winner = None
+    room.rematch_requests.clear()
+    start_recording(room)
+    for name, client in room.players.items():
+        room.ready[name] = True
+        # Boards from a previous match must not be served as keyframes
+        client.board_keyframe = None
+        client.board_state = None
+        client.board_seq = None
+        client.current_piece = None
+        client.score = None
+        opponent = room.opponent_of(name)
+        message = {'type': 'start', 'opponent': opponent.username if opponent else None}
+        try:
+            client.conn.send(encode_message(message))
+        except:
+            pass
+    if room.spectators:
+        # Tell spectators a new game started so they clear both boards
+        room.send_spectators(encode_message(dict(room_summary(room), type='spectate')))
+
+def run_matchmaking():
+    """
+    Retry pairing waiting players as their match windows widen
+    Called every MATCHMAKING_INTERVAL seconds by either server mode
+    """
+    with lock:
+        pairs = matchmaker.tick()
+        for pair in pairs:
+            create_room(list(pair))
+    if pairs:
+        update_lobby()
+
+def run_heartbeat():
+    """
+    Ping every client and disconnect the ones that have gone quiet
+    A client that sent nothing (not even a pong) for IDLE_TIMEOUT seconds is
+    aborted; its handler then sees EOF and cleans up through the usual path.
+    Called every HEARTBEAT_INTERVAL seconds by either server mode
+    """
+    now = time.monotonic()
+    expire_sessions(now)
+    idle = []
+    with lock:
+        for client in registry:
+            if now - client.last_seen > IDLE_TIMEOUT:
+                idle.append(client)
+                continue
+            client.ping_id += 1
+            client.ping_sent = now
+            ping = {'type': 'ping', 'id': client.ping_id}
+            if client.rtt is not None:
+                ping['rtt'] = round(client.rtt * 1000, 1)  # Milliseconds, for client-side tuning
             try:
-                client['conn'].send((json.dumps(message) + '\n').encode())
+                client.conn.send(encode_message(ping))
             except:
                 pass
+    for client in idle:
+        log.info("Idle, disconnecting", extra={'player': client.username,
+                                                'idle': round(now - client.last_seen, 1)})
+        metrics.count('tetris_idle_disconnects_total')
+        client.conn.abort()
 
-def start_game():
+def heartbeat_loop():
     """
-    Notify all clients to start the game
-    Sends start message to all connected players
+    Background heartbeat thread for the threaded server
     """
-    message = {'type': 'start'}
-    for client in clients:
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
         try:
-            client['conn'].send((json.dumps(message) + '\n').encode())
-        except:
-            pass
+            run_heartbeat()
+        except Exception as e:
+            log.exception("Heartbeat error")
+
+async def heartbeat_task():
+    """
+    Background heartbeat task for the asyncio server
+    """
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        try:
+            run_heartbeat()
+        except Exception as e:
+            log.exception("Heartbeat error")
+
+def lobby_loop():
+    """
+    Background lobby broadcast thread for the threaded server
+    """
+    while True:
+        time.sleep(LOBBY_UPDATE_INTERVAL)
+        try:
+            flush_lobby()
+        except Exception:
+            log.exception("Lobby update error")
+
+async def lobby_task():
+    """
+    Background lobby broadcast task for the asyncio server
+    """
+    while True:
+        await asyncio.sleep(LOBBY_UPDATE_INTERVAL)
+        try:
+            flush_lobby()
+        except Exception:
+            log.exception("Lobby update error")
+
+def matchmaking_loop():
+    """
+    Background matchmaking thread for the threaded server
+    """
+    while True:
+        time.sleep(MATCHMAKING_INTERVAL)
+        try:
+            run_matchmaking()
+        except Exception as e:
+            log.exception("Matchmaking error")
 
-def start_server():
+async def matchmaking_task():
+    """
+    Background matchmaking task for the asyncio server
+    """
+    while True:
+        await asyncio.sleep(MATCHMAKING_INTERVAL)
+        try:
+            run_matchmaking()
+        except Exception as e:
+            log.exception("Matchmaking error")
+
+def queue_sharded(client):
+    """
+    Ask the supervisor to find an opponent for a ready player (worker mode)
+    Must be called with the lock held
+    """
+    if client.shard_key is not None:
+        return
+    key = f"{shard.worker_id}/{next(shard_keys)}"
+    client.shard_key = key
+    shard_clients[key] = client
+    shard.send({'op': 'enqueue', 'key': key, 'username': client.username})
+
+def unqueue_sharded(client):
+    """
+    Take a player out of the supervisor's queue (worker mode)
+    Must be called with the lock held
+    """
+    key = client.shard_key
+    client.shard_key = None
+    if key is not None:
+        shard_clients.pop(key, None)
+        shard.send({'op': 'remove', 'key': key})
+
+def pair_adopted(client, partner_key):
+    """
+    Start the match a handed-off player was moved here for
+    If the partner left in the meantime the player goes back in the queue
+    Args:
+        client: Client record of the adopted player
+        partner_key: Shard key of the opponent waiting on this worker
+    """
+    with lock:
+        partner = shard_clients.pop(partner_key, None)
+        if partner is not None and partner.room is None:
+            partner.shard_key = None
+            create_room([partner, client])
+        else:
+            ready_status[client.username] = True
+            queue_sharded(client)
+    update_lobby()
+
+async def release_client(client, target, partner_key):
+    """
+    Hand a matched player's connection to the worker hosting their opponent
+    Bytes already read but not yet handled travel along with the socket
+    Args:
+        client: Client record of the player to move
+        target: Worker id that will adopt the connection
+        partner_key: Shard key of the opponent on the target worker
+    """
+    conn = client.conn
+    key = client.shard_key
+    client.shard_key = None
+    # Stop reading and let the handler finish the frames it already has
+    client.handoff = True
+    conn.writer.transport.pause_reading()
+    client.reader.feed_eof()
+    await asyncio.wait([client.task])
+    pending = bytes(client.decoder.buffer)
+    with lock:
+        # The adopting worker issues the player a new session token
+        sessions.pop(client.session, None)
+        remove_from_lobby(client)
+    fd = await conn.detach()
+    if fd is None:
+        log.warning("Lost connection during hand-off", extra={'player': client.username})
+        shard.send({'op': 'handoff_failed', 'key': key})
+    else:
+        try:
+            shard.send({
+                'op': 'handoff',
+                'key': key,
+                'target': target,
+                'partner': partner_key,
+                'username': client.username,
+                'board_encoding': client.board_encoding,
+                'board_delta': client.board_delta,
+                'pending': base64.b64encode(pending).decode('ascii')
+            }, fds=[fd])
+            log.info("Handed off", extra={'player': client.username, 'target': target})
+        finally:
+            os.close(fd)
+    update_lobby()
+
+async def adopt_client(fd, meta):
+    """
+    Take over a connection handed off by another worker
+    Args:
+        fd: Socket file descriptor received from the supervisor
+        meta: Hand-off details (username, encodings, partner, pending bytes)
+    """
+    try:
+        reader, writer = await asyncio.open_connection(sock=socket.socket(fileno=fd))
+    except OSError as e:
+        log.warning("Could not adopt connection", extra={'player': meta['username'], 'error': str(e)})
+        shard.send({'op': 'handoff_failed', 'key': meta['key']})
+        return
+    await handle_client_async(reader, writer, adopted=meta)
+
+def handle_shard_op(op, fds):
+    """
+    Handle a message from the supervisor (worker mode)
+    Args:
+        op: Decoded control message
+        fds: File descriptors that came with it (only for 'adopt')
+    """
+    kind = op['op']
+    if kind == 'match':
+        # Both players are on this worker
+        with lock:
+            players = [shard_clients.pop(key, None) for key in op['players']]
+            present = [c for c in players if c is not None and c.room is None]
+            for client in present:
+                client.shard_key = None
+            if len(present) == 2:
+                create_room(present)
+            else:
+                for client in present:
+                    queue_sharded(client)
+        update_lobby()
+    elif kind == 'release':
+        client = shard_clients.pop(op['key'], None)
+        if client is None or client.room is not None:
+            shard.send({'op': 'handoff_failed', 'key': op['key']})
+            return
+        asyncio.ensure_future(release_client(client, op['target'], op['partner']))
+    elif kind == 'adopt':
+        asyncio.ensure_future(adopt_client(fds.pop(0), op))
+    elif kind == 'requeue':
+        # The opponent we were matched with vanished during its hand-off
+        client = shard_clients.get(op['key'])
+        if client is not None:
+            shard.send({'op': 'enqueue', 'key': op['key'], 'username': client.username})
+    elif kind == 'rating':
+        matchmaker.ratings[op['username']] = op['rating']
+    for fd in fds:
+        os.close(fd)
+
+def render_metrics():
+    """
+    Build the metrics text: counters and histograms plus live gauges for
+    players, rooms, the matchmaking queue and each connection's send queue
+    """
+    with lock:
+        snapshot = [(client.username, client.conn) for client in registry]
+        gauges = [
+            ('tetris_players', '', len(snapshot)),
+            ('tetris_rooms', '', len(rooms)),
+            ('tetris_rooms_in_progress', '', sum(1 for room in rooms.values() if room.in_progress)),
+            ('tetris_matchmaking_waiting', '', len(matchmaker)),
+        ]
+    queued_bytes = 0
+    for username, conn in snapshot:
+        queue = getattr(conn, 'queue', None)
+        if queue is None:
+            continue
+        queued_bytes += queue.queued_bytes
+        name = username.replace('\\', '\\\\').replace('"', '\\"')
+        gauges.append(('tetris_send_queue_depth', f'user="{name}"', len(queue)))
+    gauges.append(('tetris_send_queue_bytes', '', queued_bytes))
+    if log_handler is not None:
+        gauges.append(('tetris_log_records_dropped', '', log_handler.dropped))
+    return metrics.render(gauges)
+
+def start_server(host=HOST, port=PORT):
     """
     Initialize and start the game server
     Listens for incoming connections and spawns handler threads
     """
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((HOST, PORT))
-    server.listen()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(BACKLOG)
     server_ip = socket.gethostbyname(socket.gethostname())
-    print(f"Server listening on {server_ip}:{PORT}")
+    log.info("Server listening", extra={'addr': [server_ip, port], 'mode': 'thread', 'codec': CODEC})
+    threading.Thread(target=matchmaking_loop, daemon=True).start()
+    threading.Thread(target=heartbeat_loop, daemon=True).start()
+    threading.Thread(target=lobby_loop, daemon=True).start()
     
     # Main server loop
     while True:
         conn, addr = server.accept()
+        set_nodelay(conn)
         threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
 
+async def serve_async(host=HOST, port=PORT, control_sock=None, worker_id=None):
+    """
+    Run the asyncio server until cancelled
+    Every connection is a coroutine on a single event loop instead of an OS thread
+    Args:
+        control_sock: Channel to the supervisor when running as a worker process
+        worker_id: This worker's number when running as a worker process
+    """
+    global shard
+    server = await asyncio.start_server(handle_client_async, host, port, backlog=BACKLOG,
+                                        reuse_address=True, reuse_port=control_sock is not None)
+    server_ip = socket.gethostbyname(socket.gethostname())
+    if control_sock is not None:
+        # Matchmaking happens in the supervisor
+        shard = ShardLink(worker_id, control_sock, handle_shard_op)
+        shard.attach(asyncio.get_running_loop())
+        log.info("Worker listening", extra={'addr': [server_ip, port], 'mode': 'asyncio', 'pid': os.getpid()})
+    else:
+        log.info("Server listening", extra={'addr': [server_ip, port], 'mode': 'asyncio', 'codec': CODEC})
+        asyncio.ensure_future(matchmaking_task())
+    asyncio.ensure_future(heartbeat_task())
+    asyncio.ensure_future(lobby_task())
+    async with server:
+        await server.serve_forever()
+
+def start_async_server(host=HOST, port=PORT):
+    """
+    Initialize and start the game server in asyncio mode
+    """
+    try:
+        asyncio.run(serve_async(host, port))
+    except KeyboardInterrupt:
+        pass
+
+def open_leaderboard(path):
+    """
+    Open the leaderboard database, or leave the leaderboard disabled for an empty path
+    """
+    global leaderboard
+    if path:
+        leaderboard = Leaderboard(path)
+        atexit.register(leaderboard.close)  # Commit games still queued for the writer
+        log.info("Leaderboard opened", extra={'players': len(leaderboard), 'path': path})
+
+def start_logging(args, worker_id=None):
+    """
+    Start the background JSON log writer (again in each forked worker)
+    """
+    global log_handler
+    log_handler = setup_logging(args.log_level, parse_sample_rates(args.log_sample), args.log_file or None,
+                                {'worker': worker_id} if worker_id is not None else None)
+
+def run_worker(worker_id, control_sock, args):
+    """
+    Entry point of a forked worker process
+    Every worker listens on the same port (SO_REUSEPORT) and gets its own
+    metrics port, metrics_port + worker_id
+    """
+    start_logging(args, worker_id)
+    open_leaderboard(args.leaderboard_db)
+    if args.metrics_port:
+        start_metrics_server(METRICS_HOST, args.metrics_port + worker_id, render_metrics)
+    if args.stats_interval:
+        start_stats_dump(args.stats_interval, render_metrics)
+    asyncio.run(serve_async(args.host, args.port, control_sock, worker_id))
+
+def parse_args():
+    """
+    Parse server command line options
+    """
+    parser = argparse.ArgumentParser(description="Tetris Battle server")
+    parser.add_argument('--host', default=HOST, help="Address to bind to")
+    parser.add_argument('--port', type=int, default=PORT, help="Port to listen on")
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default=SERVER_MODE,
+                        help="Connection handling model")
+    parser.add_argument('--send-queue-frames', type=int, default=SEND_QUEUE_MAX_FRAMES,
+                        help="Max frames queued per client before stale boards are dropped")
+    parser.add_argument('--send-queue-bytes', type=int, default=SEND_QUEUE_MAX_BYTES,
+                        help="Max bytes queued per client before stale boards are dropped")
+    parser.add_argument('--send-batch-ms', type=float, default=SEND_BATCH_INTERVAL * 1000,
+                        help="Collect each client's outbound frames for this many ms and "
+                             "write them with one syscall (0 writes immediately)")
+    parser.add_argument('--max-dropped-frames', type=int, default=SEND_QUEUE_MAX_DROPS,
+                        help="Dropped frames without progress before a client is disconnected")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="Seconds of silence before a client is disconnected")
+    parser.add_argument('--session-grace', type=float, default=SESSION_GRACE,
+                        help="Seconds a dropped player's match is held for them to reconnect (0 disables)")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help="Local port for the plain-text metrics endpoint (0 disables)")
+    parser.add_argument('--stats-interval', type=float, default=STATS_INTERVAL,
+                        help="Print metrics to stdout every N seconds (0 disables)")
+    parser.add_argument('--replay-dir', default=REPLAY_DIR,
+                        help="Directory for match recordings ('' disables recording)")
+    parser.add_argument('--leaderboard-db', default=LEADERBOARD_PATH,
+                        help="SQLite file for the server leaderboard ('' disables it)")
+    parser.add_argument('--log-level', choices=['debug', 'info', 'warning', 'error'], default=LOG_LEVEL,
+                        help="Minimum level of the JSON log lines ('debug' traces messages)")
+    parser.add_argument('--log-sample', default=LOG_SAMPLE,
+                        help="Debug-trace only 1 in N messages of a type, e.g. 'board=50,pong=10'")
+    parser.add_argument('--log-file', default='',
+                        help="Append JSON log lines to this file instead of stderr")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="Worker processes sharing the port; players of a match are "
+                             "moved into the same worker (asyncio mode, Linux)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    start_server() 
\ No newline at end of file
+    args = parse_args()
+    SEND_QUEUE_MAX_FRAMES = args.send_queue_frames
+    SEND_QUEUE_MAX_BYTES = args.send_queue_bytes
+    SEND_QUEUE_MAX_DROPS = args.max_dropped_frames
+    SEND_BATCH_INTERVAL = args.send_batch_ms / 1000
+    REPLAY_DIR = args.replay_dir
+    IDLE_TIMEOUT = args.idle_timeout
+    SESSION_GRACE = args.session_grace
+    start_logging(args)
+    if args.workers > 1:
+        # Each worker starts its own metrics endpoint after the fork
+        run_supervisor(args.workers, lambda worker_id, sock: run_worker(worker_id, sock, args))
+    else:
+        open_leaderboard(args.leaderboard_db)
+        if args.metrics_port:
+            start_metrics_server(METRICS_HOST, args.metrics_port, render_metrics)
+        if args.stats_interval:
+            start_stats_dump(args.stats_interval, render_metrics)
+        if args.mode == 'asyncio':
+            start_async_server(args.host, args.port)
+        else:
+            start_server(args.host, args.port)
@@ -0,0 +1,235 @@
+# Multi-process sharding for the Tetris server
+# A supervisor forks worker processes that all listen on the same port with
+# SO_REUSEPORT, so the kernel spreads new connections across them. The
+# supervisor runs the one matchmaking queue; when it pairs two players that
+# landed on different workers, one player's socket is handed to the other
+# worker (file descriptor passing over a Unix socketpair) so every room lives
+# entirely inside a single process.
+import json
+import os
+import selectors
+import socket
+import time
+
+from t_log import log, stop_logging
+from t_matchmaking import Matchmaker
+
+CONTROL_MESSAGE_SIZE = 256 * 1024  # Largest control message (handoffs carry unread bytes)
+COORDINATOR_TICK = 1.0  # Seconds between matchmaking sweeps in the supervisor
+
+def send_op(sock, op, fds=()):
+    """
+    Send one control message, optionally carrying file descriptors
+    Control channels are SOCK_SEQPACKET, so every send is one message
+    """
+    data = json.dumps(op).encode()
+    if fds:
+        socket.send_fds(sock, [data], list(fds))
+    else:
+        sock.send(data)
+
+def recv_op(sock):
+    """
+    Receive one control message
+    Returns:
+        (op dict, list of received fds), or (None, []) when the peer has gone
+    """
+    data, fds, _, _ = socket.recv_fds(sock, CONTROL_MESSAGE_SIZE, 1)
+    if not data:
+        return None, fds
+    return json.loads(data), fds
+
+class ShardLink:
+    """
+    Worker side of the control channel to the supervisor
+    Incoming ops are read from the event loop and passed to on_op(op, fds)
+    """
+
+    def __init__(self, worker_id, sock, on_op):
+        self.worker_id = worker_id
+        self.sock = sock
+        self.on_op = on_op
+
+    def attach(self, loop):
+        """Start delivering supervisor messages on the given asyncio loop"""
+        self.sock.setblocking(False)
+        loop.add_reader(self.sock.fileno(), self._readable, loop)
+
+    def _readable(self, loop):
+        try:
+            op, fds = recv_op(self.sock)
+        except BlockingIOError:
+            return
+        if op is None:
+            # Supervisor is gone; nothing can be matched any more
+            log.warning("Supervisor exited, stopping", extra={'worker': self.worker_id})
+            loop.remove_reader(self.sock.fileno())
+            raise SystemExit(0)
+        self.on_op(op, fds)
+
+    def send(self, op, fds=()):
+        op['worker'] = self.worker_id
+        self.sock.setblocking(True)
+        try:
+            send_op(self.sock, op, fds)
+        finally:
+            self.sock.setblocking(False)
+
+class Coordinator:
+    """
+    Supervisor process: owns the worker processes and the matchmaking queue
+    Workers report ready/unready players and match results; the coordinator
+    pairs players and tells workers to start rooms or hand sockets over.
+    """
+
+    def __init__(self, worker_main):
+        self.worker_main = worker_main  # worker_main(worker_id, control_sock) runs in each child
+        self.matchmaker = Matchmaker()
+        self.selector = selectors.DefaultSelector()
+        self.channels = {}  # worker id -> control socket
+        self.pids = {}  # pid -> worker id
+        self.handoffs = {}  # key of player being moved -> partner's queue payload
+
+    def spawn(self, worker_id):
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        for sock in (parent_sock, child_sock):
+            # Each control message must fit in the socket buffer in one piece
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2 * CONTROL_MESSAGE_SIZE)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2 * CONTROL_MESSAGE_SIZE)
+        pid = os.fork()
+        if pid == 0:
+            parent_sock.close()
+            for channel in self.channels.values():
+                channel.close()
+            self.selector.close()
+            code = 0
+            try:
+                self.worker_main(worker_id, child_sock)
+            except (KeyboardInterrupt, SystemExit):
+                pass
+            except Exception:
+                log.exception("Worker crashed", extra={'worker': worker_id})
+                code = 1
+            stop_logging()  # os._exit skips atexit; flush the worker's log first
+            os._exit(code)
+        child_sock.close()
+        self.channels[worker_id] = parent_sock
+        self.pids[pid] = worker_id
+        self.selector.register(parent_sock, selectors.EVENT_READ, worker_id)
+        log.info("Started worker", extra={'worker': worker_id, 'pid': pid})
+
+    def run(self, worker_count):
+        for worker_id in range(worker_count):
+            self.spawn(worker_id)
+        next_tick = time.monotonic() + COORDINATOR_TICK
+        while True:
+            timeout = max(0.0, next_tick - time.monotonic())
+            for key, _ in self.selector.select(timeout):
+                self.read_channel(key.fileobj, key.data)
+            if time.monotonic() >= next_tick:
+                next_tick += COORDINATOR_TICK
+                for pair in self.matchmaker.tick():
+                    self.dispatch(pair)
+                self.reap_workers()
+
+    def read_channel(self, sock, worker_id):
+        try:
+            op, fds = recv_op(sock)
+        except OSError:
+            op, fds = None, []
+        if op is None:
+            self.selector.unregister(sock)
+            sock.close()
+            self.channels.pop(worker_id, None)
+            return
+        try:
+            self.handle_op(op, fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def handle_op(self, op, fds):
+        kind = op['op']
+        if kind == 'enqueue':
+            payload = (op['key'], op['worker'], op['username'])
+            rating = self.matchmaker.rating(op['username'])
+            pair = self.matchmaker.enqueue(op['key'], payload, rating=rating)
+            if pair:
+                self.dispatch(pair)
+        elif kind == 'remove':
+            self.matchmaker.remove(op['key'])
+        elif kind == 'result':
+            self.matchmaker.record_result(op['winner'], op['loser'])
+            for username in (op['winner'], op['loser']):
+                self.broadcast({'op': 'rating', 'username': username,
+                                'rating': self.matchmaker.rating(username)})
+        elif kind == 'handoff':
+            # Relay the socket to the worker that hosts the partner
+            self.handoffs.pop(op['key'], None)
+            channel = self.channels.get(op['target'])
+            if channel is not None and fds:
+                op['op'] = 'adopt'
+                send_op(channel, op, fds[:1])
+        elif kind == 'handoff_failed':
+            # The moving player vanished; put their partner back in the queue
+            partner = self.handoffs.pop(op['key'], None)
+            if partner is not None:
+                self.send(partner[1], {'op': 'requeue', 'key': partner[0]})
+
+    def dispatch(self, pair):
+        """Start a match: in place if both players share a worker, else move one"""
+        (key_a, worker_a, _), (key_b, worker_b, _) = pair
+        if worker_a == worker_b:
+            self.send(worker_a, {'op': 'match', 'players': [key_a, key_b]})
+            return
+        # Move the player who arrived second to the worker of the one who waited
+        self.handoffs[key_b] = pair[0]
+        self.send(worker_b, {'op': 'release', 'key': key_b, 'target': worker_a, 'partner': key_a})
+
+    def send(self, worker_id, op):
+        channel = self.channels.get(worker_id)
+        if channel is None:
+            return
+        try:
+            send_op(channel, op)
+        except OSError as e:
+            log.warning("Lost worker", extra={'worker': worker_id, 'error': str(e)})
+
+    def broadcast(self, op):
+        for worker_id in list(self.channels):
+            self.send(worker_id, op)
+
+    def reap_workers(self):
+        """Restart workers that exited and forget the players they were queueing"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker_id = self.pids.pop(pid, None)
+            if worker_id is None:
+                continue
+            log.warning("Worker exited, restarting", extra={'worker': worker_id, 'status': status})
+            stale = [key for key, entry in self.matchmaker.entries.items() if entry[1][1] == worker_id]
+            for key in stale:
+                self.matchmaker.remove(key)
+            channel = self.channels.pop(worker_id, None)
+            if channel is not None:
+                self.selector.unregister(channel)
+                channel.close()
+            self.spawn(worker_id)
+
+def run_supervisor(worker_count, worker_main):
+    """
+    Fork worker_count workers and coordinate them until interrupted
+    Args:
+        worker_count: Number of worker processes
+        worker_main: Callable(worker_id, control_sock) run in each child
+    """
+    coordinator = Coordinator(worker_main)
+    try:
+        coordinator.run(worker_count)
+    except KeyboardInterrupt:
+        pass
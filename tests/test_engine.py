@@ -0,0 +1,146 @@
+import random
+
+import pytest
+
+from t_engine import (BOARDS, COLUMNS, NO_KICKS, PIECES, ROWS, PieceRotation, TetrisEngine,
+                      benchmark)
+
+CELL = PieceRotation([[1]], NO_KICKS)
+
+
+def fill(grid, cells, color='red'):
+    """Lock single cells into a board backend"""
+    for x, y in cells:
+        grid.place(CELL, x, y, color)
+
+def brute_force_drop(grid, state, x, y):
+    """Rows the piece can fall, by testing each row on the way down"""
+    distance = 0
+    while not grid.collides(state, x, y + distance + 1):
+        distance += 1
+    return distance
+
+def brute_force_tops(grid):
+    return [next((y for y in range(ROWS) if grid.filled(x, y)), ROWS) for x in range(COLUMNS)]
+
+def random_board(board_class, rng, fill_rows=12, density=0.6):
+    grid = board_class()
+    fill(grid, [(x, y) for y in range(ROWS - fill_rows, ROWS) for x in range(COLUMNS)
+                if rng.random() < density])
+    return grid
+
+@pytest.fixture(params=sorted(BOARDS))
+def board_class(request):
+    return BOARDS[request.param]
+
+def test_clear_full_rows(board_class):
+    grid = board_class()
+    fill(grid, [(x, ROWS - 1) for x in range(COLUMNS)])
+    fill(grid, [(x, ROWS - 3) for x in range(COLUMNS)])
+    fill(grid, [(0, ROWS - 2), (4, ROWS - 4)], color='cyan')
+    assert grid.clear_full_rows(range(ROWS)) == 2
+    rows = grid.rows()
+    assert rows[ROWS - 1] == ['cyan'] + [0] * (COLUMNS - 1)
+    assert rows[ROWS - 2] == [0] * 4 + ['cyan'] + [0] * (COLUMNS - 5)
+    assert all(cell == 0 for row in rows[:ROWS - 2] for cell in row)
+    assert grid.tops == brute_force_tops(grid)
+
+def test_clear_only_given_rows(board_class):
+    grid = board_class()
+    fill(grid, [(x, ROWS - 1) for x in range(COLUMNS)])
+    assert grid.clear_full_rows([ROWS - 2]) == 0
+    assert grid.clear_full_rows([ROWS - 1]) == 1
+    assert grid.tops == [ROWS] * COLUMNS
+
+def test_engine_line_clear_scores(board_class):
+    engine = TetrisEngine(seed=1, board=board_class)
+    fill(engine.grid, [(x, ROWS - 1) for x in range(COLUMNS) if x not in (4, 5, 6, 7)])
+    engine.current_piece = {'shape': PIECES[1][0].shape, 'color': 'cyan', 'x': 4, 'y': 0,
+                            'kind': 1, 'rotation': 0}
+    assert engine.hard_drop() == 1
+    assert engine.total_lines_cleared == 1
+    assert engine.combo == 1
+    assert engine.board[ROWS - 1] == [0] * COLUMNS
+    # 19 rows of drop earn one soft and two hard drop points each
+    assert engine.score == 19 * 3
+
+def test_lower_tops_matches_board(board_class):
+    rng = random.Random(7)
+    for _ in range(50):
+        grid = random_board(board_class, rng)
+        full = rng.sample(range(ROWS - 12, ROWS), rng.randrange(1, 4))
+        fill(grid, [(x, y) for y in full for x in range(COLUMNS)])
+        assert grid.clear_full_rows(range(ROWS)) >= len(full)
+        assert grid.tops == brute_force_tops(grid)
+
+def test_drop_distance_matches_brute_force(board_class):
+    rng = random.Random(3)
+    for _ in range(50):
+        grid = random_board(board_class, rng)
+        for rotations in PIECES:
+            for state in rotations:
+                for x in range(COLUMNS - state.width + 1):
+                    # From the top, and from inside the stack (under overhangs)
+                    for y in (0, ROWS - 8):
+                        if grid.collides(state, x, y):
+                            continue
+                        assert grid.drop_distance(state, x, y) == brute_force_drop(grid, state, x, y)
+
+def test_ghost_y_matches_brute_force(board_class):
+    engine = TetrisEngine(seed=5, board=board_class)
+    rng = random.Random(5)
+    for _ in range(300):
+        piece = engine.current_piece
+        state = PIECES[piece['kind']][piece['rotation']]
+        expected = piece['y'] + brute_force_drop(engine.grid, state, piece['x'], piece['y'])
+        assert engine.ghost_y() == expected
+        engine.move(rng.choice((-1, 1)), 0)
+        engine.hard_drop()
+        assert engine.current_piece is not None
+        if engine.game_over:
+            engine.reset()
+
+def test_piece_above_the_board():
+    # A wall kick can lift a piece to y = -1; both backends must agree there
+    rng = random.Random(9)
+    for _ in range(30):
+        seed = rng.random()
+        grids = [random_board(board_class, random.Random(seed), fill_rows=ROWS - 1)
+                 for board_class in BOARDS.values()]
+        for rotations in PIECES:
+            for state in rotations:
+                for x in range(COLUMNS - state.width + 1):
+                    results = {(grid.collides(state, x, -1), grid.drop_distance(state, x, -1))
+                               for grid in grids}
+                    assert len(results) == 1
+        state = rng.choice(rng.choice(PIECES))
+        x = rng.randrange(COLUMNS - state.width + 1)
+        for grid in grids:
+            grid.place(state, x, -1, 'green')
+        assert grids[0].rows() == grids[1].rows()
+        assert grids[0].tops == grids[1].tops == brute_force_tops(grids[0])
+
+def test_backends_play_the_same_game():
+    engines = [TetrisEngine(seed=11, board=board_class) for board_class in BOARDS.values()]
+    rng = random.Random(11)
+    for _ in range(500):
+        turns = rng.randrange(4)
+        shift = rng.randrange(-COLUMNS // 2, COLUMNS // 2 + 1)
+        for engine in engines:
+            for _ in range(turns):
+                engine.rotate()
+            for _ in range(abs(shift)):
+                engine.move(1 if shift > 0 else -1, 0)
+            engine.hard_drop()
+            if engine.game_over:
+                engine.reset()
+        first = engines[0]
+        for other in engines[1:]:
+            assert other.board == first.board
+            assert other.grid.tops == first.grid.tops
+            assert other.score == first.score
+
+def test_benchmark_runs(board_class):
+    rate, games = benchmark(200, board=board_class)
+    assert rate > 0
+    assert games >= 1
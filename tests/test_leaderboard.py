@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+import t_leaderboard
+from t_leaderboard import Leaderboard, RankIndex
+
+@pytest.fixture
+def board():
+    lb = Leaderboard(':memory:')
+    for i in range(10):
+        lb.record(f'p{i}', i * 10)  # p9 is first, p0 last
+    yield lb
+    lb.close()
+
+def test_around_first_player(board):
+    entries = board.around('p9', 3)
+    assert [e['rank'] for e in entries] == [1, 2, 3, 4]
+    assert entries[0] == {'rank': 1, 'name': 'p9', 'score': 90}
+
+def test_around_second_player(board):
+    entries = board.around('p8', 3)
+    assert [(e['rank'], e['name']) for e in entries] == [
+        (1, 'p9'), (2, 'p8'), (3, 'p7'), (4, 'p6'), (5, 'p5')]
+
+def test_around_last_player(board):
+    assert [e['rank'] for e in board.around('p0', 2)] == [8, 9, 10]
+
+def test_around_unknown_player(board):
+    assert board.around('nobody') == []
+
+def test_rank_and_improvement(board):
+    assert board.rank('p5') == (5, 50)
+    assert not board.record('p5', 10)  # Not a new best
+    assert board.record('p5', 95)
+    assert board.rank('p5') == (1, 95)
+    assert board.top(2)[1]['name'] == 'p9'
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # Blocks split at 8 keys, so a few dozen keys span several blocks
+    monkeypatch.setattr(t_leaderboard, 'BLOCK_SIZE', 4)
+
+def test_rank_index_slice_edges(small_blocks):
+    keys = list(range(0, 60, 2))
+    index = RankIndex(keys)
+    assert index.slice(0, 3) == [0, 2, 4]
+    assert index.slice(-5, 2) == [0, 2]
+    assert index.slice(28, 40) == [56, 58]
+    assert index.slice(len(keys), len(keys) + 5) == []
+    assert index.slice(5, 5) == []
+    assert index.slice(0, len(keys)) == keys
+    # Around each block boundary
+    for start in range(len(keys)):
+        assert index.slice(start, start + 3) == keys[start:start + 3]
+    with pytest.raises(IndexError):
+        index[len(keys)]
+    with pytest.raises(IndexError):
+        index[-1]
+
+def test_rank_index_matches_sorted_list(small_blocks):
+    rng = random.Random(4)
+    index = RankIndex()
+    expected = []
+    for _ in range(400):
+        key = rng.randrange(100)
+        if expected and rng.random() < 0.4:
+            key = rng.choice(expected)
+            index.remove(key)
+            expected.remove(key)
+        else:
+            index.add(key)
+            expected.append(key)
+            expected.sort()
+        assert len(index) == len(expected)
+        assert index.slice(0, len(expected)) == expected
+        probe = rng.randrange(100)
+        assert index.rank(probe) == sum(1 for k in expected if k < probe)
+    with pytest.raises(KeyError):
+        index.remove(1000)
+
+def test_rank_index_empty():
+    index = RankIndex()
+    assert index.slice(0, 10) == []
+    assert index.rank(5) == 0
+    index.add(5)
+    index.remove(5)
+    assert len(index) == 0
+    assert index.slice(-1, 1) == []
+
+def test_games_persist_across_reopen(tmp_path):
+    path = str(tmp_path / 'scores.db')
+    lb = Leaderboard(path)
+    lb.record('alice', 300, played=1.0)
+    lb.record('bob', 500, played=2.0)
+    lb.record('alice', 100, played=3.0)
+    lb.close()  # Commits whatever the writer has not written yet
+    lb = Leaderboard(path)
+    assert lb.top() == [{'rank': 1, 'name': 'bob', 'score': 500},
+                        {'rank': 2, 'name': 'alice', 'score': 300}]
+    assert lb.db.execute('SELECT COUNT(*) FROM games').fetchone() == (3,)
+    lb.close()
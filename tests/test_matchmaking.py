@@ -0,0 +1,132 @@
+import random
+
+from t_matchmaking import (BASE_WINDOW, BUCKET_WIDTH, DEFAULT_RATING, MAX_WINDOW, WINDOW_GROWTH,
+                           IndexedPriorityQueue, Matchmaker)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def check_heap(queue):
+    heap = queue.heap
+    for i, (priority, key) in enumerate(heap):
+        assert queue.index[key] == i
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < len(heap):
+                assert heap[child][0] >= priority
+    assert len(queue.index) == len(heap)
+
+def test_queue_pops_in_priority_order():
+    queue = IndexedPriorityQueue()
+    rng = random.Random(1)
+    priorities = {f'p{i}': rng.random() for i in range(100)}
+    for key, priority in priorities.items():
+        queue.push(key, priority)
+    check_heap(queue)
+    popped = [queue.pop() for _ in range(len(priorities))]
+    assert popped == sorted((priority, key) for key, priority in priorities.items())
+    assert queue.peek() is None
+
+def test_queue_update_and_remove():
+    queue = IndexedPriorityQueue()
+    rng = random.Random(2)
+    expected = {}
+    for step in range(500):
+        key = f'p{rng.randrange(40)}'
+        action = rng.random()
+        if action < 0.5:
+            expected[key] = rng.random()
+            queue.push(key, expected[key])  # Updates when already queued
+        elif action < 0.8:
+            assert queue.remove(key) == (key in expected)
+            expected.pop(key, None)
+        elif key in expected:
+            expected[key] = rng.random()
+            queue.update(key, expected[key])
+        check_heap(queue)
+        assert len(queue) == len(expected)
+        assert all(key in queue for key in expected)
+    assert queue.sorted_items() == sorted((priority, key) for key, priority in expected.items())
+
+def test_match_within_base_window():
+    matchmaker = Matchmaker(clock=FakeClock())
+    assert matchmaker.enqueue('alice', 'A', rating=1200) is None
+    assert matchmaker.enqueue('bob', 'B', rating=1200 + BASE_WINDOW) == ('A', 'B')
+    assert len(matchmaker) == 0
+    assert matchmaker.buckets == {}
+
+def test_closest_rating_wins():
+    matchmaker = Matchmaker(clock=FakeClock())
+    # Neither waiting player is inside the other's window; both are inside mine,
+    # one bucket below and one bucket above
+    matchmaker.enqueue('far', 'far', rating=1150)
+    matchmaker.enqueue('near', 'near', rating=1260)
+    assert matchmaker.enqueue('me', 'me', rating=1240) == ('near', 'me')
+    assert 'far' in matchmaker
+
+def test_window_grows_while_waiting():
+    clock = FakeClock()
+    matchmaker = Matchmaker(clock=clock)
+    gap = BASE_WINDOW + 2 * BUCKET_WIDTH
+    matchmaker.enqueue('alice', 'A', rating=1000)
+    assert matchmaker.enqueue('bob', 'B', rating=1000 + gap) is None
+    assert matchmaker.tick() == []
+    clock.now = 2 * BUCKET_WIDTH / WINDOW_GROWTH
+    assert matchmaker.window('alice') == gap
+    assert matchmaker.tick() == [('B', 'A')]
+    assert len(matchmaker) == 0
+
+def test_window_is_capped():
+    clock = FakeClock()
+    matchmaker = Matchmaker(clock=clock)
+    matchmaker.enqueue('alice', 'A', rating=0)
+    clock.now = 10 * MAX_WINDOW / WINDOW_GROWTH
+    assert matchmaker.window('alice') == MAX_WINDOW
+    assert matchmaker.enqueue('bob', 'B', rating=MAX_WINDOW + 1) is None
+    assert matchmaker.tick() == []
+
+def test_remove_and_requeue():
+    matchmaker = Matchmaker(clock=FakeClock())
+    matchmaker.enqueue('alice', 'A')
+    assert matchmaker.enqueue('alice', 'A') is None  # Already waiting
+    assert matchmaker.remove('alice')
+    assert not matchmaker.remove('alice')
+    assert matchmaker.enqueue('bob', 'B') is None
+    assert matchmaker.rating('bob') == DEFAULT_RATING
+
+def test_record_result():
+    matchmaker = Matchmaker(clock=FakeClock())
+    matchmaker.record_result('alice', 'bob')
+    assert matchmaker.rating('alice') > DEFAULT_RATING > matchmaker.rating('bob')
+    assert matchmaker.rating('alice') + matchmaker.rating('bob') == 2 * DEFAULT_RATING
+
+def test_tick_only_retries_due_players():
+    clock = FakeClock()
+    matchmaker = Matchmaker(clock=clock)
+    # Ratings far enough apart that nobody pairs before MAX_WINDOW
+    for i in range(50):
+        matchmaker.enqueue(f'p{i}', i, rating=i * (MAX_WINDOW + BUCKET_WIDTH))
+    first_retry = BUCKET_WIDTH / WINDOW_GROWTH
+    clock.now = first_retry / 2
+    assert matchmaker.tick() == []
+    assert all(entry[2] == BASE_WINDOW for entry in matchmaker.entries.values())
+    clock.now = first_retry
+    assert matchmaker.tick() == []
+    assert all(entry[2] == BASE_WINDOW + BUCKET_WIDTH for entry in matchmaker.entries.values())
+    assert matchmaker.retries.peek()[0] == 2 * first_retry
+
+def test_players_at_max_window_leave_the_retry_queue():
+    clock = FakeClock()
+    matchmaker = Matchmaker(clock=clock)
+    matchmaker.enqueue('alice', 'A', rating=0)
+    matchmaker.enqueue('bob', 'B', rating=10 * MAX_WINDOW)
+    clock.now = (MAX_WINDOW - BASE_WINDOW) / WINDOW_GROWTH
+    assert matchmaker.tick() == []
+    assert len(matchmaker.retries) == 0
+    assert len(matchmaker) == 2
+    assert matchmaker.remove('alice')
+    assert 'alice' not in matchmaker
@@ -0,0 +1,64 @@
+from t_server import OutboundQueue
+
+BOARD = b'{"type":"board"}\n'
+CHAT = b'{"type":"chat"}\n'
+
+
+def test_fits_without_dropping():
+    queue = OutboundQueue(max_frames=4)
+    for _ in range(4):
+        assert queue.push(BOARD, droppable=True)
+    assert len(queue) == 4
+    assert queue.dropped_total == 0
+
+def test_stale_boards_dropped_first():
+    queue = OutboundQueue(max_frames=4, max_drops=10)
+    queue.push(BOARD, droppable=True)
+    queue.push(CHAT)
+    queue.push(BOARD, droppable=True)
+    queue.push(CHAT)
+    # Full: both queued boards go, the chat messages and the new frame stay
+    assert queue.push(b'{"type":"score"}\n')
+    assert queue.pop_all() == [CHAT, CHAT, b'{"type":"score"}\n']
+    assert queue.dropped_total == 2
+    assert queue.queued_bytes == 0
+
+def test_byte_limit():
+    queue = OutboundQueue(max_frames=100, max_bytes=len(BOARD) * 2, max_drops=10)
+    queue.push(BOARD, droppable=True)
+    queue.push(BOARD, droppable=True)
+    assert queue.push(CHAT)
+    assert queue.pop_all() == [CHAT]
+
+def test_new_board_dropped_when_nothing_droppable_queued():
+    queue = OutboundQueue(max_frames=2, max_drops=10)
+    queue.push(CHAT)
+    queue.push(CHAT)
+    assert queue.push(BOARD, droppable=True)
+    assert len(queue) == 2
+    assert queue.dropped_total == 1
+
+def test_disconnect_when_message_cannot_fit():
+    queue = OutboundQueue(max_frames=2, max_drops=10)
+    queue.push(CHAT)
+    queue.push(CHAT)
+    assert not queue.push(CHAT)
+
+def test_disconnect_after_too_many_drops():
+    queue = OutboundQueue(max_frames=1, max_drops=3)
+    queue.push(CHAT)
+    assert queue.push(BOARD, droppable=True)
+    assert queue.push(BOARD, droppable=True)
+    assert not queue.push(BOARD, droppable=True)  # Third drop without a write
+
+def test_write_progress_resets_drop_count():
+    queue = OutboundQueue(max_frames=1, max_drops=3)
+    queue.push(CHAT)
+    queue.push(BOARD, droppable=True)
+    queue.push(BOARD, droppable=True)
+    queue.pop_all()
+    queue.written()
+    assert queue.push(CHAT)
+    assert queue.push(BOARD, droppable=True)
+    assert queue.push(BOARD, droppable=True)
+    assert queue.dropped_total == 4
@@ -0,0 +1,116 @@
+import json
+import random
+
+import pytest
+
+from t_protocol import (BOARD_ENCODING_PACKED, PALETTE, FrameDecoder, FrameError,
+                        apply_board_changes, board_changes, choose_board_encoding, decode_board,
+                        encode_board, encode_message, pack_board, unpack_board)
+
+COLUMNS = 10
+ROWS = 20
+
+
+def random_board(rng, density=0.4):
+    return [[rng.choice(PALETTE[1:]) if rng.random() < density else 0 for _ in range(COLUMNS)]
+            for _ in range(ROWS)]
+
+def test_frames_split_across_feeds():
+    decoder = FrameDecoder()
+    assert decoder.feed(b'{"a":1}\n{"b"') == [b'{"a":1}']
+    assert decoder.feed(b':2}') == []
+    assert decoder.feed(b'\n\n{"c":3}\n') == [b'{"b":2}', b'{"c":3}']
+
+def test_partial_utf8_character():
+    frame = encode_message({'type': 'chat', 'message': 'héllo 🎉'})
+    cut = frame.index('🎉'.encode()) + 2  # Inside the 4-byte emoji
+    decoder = FrameDecoder()
+    assert decoder.feed(frame[:cut]) == []
+    [whole] = decoder.feed(frame[cut:])
+    assert json.loads(whole)['message'] == 'héllo 🎉'
+
+def test_byte_at_a_time():
+    frames = [encode_message({'type': 'chat', 'message': text}) for text in ('ä', '日本', 'ok')]
+    decoder = FrameDecoder()
+    received = []
+    for byte in b''.join(frames):
+        received += decoder.feed(bytes([byte]))
+    assert [json.loads(frame)['message'] for frame in received] == ['ä', '日本', 'ok']
+
+def test_multibyte_delimiter_straddles_feeds():
+    decoder = FrameDecoder(delimiter=b'\r\n')
+    assert decoder.feed(b'one\r') == []
+    assert decoder.feed(b'\ntwo\r\n') == [b'one', b'two']
+
+def test_oversized_complete_frame():
+    with pytest.raises(FrameError):
+        FrameDecoder(max_frame_size=8).feed(b'x' * 9 + b'\n')
+
+def test_oversized_partial_frame():
+    # A peer that never sends the delimiter must not grow the buffer forever
+    decoder = FrameDecoder(max_frame_size=8)
+    assert decoder.feed(b'xxxx') == []
+    assert decoder.feed(b'xxxx') == []
+    with pytest.raises(FrameError):
+        decoder.feed(b'x')
+
+def test_partial_frame_after_complete_ones():
+    # Only the unterminated tail counts against the limit
+    decoder = FrameDecoder(max_frame_size=8)
+    assert decoder.feed(b'12345678\n1234') == [b'12345678']
+    with pytest.raises(FrameError):
+        decoder.feed(b'56789')
+
+def test_pack_board_round_trip():
+    rng = random.Random(1)
+    for _ in range(20):
+        board = random_board(rng)
+        assert unpack_board(pack_board(board), COLUMNS) == board
+        assert decode_board(encode_board(board), COLUMNS) == board
+    assert len(pack_board(board)) == ROWS * COLUMNS // 2
+
+def test_pack_board_odd_cell_count():
+    board = [['red', 0, 'cyan']]
+    assert unpack_board(pack_board(board), 3) == board
+
+def test_pack_board_unknown_color():
+    board = [[0] * COLUMNS for _ in range(ROWS)]
+    board[0][0] = 'magenta'
+    assert unpack_board(pack_board(board), COLUMNS)[0][0] == 'gray'
+
+def test_choose_board_encoding():
+    assert choose_board_encoding(['zstd', BOARD_ENCODING_PACKED]) == BOARD_ENCODING_PACKED
+    assert choose_board_encoding([]) is None
+
+def test_board_changes_round_trip():
+    rng = random.Random(2)
+    old = random_board(rng)
+    for _ in range(20):
+        new = [row[:] for row in old]
+        for _ in range(rng.randrange(8)):
+            new[rng.randrange(ROWS)][rng.randrange(COLUMNS)] = rng.choice(PALETTE)
+        changes = board_changes(old, new)
+        board = [row[:] for row in old]
+        apply_board_changes(board, changes)
+        assert board == new
+        old = new
+
+def test_board_changes_empty_when_equal():
+    board = random_board(random.Random(3))
+    assert board_changes(board, [row[:] for row in board]) == []
+
+def test_board_changes_cleared_cell():
+    old = [[0] * COLUMNS for _ in range(ROWS)]
+    old[19][3] = 'red'
+    new = [[0] * COLUMNS for _ in range(ROWS)]
+    assert board_changes(old, new) == [19 * COLUMNS + 3, 0]
+
+def test_board_changes_line_clear():
+    # A cleared line shifts every row above it: all of them show up as changes
+    rng = random.Random(4)
+    old = random_board(rng, density=0.7)
+    old[ROWS - 1] = ['red'] * COLUMNS
+    new = [[0] * COLUMNS] + [row[:] for row in old[:ROWS - 1]]
+    board = [row[:] for row in old]
+    apply_board_changes(board, board_changes(old, new))
+    assert board == new
@@ -0,0 +1,82 @@
+from t_registry import Player, PlayerRegistry
+
+
+def make_player(name):
+    return Player(object(), ('127.0.0.1', 0), name)
+
+def test_add_and_lookup():
+    registry = PlayerRegistry()
+    alice, bob = make_player('alice'), make_player('bob')
+    registry.add(alice)
+    registry.add(bob)
+    assert len(registry) == 2
+    assert alice in registry
+    assert registry.get(alice.conn) is alice
+    assert registry.find('bob') is bob
+    assert registry.get(object()) is None
+    assert registry.find('carol') is None
+    assert list(registry) == [alice, bob]
+
+def test_remove():
+    registry = PlayerRegistry()
+    alice = make_player('alice')
+    registry.add(alice)
+    assert registry.remove(alice)
+    assert not registry.remove(alice)
+    assert alice not in registry
+    assert len(registry) == 0
+    assert registry.find('alice') is None
+    assert registry.in_lobby() == []
+
+def test_iteration_survives_removal():
+    registry = PlayerRegistry()
+    players = [make_player(f'p{i}') for i in range(4)]
+    for player in players:
+        registry.add(player)
+    for player in registry:
+        registry.remove(player)
+    assert len(registry) == 0
+
+def test_reused_username_keeps_latest_connection():
+    registry = PlayerRegistry()
+    old, new = make_player('alice'), make_player('alice')
+    registry.add(old)
+    registry.add(new)
+    assert registry.find('alice') is new
+    # Dropping the stale connection must not forget the live one
+    assert registry.remove(old)
+    assert registry.find('alice') is new
+    assert new in registry
+
+def test_unregistered_player_with_same_connection():
+    registry = PlayerRegistry()
+    alice = make_player('alice')
+    registry.add(alice)
+    impostor = Player(alice.conn, alice.addr, 'alice')
+    assert impostor not in registry
+    assert not registry.remove(impostor)
+    assert registry.get(alice.conn) is alice
+
+def test_relocate_tracks_the_lobby():
+    registry = PlayerRegistry()
+    alice, bob, carol = make_player('alice'), make_player('bob'), make_player('carol')
+    for player in (alice, bob, carol):
+        registry.add(player)
+    assert registry.in_lobby() == [alice, bob, carol]
+    alice.lobby_version = 3
+    alice.room = 1
+    carol.spectating = 1
+    registry.relocate(alice)
+    registry.relocate(carol)
+    assert registry.in_lobby() == [bob]
+    # Leaving the lobby invalidates the version the client has seen
+    assert alice.lobby_version is None
+    alice.room = None
+    registry.relocate(alice)
+    assert registry.in_lobby() == [bob, alice]
+
+def test_relocate_ignores_unregistered_players():
+    registry = PlayerRegistry()
+    alice = make_player('alice')
+    registry.relocate(alice)
+    assert registry.in_lobby() == []
@@ -0,0 +1,54 @@
+import pytest
+
+from t_replay import (FILE_HEADER, REC_END, REC_KEYFRAME, REC_SCORE, Replay, ReplayRecorder,
+                      read_replay)
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = tmp_path / 'game.trpl'
+    recorder = ReplayRecorder(str(path), ['alice', 'bob'], meta={'room': 3})
+    recorder.board('alice', {'board': [[0] * 10 for _ in range(20)]})
+    recorder.score('bob', 120)
+    recorder.end('bob')
+    return path
+
+def test_round_trip(recording):
+    meta, records = read_replay(str(recording))
+    assert meta['players'] == ['alice', 'bob']
+    assert meta['room'] == 3
+    assert [(kind, player) for kind, player, _, _ in records][0] == (REC_KEYFRAME, 0)
+    assert (REC_SCORE, 1) in [(kind, player) for kind, player, _, _ in records]
+    assert records[-1][:2] == (REC_END, 1)
+
+def test_header_flushed_on_open(tmp_path):
+    path = tmp_path / 'live.trpl'
+    recorder = ReplayRecorder(str(path), ['alice', 'bob'])
+    meta, records = read_replay(str(path))
+    assert meta['players'] == ['alice', 'bob']
+    assert records == []
+    recorder.close()
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.trpl'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError):
+        read_replay(str(path))
+
+def test_not_a_replay(tmp_path):
+    path = tmp_path / 'other.trpl'
+    path.write_bytes(b'PK\x03\x04' + bytes(16))
+    with pytest.raises(ValueError):
+        read_replay(str(path))
+
+@pytest.mark.parametrize('cut', [FILE_HEADER.size - 1, FILE_HEADER.size + 2, -1, -3])
+def test_truncated(recording, cut):
+    data = recording.read_bytes()
+    recording.write_bytes(data[:cut])
+    with pytest.raises(ValueError):
+        read_replay(str(recording))
+
+def test_replay_state(recording):
+    replay = Replay(str(recording))
+    assert replay.players == ['alice', 'bob']
+    assert replay.final is not None
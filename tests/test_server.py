@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+import t_server
+from t_leaderboard import Leaderboard
+from t_matchmaking import Matchmaker
+from t_registry import PlayerRegistry
+
+
+class FakeConn:
+    """Stands in for a client connection; keeps every frame sent to it"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send(self, data, droppable=False):
+        self.sent.append(data)
+
+    def close(self):
+        self.closed = True
+
+    def messages(self, kind=None):
+        decoded = [json.loads(frame) for data in self.sent for frame in data.split(b'\n') if frame]
+        return [m for m in decoded if kind is None or m['type'] == kind]
+
+@pytest.fixture
+def server(monkeypatch):
+    """The server module with fresh shared state and no disk output"""
+    monkeypatch.setattr(t_server, 'registry', PlayerRegistry())
+    monkeypatch.setattr(t_server, 'ready_status', {})
+    monkeypatch.setattr(t_server, 'rooms', {})
+    monkeypatch.setattr(t_server, 'sessions', {})
+    monkeypatch.setattr(t_server, 'matchmaker', Matchmaker())
+    monkeypatch.setattr(t_server, 'REPLAY_DIR', '')
+    monkeypatch.setattr(t_server, 'leaderboard', None)
+    monkeypatch.setattr(t_server, 'lobby_dirty', False)
+    monkeypatch.setattr(t_server, 'lobby_view', {})
+    monkeypatch.setattr(t_server, 'lobby_version', 0)
+    return t_server
+
+def join(server, username):
+    return server.register_client(FakeConn(), ('127.0.0.1', 0), username)
+
+def start_match(server, first, second):
+    a, b = join(server, first), join(server, second)
+    server.handle_message(a, {'type': 'ready', 'ready': True})
+    server.handle_message(b, {'type': 'ready', 'ready': True})
+    assert a.room is not None and a.room is b.room
+    return a, b
+
+def test_lose_records_reported_scores_only(server, monkeypatch):
+    lb = Leaderboard(':memory:')
+    monkeypatch.setattr(server, 'leaderboard', lb)
+    alice, bob = start_match(server, 'alice', 'bob')
+    server.handle_message(bob, {'type': 'score', 'value': 700})
+    # alice never sent a score: no 0-score row for her
+    server.handle_message(alice, {'type': 'lose'})
+    lb.close()
+    assert lb.rank('bob') == (1, 700)
+    assert lb.rank('alice') == (None, None)
+    assert alice.conn.messages('game_over')[0]['result'] == 'lose'
+    assert bob.conn.messages('game_over')[0]['result'] == 'win'
+
+def lobby_names(frames):
+    return [entry['name'] for message in frames for entry in message['players']]
+
+def test_lobby_snapshot_then_diffs(server):
+    alice, bob = join(server, 'alice'), join(server, 'bob')
+    server.flush_lobby()
+    [snapshot] = alice.conn.messages('lobby')
+    assert snapshot['version'] == 1
+    assert lobby_names([snapshot]) == ['alice', 'bob']
+    assert bob.conn.messages('lobby') == [snapshot]
+    # Nothing changed: no traffic
+    sent = len(alice.conn.sent)
+    server.flush_lobby()
+    assert len(alice.conn.sent) == sent
+    carol = join(server, 'carol')
+    server.handle_message(bob, {'type': 'ready', 'ready': True})
+    server.flush_lobby()
+    # Both changes since version 1 go out as one diff; the newcomer gets a snapshot
+    [diff] = alice.conn.messages('lobby_diff')
+    assert diff['version'] == 2
+    assert sorted(entry['name'] for entry in diff['players']) == ['bob', 'carol']
+    assert diff['removed'] == []
+    assert bob.conn.messages('lobby_diff') == [diff]
+    assert carol.conn.messages('lobby_diff') == []
+    [snapshot] = carol.conn.messages('lobby')
+    assert snapshot['version'] == 2
+    assert lobby_names([snapshot]) == ['alice', 'carol', 'bob']  # Not ready first
+
+def test_lobby_diff_lists_removed_players(server):
+    alice, bob = join(server, 'alice'), join(server, 'bob')
+    server.flush_lobby()
+    server.remove_client(bob)
+    server.flush_lobby()
+    [diff] = alice.conn.messages('lobby_diff')
+    assert diff == {'type': 'lobby_diff', 'version': 2, 'players': [], 'removed': ['bob']}
+
+def test_stale_client_gets_a_snapshot(server):
+    alice, bob = join(server, 'alice'), join(server, 'bob')
+    server.flush_lobby()
+    bob.lobby_version = None  # e.g. back from a room
+    server.handle_message(alice, {'type': 'ready', 'ready': True})
+    server.flush_lobby()
+    assert len(alice.conn.messages('lobby_diff')) == 1
+    assert bob.conn.messages('lobby_diff') == []
+    assert [message['version'] for message in bob.conn.messages('lobby')] == [1, 2]
+
+def test_lobby_snapshot_pages(server, monkeypatch):
+    monkeypatch.setattr(server, 'LOBBY_PAGE_SIZE', 2)
+    clients = [join(server, f'p{i}') for i in range(5)]
+    server.flush_lobby()
+    pages = clients[0].conn.messages('lobby')
+    assert [(message['page'], message['pages'], message['total']) for message in pages] == \
+        [(0, 3, 5), (1, 3, 5), (2, 3, 5)]
+    assert [len(message['players']) for message in pages] == [2, 2, 1]
+    assert lobby_names(pages) == [f'p{i}' for i in range(5)]
+    # One page on request, clamped to the last one
+    server.handle_message(clients[0], {'type': 'request_lobby', 'page': 9})
+    [last] = clients[0].conn.messages('lobby')[3:]
+    assert last['page'] == 2
+    assert lobby_names([last]) == ['p4']